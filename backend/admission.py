@@ -0,0 +1,253 @@
+"""Per-provider admission control for outbound LLM calls.
+
+Each call is admitted against every lane that applies to it: the provider lane
+(e.g. `openrouter`) and the model lane (e.g. `openrouter/deepseek/...`). A lane
+can cap concurrency and hold two token buckets, one priced in requests and one
+priced in estimated input tokens. Callers wait in a bounded queue up to a
+deadline; when the queue is full or the deadline passes they get
+`AdmissionRejected` with a retry-after hint instead of piling onto the provider.
+
+Waiters are served first-in first-out per lane, and a new call only takes
+capacity when nobody is queued in its lanes. Otherwise small, cheap calls
+could keep taking refilled tokens ahead of a large queued call until it
+timed out. The queue bound applies per provider, so one saturated provider
+does not turn away calls to the others.
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, now: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.tokens = self.capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        # Costs above capacity are clamped so an oversized request is slow, not impossible.
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float) -> None:
+        self.tokens -= min(cost, self.capacity)
+
+
+class Lane:
+    def __init__(self, name: str, limits: Dict, now: float) -> None:
+        self.name = name
+        self.concurrency = limits.get("concurrency")
+        self.request_bucket = (
+            TokenBucket(limits["requests_per_minute"], now) if limits.get("requests_per_minute") else None
+        )
+        self.token_bucket = TokenBucket(limits["tokens_per_minute"], now) if limits.get("tokens_per_minute") else None
+        self.in_flight = 0
+        self.queue: Deque["Ticket"] = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self.queue)
+
+    def wait_time(self, estimated_tokens: int, now: float) -> Optional[float]:
+        """0 when admissible now, seconds until a bucket refills, or None if blocked on concurrency."""
+        if self.concurrency is not None and self.in_flight >= self.concurrency:
+            return None
+        wait = 0.0
+        if self.request_bucket is not None:
+            self.request_bucket.refill(now)
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket is not None:
+            self.token_bucket.refill(now)
+            wait = max(wait, self.token_bucket.wait_time(estimated_tokens))
+        return wait
+
+    def take(self, estimated_tokens: int) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        if self.request_bucket is not None:
+            self.request_bucket.take(1)
+        if self.token_bucket is not None:
+            self.token_bucket.take(estimated_tokens)
+
+    def snapshot(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "concurrency_limit": self.concurrency,
+            "request_tokens_available": (
+                round(self.request_bucket.tokens, 2) if self.request_bucket is not None else None
+            ),
+            "input_tokens_available": round(self.token_bucket.tokens) if self.token_bucket is not None else None,
+        }
+
+
+class Ticket:
+    def __init__(self, lanes: List[Lane]) -> None:
+        self.lanes = lanes
+
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, Dict], max_queue: int, max_wait_seconds: float) -> None:
+        self._limits = {key.lower(): value for key, value in limits.items()}
+        self._max_queue = max_queue
+        self._max_wait_seconds = max_wait_seconds
+        self._lanes: Dict[str, Lane] = {}
+        self._cond = threading.Condition()
+        self._waiting_total = 0
+
+    def _lanes_for(self, provider: str, model: str) -> List[Lane]:
+        """The provider lane followed by the model lane."""
+        now = time.monotonic()
+        lanes: List[Lane] = []
+        for name in (provider.lower(), f"{provider}/{model}".lower()):
+            lane = self._lanes.get(name)
+            if lane is None:
+                lane = Lane(name, self._limits.get(name, {}), now)
+                self._lanes[name] = lane
+            lanes.append(lane)
+        return lanes
+
+    def _try_take(self, lanes: List[Lane], estimated_tokens: int, ticket: Optional[Ticket] = None) -> Optional[float]:
+        """Take capacity for `ticket` (None for a new call) if it is next in every lane."""
+        if any(lane.queue and lane.queue[0] is not ticket for lane in lanes):
+            return None
+        now = time.monotonic()
+        waits = [lane.wait_time(estimated_tokens, now) for lane in lanes]
+        if any(wait is None for wait in waits):
+            return None
+        longest = max(waits)
+        if longest > 0:
+            return longest
+        for lane in lanes:
+            lane.take(estimated_tokens)
+        return 0.0
+
+    def _enqueue(self, lanes: List[Lane], estimated_tokens: int) -> Ticket:
+        if lanes[0].waiting >= self._max_queue:
+            for lane in lanes:
+                lane.rejected += 1
+            raise AdmissionRejected(
+                "Provider queue is full, retry later.",
+                self._retry_hint(lanes, estimated_tokens),
+            )
+        ticket = Ticket(lanes)
+        self._waiting_total += 1
+        for lane in lanes:
+            lane.queue.append(ticket)
+        return ticket
+
+    def _dequeue(self, ticket: Ticket) -> None:
+        self._waiting_total -= 1
+        for lane in ticket.lanes:
+            lane.queue.remove(ticket)
+        # The next waiter in these lanes may be able to go now.
+        self._cond.notify_all()
+
+    def _timed_out(self, lanes: List[Lane], estimated_tokens: int) -> AdmissionRejected:
+        for lane in lanes:
+            lane.rejected += 1
+        return AdmissionRejected(
+            "Timed out waiting for provider capacity.",
+            self._retry_hint(lanes, estimated_tokens),
+        )
+
+    def _retry_hint(self, lanes: List[Lane], estimated_tokens: int) -> float:
+        hints = [1.0]
+        now = time.monotonic()
+        for lane in lanes:
+            wait = lane.wait_time(estimated_tokens, now)
+            if wait:
+                hints.append(wait)
+        return max(hints)
+
+    def acquire(self, provider: str, model: str, estimated_tokens: int, timeout: Optional[float] = None) -> Ticket:
+        deadline = time.monotonic() + (self._max_wait_seconds if timeout is None else timeout)
+        with self._cond:
+            lanes = self._lanes_for(provider, model)
+            if self._try_take(lanes, estimated_tokens) == 0:
+                return Ticket(lanes)
+            ticket = self._enqueue(lanes, estimated_tokens)
+            try:
+                while True:
+                    wait = self._try_take(lanes, estimated_tokens, ticket)
+                    if wait == 0:
+                        return ticket
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(lanes, estimated_tokens)
+                    self._cond.wait(remaining if wait is None else min(remaining, wait))
+            finally:
+                self._dequeue(ticket)
+
+    async def acquire_async(
+        self,
+        provider: str,
+        model: str,
+        estimated_tokens: int,
+        timeout: Optional[float] = None,
+    ) -> Ticket:
+        deadline = time.monotonic() + (self._max_wait_seconds if timeout is None else timeout)
+        with self._cond:
+            lanes = self._lanes_for(provider, model)
+            if self._try_take(lanes, estimated_tokens) == 0:
+                return Ticket(lanes)
+            ticket = self._enqueue(lanes, estimated_tokens)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(lanes, estimated_tokens, ticket)
+                    if wait == 0:
+                        return ticket
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(lanes, estimated_tokens)
+                # The event loop cannot block on the condition, so poll briefly instead.
+                await asyncio.sleep(min(remaining, 0.05 if wait is None else wait, 0.25))
+        finally:
+            with self._cond:
+                self._dequeue(ticket)
+
+    def release(self, ticket: Ticket) -> None:
+        with self._cond:
+            for lane in ticket.lanes:
+                lane.in_flight -= 1
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                "queue_depth": self._waiting_total,
+                "max_provider_queue_depth": max(
+                    (lane.waiting for name, lane in self._lanes.items() if "/" not in name),
+                    default=0,
+                ),
+                "max_queue": self._max_queue,
+                "lanes": {name: lane.snapshot() for name, lane in sorted(self._lanes.items())},
+            }
+
+
+def estimate_input_tokens(payload: Dict) -> int:
+    # Roughly four characters per token; good enough for pricing admission.
+    return max(1, len(json.dumps(payload, ensure_ascii=False)) // 4)
@@ -1,25 +1,70 @@
 """Backend API for generating MCQ questions from local notes files."""
 
 import base64
+import contextvars
+import hashlib
 import io
 import json
+import math
 import os
+import queue
+import re
+import secrets
 import sqlite3
+import threading
+import time
 import warnings
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 from PyPDF2 import PdfReader
 from PyPDF2.errors import PdfReadWarning
 from pdfminer.high_level import extract_text as pdfminer_extract_text
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+from admission import AdmissionController, AdmissionRejected, estimate_input_tokens
+from bank_transfer import decode_ndjson, encode_ndjson, require_compression
+from deadlines import (
+    Deadline,
+    DeadlineExceeded,
+    RequestCancelled,
+    call_timeout,
+    check_deadline,
+    current_deadline,
+    reset_current_deadline,
+    set_current_deadline,
+)
+from hedging import HedgeExecutor, LatencyTracker, run_hedged
+import serialization
+from profiling import RequestProfiler, annotate, configure_slow_request_log, stage
+from provider_files import OpenAIFileClient, ProviderFileClient
+from readiness import InFlightGauge, TimedWindow, error_rate, failing_checks, percentile
+from serialization import FastJSONProvider
+from sharding import (
+    DATA_EPOCH_SCOPE,
+    TENANT_HEADER,
+    HandleLRU,
+    current_tenant,
+    list_shard_tenants,
+    normalize_tenant_id,
+    reset_current_tenant,
+    set_current_tenant,
+    tenant_context,
+    tenant_db_path,
+)
+from singleflight import SingleFlight
+from usage import UsageRecorder, current_usage_source, estimate_cost, parse_provider_usage, usage_source
+
 
 OPENAI_URL = "https://api.openai.com/v1/responses"
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENAI_FILES_URL = "https://api.openai.com/v1/files"
 DEFAULT_MODEL = "gpt-5.2"
 DEFAULT_OPENROUTER_MODEL = "deepseek/deepseek-r1-0528:free"
 DEFAULT_NOTES_DIR = Path(__file__).resolve().parent.parent / "notes"
@@ -27,25 +72,405 @@ SUPPORTED_SUFFIXES = {".txt", ".pdf"}
 DB_PATH = Path(__file__).resolve().parent / "study_data.db"
 MORE_QUESTIONS_BATCH = 10
 MAX_QUESTIONS_PER_SOURCE = 50
+MAX_ANSWER_BATCH = 500
+BANK_IMPORT_BATCH_SIZE = 1000
+GENERATION_TOPUP_ATTEMPTS = int(os.environ.get("GENERATION_TOPUP_ATTEMPTS", "1"))
+# Header/footer detection looks at this many non-empty lines at each page edge.
+NORMALIZE_EDGE_LINES = 3
+NORMALIZE_REPEAT_RATIO = 0.5
+DOCUMENT_STATS_CACHE_SIZE = 256
+# Rough prompt size of one PDF page, used to weigh PDFs against text notes.
+PDF_PAGE_TOKEN_ESTIMATE = 500
+# Per-file notes generation packs files smaller than this (estimated tokens) into one call.
+NOTES_GROUP_TOKENS = int(os.environ.get("NOTES_GROUP_TOKENS", "2000"))
+NOTES_PARALLEL_WORKERS = int(os.environ.get("NOTES_PARALLEL_WORKERS", "4"))
+MAX_UPLOAD_BATCH_FILES = int(os.environ.get("MAX_UPLOAD_BATCH_FILES", "20"))
+UPLOAD_BATCH_WORKERS = int(os.environ.get("UPLOAD_BATCH_WORKERS", "4"))
+# The PDF pre-classifier inspects at most this many evenly spaced pages.
+PDF_CLASSIFY_SAMPLE_PAGES = 5
+# Reservations older than this belong to a crashed request and no longer count toward the cap.
+RESERVATION_TTL_SECONDS = 900
+REVIEW_DEFAULT_EASE = 2.5
+REVIEW_MIN_EASE = 1.3
+REVIEW_QUALITY_CORRECT = 4
+REVIEW_QUALITY_WRONG = 1
+GLOBAL_VERSION_SCOPE = "global"
+# Lanes are keyed by provider ("openai", "openrouter") or "provider/model".
+DEFAULT_PROVIDER_LIMITS = {
+    "openai": {"concurrency": 16},
+    "openrouter": {"concurrency": 4, "requests_per_minute": 20},
+}
 
 # Load env vars from project .env and user home .env if present.
 load_dotenv(Path(__file__).resolve().parent / ".env")
 load_dotenv(Path.home() / ".env")
 load_dotenv(Path.home() / "Desktop" / ".env")
 
+DB_BUSY_TIMEOUT_SECONDS = float(os.environ.get("DB_BUSY_TIMEOUT_SECONDS", "30"))
+DB_WRITE_QUEUE_SIZE = int(os.environ.get("DB_WRITE_QUEUE_SIZE", "1000"))
+DB_WRITE_BATCH_MAX = int(os.environ.get("DB_WRITE_BATCH_MAX", "64"))
+DB_WRITE_ENQUEUE_TIMEOUT_SECONDS = float(os.environ.get("DB_WRITE_ENQUEUE_TIMEOUT_SECONDS", "10"))
+# When set, each tenant (X-Tenant-ID header) gets its own database file in this directory.
+DB_SHARD_DIR = os.environ.get("DB_SHARD_DIR", "").strip()
+DB_MAX_OPEN_SHARDS = int(os.environ.get("DB_MAX_OPEN_SHARDS", "64"))
+PROVIDER_LIMITS = json.loads(os.environ["PROVIDER_LIMITS"]) if os.environ.get("PROVIDER_LIMITS") else DEFAULT_PROVIDER_LIMITS
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "30"))
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").strip().lower() == "true"
+# Maps a primary model to its backup, e.g. {"gpt-5.2": {"model_tier": "pro", "model": "gpt-5-mini"}}.
+HEDGE_BACKUPS = json.loads(os.environ["HEDGE_BACKUPS"]) if os.environ.get("HEDGE_BACKUPS") else {}
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.environ.get("HEDGE_DEFAULT_DELAY_SECONDS", "60"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+# Overall time a generation request may take, from extraction to the final write.
+GENERATION_BUDGET_SECONDS = float(os.environ.get("GENERATION_BUDGET_SECONDS", "300"))
+# Upper bound for a single provider call; the remaining budget usually cuts it shorter.
+PROVIDER_TIMEOUT_SECONDS = float(os.environ.get("PROVIDER_TIMEOUT_SECONDS", str(GENERATION_BUDGET_SECONDS)))
+PROVIDER_FILE_UPLOADS = os.environ.get("PROVIDER_FILE_UPLOADS", "false").strip().lower() == "true"
+PROVIDER_FILE_TTL_SECONDS = int(os.environ.get("PROVIDER_FILE_TTL_SECONDS", "86400"))
+PROVIDER_FILES_LANE = "files"
+MAINTENANCE_ENABLED = os.environ.get("MAINTENANCE_ENABLED", "true").strip().lower() == "true"
+MAINTENANCE_INTERVAL_SECONDS = float(os.environ.get("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+# Sources touched more recently than this are never collected, so an upload in progress is safe.
+MAINTENANCE_ORPHAN_GRACE_SECONDS = int(os.environ.get("MAINTENANCE_ORPHAN_GRACE_SECONDS", "3600"))
+MAINTENANCE_DELETE_BATCH = int(os.environ.get("MAINTENANCE_DELETE_BATCH", "50"))
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get("MAINTENANCE_VACUUM_PAGES", "256"))
+MAINTENANCE_VACUUM_MAX_STEPS = int(os.environ.get("MAINTENANCE_VACUUM_MAX_STEPS", "200"))
+MAINTENANCE_STEP_PAUSE_SECONDS = float(os.environ.get("MAINTENANCE_STEP_PAUSE_SECONDS", "0.05"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "").strip()
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "cprofile").strip().lower()
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_SECONDS", "0.005"))
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_LOG = os.environ.get("SLOW_REQUEST_LOG", "").strip()
+USAGE_BATCH_SIZE = int(os.environ.get("USAGE_BATCH_SIZE", "100"))
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("USAGE_FLUSH_INTERVAL_SECONDS", "5"))
+USAGE_RETENTION_DAYS = int(os.environ.get("USAGE_RETENTION_DAYS", "0"))
+# USD per million tokens, e.g. {"gpt-5.2": {"input": 1.25, "cached_input": 0.125, "output": 10}}.
+MODEL_PRICING = json.loads(os.environ["MODEL_PRICING"]) if os.environ.get("MODEL_PRICING") else {}
+USAGE_BUCKETS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "month": "%Y-%m"}
+USAGE_GROUP_COLUMNS = ("source_file", "model", "model_tier", "provider", "status")
+# Readiness limits; 0 disables a check. Latency and error rates cover the last READY_WINDOW_SECONDS.
+READY_WINDOW_SECONDS = float(os.environ.get("READY_WINDOW_SECONDS", "60"))
+READY_MAX_IN_FLIGHT = int(os.environ.get("READY_MAX_IN_FLIGHT", "64"))
+READY_MAX_ADMISSION_QUEUE = int(os.environ.get("READY_MAX_ADMISSION_QUEUE", str(ADMISSION_MAX_QUEUE * 3 // 4)))
+READY_MAX_DB_WRITE_QUEUE = int(os.environ.get("READY_MAX_DB_WRITE_QUEUE", str(DB_WRITE_QUEUE_SIZE // 2)))
+READY_MAX_DB_WRITE_P95_MS = float(os.environ.get("READY_MAX_DB_WRITE_P95_MS", "2000"))
+READY_MAX_PROVIDER_ERROR_RATE = float(os.environ.get("READY_MAX_PROVIDER_ERROR_RATE", "0.5"))
+READY_MIN_PROVIDER_CALLS = int(os.environ.get("READY_MIN_PROVIDER_CALLS", "10"))
+PROFILE_HEADER = "X-Profile"
+# Endpoints the profiler and slow-request log cover: uploads, "more" and the listings.
+PROFILED_ENDPOINTS = {
+    "questions_upload",
+    "more_questions",
+    "wrong_answers",
+    "review_next",
+    "error_collections",
+    "favorite_collections",
+    "generated_questions",
+    "bootstrap",
+}
+# Endpoints that run under a GENERATION_BUDGET_SECONDS deadline and count as in-flight generations.
+GENERATION_ENDPOINTS = {"questions", "questions_upload", "questions_upload_batch", "more_questions"}
+
 app = Flask(__name__)
+app.json_provider_class = FastJSONProvider
+app.json = FastJSONProvider(app)
 CORS(app)
 
-
-def get_db_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+admission = AdmissionController(PROVIDER_LIMITS, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS)
+generation_flights = SingleFlight()
+provider_latency = LatencyTracker(min_samples=HEDGE_MIN_SAMPLES)
+hedge_executor = HedgeExecutor(max_workers=32, thread_name_prefix="hedge")
+notes_executor = ThreadPoolExecutor(max_workers=NOTES_PARALLEL_WORKERS, thread_name_prefix="notes")
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_BATCH_WORKERS, thread_name_prefix="upload")
+provider_file_client: ProviderFileClient = OpenAIFileClient(lambda: get_openai_api_key(), OPENAI_FILES_URL)
+file_upload_flights = SingleFlight()
+request_profiler = RequestProfiler(
+    profile_dir=PROFILE_DIR,
+    mode=PROFILE_MODE,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    trigger_header=PROFILE_HEADER,
+    trigger_token=PROFILE_TOKEN,
+    max_files=PROFILE_MAX_FILES,
+    sample_interval=PROFILE_SAMPLE_INTERVAL_SECONDS,
+    slow_ms=SLOW_REQUEST_MS,
+)
+if SLOW_REQUEST_LOG:
+    configure_slow_request_log(SLOW_REQUEST_LOG)
+generations_in_flight = InFlightGauge()
+db_write_latency_ms = TimedWindow(READY_WINDOW_SECONDS)
+# 1.0 per failed provider call, 0.0 per successful one.
+provider_outcomes = TimedWindow(READY_WINDOW_SECONDS)
+
+_metric_lock = threading.Lock()
+metric_counters: Dict[str, int] = {}
+
+
+def increment_metric(name: str, amount: int = 1) -> None:
+    with _metric_lock:
+        metric_counters[name] = metric_counters.get(name, 0) + amount
+
+
+def metric_snapshot() -> Dict[str, int]:
+    with _metric_lock:
+        return dict(metric_counters)
+
+
+class SourceCapReached(Exception):
+    def __init__(self, source_file: str, current_total: int) -> None:
+        super().__init__(f"Maximum {MAX_QUESTIONS_PER_SOURCE} questions reached for '{source_file}'.")
+        self.source_file = source_file
+        self.current_total = current_total
+
+
+_initialized_shards: set = set()
+_shard_init_lock = threading.Lock()
+
+
+def current_db_path() -> Path:
+    """Database file for the tenant in the current context (DB_PATH unless sharding is on)."""
+    if not DB_SHARD_DIR:
+        return DB_PATH
+    path = tenant_db_path(Path(DB_SHARD_DIR), current_tenant())
+    if path not in _initialized_shards:
+        with _shard_init_lock:
+            if path not in _initialized_shards:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                init_db(path)
+                _initialized_shards.add(path)
+    return path
+
+
+def get_db_connection(path: Optional[Path] = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or current_db_path(), timeout=DB_BUSY_TIMEOUT_SECONDS)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
     return conn
 
 
-def init_db() -> None:
+class WriterClosed(Exception):
+    pass
+
+
+class DatabaseWriter:
+    """Single writer thread that group-commits queued write jobs.
+
+    Each job is a callable taking the writer's connection. Jobs are drained from
+    a bounded queue and applied inside one `BEGIN IMMEDIATE` transaction per
+    batch, each under its own savepoint so a failing job does not roll back the
+    others. `BEGIN IMMEDIATE` plus busy_timeout coordinates with writers in
+    other worker processes; readers keep using WAL snapshots.
+    """
+
+    def __init__(self, path: Path, queue_size: int, batch_max: int) -> None:
+        self._path = path
+        self._queue: "queue.Queue[Optional[Tuple[Callable[[sqlite3.Connection], object], Future]]]" = (
+            queue.Queue(maxsize=queue_size)
+        )
+        self._batch_max = max(1, batch_max)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "writes": 0,
+            "failed_writes": 0,
+            "batches": 0,
+            "max_batch_size": 0,
+            "last_commit_ms": 0.0,
+        }
+
+    def submit(self, job: Callable[[sqlite3.Connection], object]) -> Future:
+        future: Future = Future()
+        if threading.current_thread() is self._thread:
+            # Nested write from inside a job: run inline in the open transaction.
+            future.set_result(job(self._connection()))
+            return future
+        # Holding the start lock orders this job before a concurrent close()'s sentinel.
+        with self._start_lock:
+            if self._closed:
+                raise WriterClosed()
+            self._start_locked()
+            try:
+                self._queue.put((job, future), timeout=DB_WRITE_ENQUEUE_TIMEOUT_SECONDS)
+            except queue.Full:
+                raise RuntimeError("Database write queue is full.") from None
+        return future
+
+    def close(self) -> None:
+        """Stop after draining already queued jobs, then close the connection."""
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            result = dict(self._stats)
+        result["queue_depth"] = self._queue.qsize()
+        return result
+
+    def _start_locked(self) -> None:
+        if self._thread is None:
+            thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            thread.start()
+            self._thread = thread
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = get_db_connection(self._path)
+            self._conn.isolation_level = None
+        return self._conn
+
+    def _run(self) -> None:
+        _writer_state.writer = self
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self._batch_max:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = item is None
+            if batch:
+                self._execute(batch)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _execute(self, batch: List[Tuple[Callable[[sqlite3.Connection], object], Future]]) -> None:
+        outcomes: List[Tuple[Future, object, Optional[BaseException]]] = []
+        started = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for job, future in batch:
+                    conn.execute("SAVEPOINT write_job")
+                    try:
+                        result = job(conn)
+                    except Exception as exc:
+                        conn.execute("ROLLBACK TO write_job")
+                        conn.execute("RELEASE write_job")
+                        outcomes.append((future, None, exc))
+                        continue
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, result, None))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as exc:
+            outcomes = [(future, None, exc) for _job, future in batch]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["writes"] += len(batch)
+            self._stats["failed_writes"] += sum(1 for _f, _r, exc in outcomes if exc is not None)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+            self._stats["last_commit_ms"] = round(elapsed_ms, 3)
+
+        for future, result, exc in outcomes:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+
+_writer_state = threading.local()
+db_writers: HandleLRU[DatabaseWriter] = HandleLRU(DB_MAX_OPEN_SHARDS, lambda writer: writer.close())
+
+
+def writer_for(path: Path) -> DatabaseWriter:
+    return db_writers.get(str(path), lambda: DatabaseWriter(path, DB_WRITE_QUEUE_SIZE, DB_WRITE_BATCH_MAX))
+
+
+def run_write(job: Callable[[sqlite3.Connection], object]):
+    # A job that writes again runs inline on its own writer, whatever the caller's context.
+    active = getattr(_writer_state, "writer", None)
+    if active is not None:
+        return active.submit(job).result()
+    started = time.perf_counter()
+    try:
+        while True:
+            try:
+                return writer_for(current_db_path()).submit(job).result()
+            except WriterClosed:
+                continue  # Evicted between lookup and submit; the next lookup opens a fresh writer.
+    finally:
+        # Queue wait plus commit, failed writes included: what a request actually waits for.
+        db_write_latency_ms.record((time.perf_counter() - started) * 1000)
+
+
+def db_writer_stats() -> Dict:
+    """Writer stats summed over the open shard writers."""
+    totals = {"writes": 0, "failed_writes": 0, "batches": 0, "max_batch_size": 0, "queue_depth": 0}
+    for writer in db_writers.values():
+        stats = writer.stats()
+        for key in ("writes", "failed_writes", "batches", "queue_depth"):
+            totals[key] += stats[key]
+        totals["max_batch_size"] = max(totals["max_batch_size"], stats["max_batch_size"])
+    totals["shards"] = db_writers.snapshot()
+    return totals
+
+
+def source_version_scope(source_file: str) -> str:
+    return f"source:{source_file}"
+
+
+def bump_data_version(conn: sqlite3.Connection, source_file: str) -> None:
+    """Bump the global and per-source version counters inside a write transaction."""
+    for scope in (GLOBAL_VERSION_SCOPE, source_version_scope(source_file)):
+        conn.execute(
+            """
+            INSERT INTO data_versions (scope, version)
+            VALUES (?, 1)
+            ON CONFLICT(scope) DO UPDATE SET
+                version = version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (scope,),
+        )
+
+
+def get_data_version(scope: str) -> Tuple[int, Optional[str], int]:
+    """Version and update time of `scope`, plus the database's epoch salt."""
     conn = get_db_connection()
     try:
+        rows = {
+            row["scope"]: row
+            for row in conn.execute(
+                "SELECT scope, version, updated_at FROM data_versions WHERE scope IN (?, ?)",
+                (scope, DATA_EPOCH_SCOPE),
+            )
+        }
+        epoch = int(rows[DATA_EPOCH_SCOPE]["version"]) if DATA_EPOCH_SCOPE in rows else 0
+        row = rows.get(scope)
+        if row is None:
+            return 0, None, epoch
+        return int(row["version"]), row["updated_at"], epoch
+    finally:
+        conn.close()
+
+
+def init_db(path: Optional[Path] = None) -> None:
+    conn = get_db_connection(path)
+    try:
+        # Only takes effect on a new database; existing ones are converted by a full VACUUM.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS generated_questions (
@@ -87,31 +512,205 @@ def init_db() -> None:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 file_name TEXT NOT NULL UNIQUE,
                 file_data BLOB NOT NULL,
+                pdf_kind TEXT,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        source_columns = {row["name"] for row in conn.execute("PRAGMA table_info(uploaded_file_sources)")}
+        if "pdf_kind" not in source_columns:
+            conn.execute("ALTER TABLE uploaded_file_sources ADD COLUMN pdf_kind TEXT")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answer_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                session_id TEXT NOT NULL,
+                source_file TEXT,
+                question TEXT NOT NULL,
+                correct_index INTEGER NOT NULL,
+                selected_index INTEGER NOT NULL,
+                is_correct INTEGER NOT NULL,
+                model TEXT,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_events_session ON answer_events (session_id)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS review_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question_key TEXT NOT NULL UNIQUE,
+                source_file TEXT NOT NULL,
+                question TEXT NOT NULL,
+                options_json TEXT NOT NULL,
+                correct_index INTEGER NOT NULL,
+                ease REAL NOT NULL,
+                interval_days REAL NOT NULL DEFAULT 0,
+                repetitions INTEGER NOT NULL DEFAULT 0,
+                lapses INTEGER NOT NULL DEFAULT 0,
+                due_at TEXT NOT NULL,
+                last_reviewed_at TEXT,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_review_items_due ON review_items (due_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_review_items_source_due ON review_items (source_file, due_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generation_reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_file TEXT NOT NULL,
+                question_count INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_generation_reservations_source ON generation_reservations (source_file)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS provider_file_handles (
+                provider TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                expires_at TEXT NOT NULL,
                 created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (provider, content_hash)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS provider_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                source_file TEXT,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                model_tier TEXT NOT NULL,
+                status TEXT NOT NULL,
+                retry_count INTEGER NOT NULL DEFAULT 0,
+                hedge INTEGER NOT NULL DEFAULT 0,
+                requested_questions INTEGER NOT NULL DEFAULT 0,
+                validated_questions INTEGER NOT NULL DEFAULT 0,
+                estimated_input_tokens INTEGER NOT NULL DEFAULT 0,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                latency_ms REAL NOT NULL,
+                cost_usd REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_provider_usage_created ON provider_usage (created_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS data_versions (
+                scope TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
                 updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
             )
             """
         )
+        conn.execute(
+            "INSERT OR IGNORE INTO data_versions (scope, version) VALUES (?, ?)",
+            (DATA_EPOCH_SCOPE, secrets.randbits(31)),
+        )
         conn.commit()
     finally:
         conn.close()
 
 
-def store_generated_questions(source_files: List[str], model: str, questions: List[Dict]) -> None:
+def store_generated_questions(
+    source_files: List[str],
+    model: str,
+    questions: List[Dict],
+    reservation_id: Optional[int] = None,
+) -> None:
     source_file = source_files[0] if source_files else "unknown"
-    conn = get_db_connection()
-    try:
-        for question in questions:
-            conn.execute(
-                """
-                INSERT INTO generated_questions (source_file, model, question_json)
-                VALUES (?, ?, ?)
-                """,
-                (source_file, model, json.dumps(question, ensure_ascii=False)),
-            )
-        conn.commit()
-    finally:
-        conn.close()
+    # Questions generated for a request that timed out or was abandoned are not stored.
+    check_deadline("store")
+
+    def write(conn: sqlite3.Connection) -> None:
+        conn.executemany(
+            """
+            INSERT INTO generated_questions (source_file, model, question_json)
+            VALUES (?, ?, ?)
+            """,
+            [(source_file, model, serialization.dumps(question)) for question in questions],
+        )
+        if reservation_id is not None:
+            # Converting the reservation into rows in one transaction keeps the cap exact.
+            conn.execute("DELETE FROM generation_reservations WHERE id = ?", (reservation_id,))
+        bump_data_version(conn, source_file)
+
+    run_write(write)
+
+
+def store_attributed_questions(model: str, attributed: List[Tuple[str, Dict]]) -> None:
+    """Store (source_file, question) pairs from a multi-file generation in one transaction."""
+    check_deadline("store")
+
+    def write(conn: sqlite3.Connection) -> None:
+        conn.executemany(
+            """
+            INSERT INTO generated_questions (source_file, model, question_json)
+            VALUES (?, ?, ?)
+            """,
+            [(source_file, model, serialization.dumps(question)) for source_file, question in attributed],
+        )
+        for source_file in sorted({source_file for source_file, _ in attributed}):
+            bump_data_version(conn, source_file)
+
+    run_write(write)
+
+
+def reserve_generation_slots(source_file: str, requested: int, enforce_cap: bool = True) -> Tuple[int, int]:
+    """Atomically reserve question slots for a source before the slow provider call.
+
+    Stored questions plus live reservations count toward MAX_QUESTIONS_PER_SOURCE,
+    so concurrent requests cannot overshoot it. Returns (reservation_id, count).
+    """
+    now = datetime.now(timezone.utc)
+
+    def write(conn: sqlite3.Connection) -> Tuple[int, int]:
+        conn.execute(
+            "DELETE FROM generation_reservations WHERE created_at < ?",
+            (format_db_timestamp(now - timedelta(seconds=RESERVATION_TTL_SECONDS)),),
+        )
+        stored = conn.execute(
+            "SELECT COUNT(*) FROM generated_questions WHERE source_file = ?",
+            (source_file,),
+        ).fetchone()[0]
+        reserved = conn.execute(
+            "SELECT COALESCE(SUM(question_count), 0) FROM generation_reservations WHERE source_file = ?",
+            (source_file,),
+        ).fetchone()[0]
+        count = requested
+        if enforce_cap:
+            count = min(requested, MAX_QUESTIONS_PER_SOURCE - stored - reserved)
+            if count <= 0:
+                raise SourceCapReached(source_file, stored)
+        cur = conn.execute(
+            "INSERT INTO generation_reservations (source_file, question_count, created_at) VALUES (?, ?, ?)",
+            (source_file, count, format_db_timestamp(now)),
+        )
+        return cur.lastrowid, count
+
+    return run_write(write)
+
+
+def release_generation_reservation(reservation_id: int) -> None:
+    def write(conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM generation_reservations WHERE id = ?", (reservation_id,))
+
+    run_write(write)
 
 
 def store_wrong_answer(
@@ -123,30 +722,293 @@ def store_wrong_answer(
     selected_index: int,
     model: str,
 ) -> None:
-    conn = get_db_connection()
-    try:
+    def write(conn: sqlite3.Connection) -> None:
+        insert_wrong_answer(
+            conn,
+            source_file=source_file,
+            question=question,
+            options=options,
+            correct_index=correct_index,
+            selected_index=selected_index,
+            model=model,
+        )
+        record_review_result(
+            conn,
+            source_file=source_file,
+            question=question,
+            options=options,
+            correct_index=correct_index,
+            is_correct=False,
+        )
+        bump_data_version(conn, source_file)
+
+    run_write(write)
+
+
+def store_correct_answer(*, source_file: str, question: str, options: List[str], correct_index: int) -> None:
+    """Reschedule a question in the review queue after a correct answer; nothing is logged."""
+
+    def write(conn: sqlite3.Connection) -> None:
+        record_review_result(
+            conn,
+            source_file=source_file,
+            question=question,
+            options=options,
+            correct_index=correct_index,
+            is_correct=True,
+        )
+
+    run_write(write)
+
+
+def insert_wrong_answer(
+    conn: sqlite3.Connection,
+    *,
+    source_file: str,
+    question: str,
+    options: List[str],
+    correct_index: int,
+    selected_index: int,
+    model: str,
+) -> None:
+    conn.execute(
+        """
+        INSERT INTO wrong_answers
+        (source_file, question, options_json, correct_index, selected_index, model)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            source_file,
+            question,
+            serialization.dumps(options),
+            correct_index,
+            selected_index,
+            model,
+        ),
+    )
+
+
+def answer_idempotency_key(session_id: str, position: int, event: Dict, client_key: object = None) -> str:
+    # Client-supplied keys are scoped to the session; otherwise the key is derived
+    # from the event's position and content so a retried batch maps to the same rows.
+    if isinstance(client_key, str) and client_key.strip():
+        return f"{session_id}:{client_key.strip()}"
+    digest = hashlib.sha256(
+        json.dumps(
+            [session_id, position, event["source_file"], event["question"], event["selected_index"]],
+            ensure_ascii=False,
+        ).encode("utf-8")
+    ).hexdigest()
+    return f"{session_id}:{digest}"
+
+
+def format_db_timestamp(value: datetime) -> str:
+    # Same layout as SQLite CURRENT_TIMESTAMP so text comparison orders correctly.
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def review_question_key(source_file: str, question: str) -> str:
+    return hashlib.sha256(f"{source_file}\n{question}".encode("utf-8")).hexdigest()
+
+
+def sm2_schedule(ease: float, interval_days: float, repetitions: int, quality: int) -> Tuple[float, float, int]:
+    """Return the next (ease, interval_days, repetitions) after one SM-2 review."""
+    ease = ease + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    ease = max(REVIEW_MIN_EASE, ease)
+    if quality < 3:
+        # Lapse: relearn from scratch and keep the item due until answered correctly.
+        return ease, 0.0, 0
+    repetitions += 1
+    if repetitions == 1:
+        interval_days = 1.0
+    elif repetitions == 2:
+        interval_days = 6.0
+    else:
+        interval_days = round(interval_days * ease, 2)
+    return ease, interval_days, repetitions
+
+
+def record_review_result(
+    conn: sqlite3.Connection,
+    *,
+    source_file: str,
+    question: str,
+    options: List[str],
+    correct_index: int,
+    is_correct: bool,
+    now: Optional[datetime] = None,
+) -> None:
+    """Apply one answer to the review queue inside the caller's write transaction.
+
+    Wrong answers enrol a question (due immediately); later answers reschedule it
+    with SM-2. Correct answers for questions never missed are not tracked.
+    """
+    now = now or datetime.now(timezone.utc)
+    key = review_question_key(source_file, question)
+    row = conn.execute(
+        "SELECT id, ease, interval_days, repetitions FROM review_items WHERE question_key = ?",
+        (key,),
+    ).fetchone()
+    if row is None:
+        if is_correct:
+            return
         conn.execute(
             """
-            INSERT INTO wrong_answers
-            (source_file, question, options_json, correct_index, selected_index, model)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO review_items
+            (question_key, source_file, question, options_json, correct_index, ease, lapses, due_at, last_reviewed_at)
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
             """,
             (
+                key,
                 source_file,
                 question,
-                json.dumps(options),
+                serialization.dumps(options),
                 correct_index,
-                selected_index,
-                model,
+                REVIEW_DEFAULT_EASE,
+                format_db_timestamp(now),
+                format_db_timestamp(now),
             ),
         )
-        conn.commit()
+        return
+
+    quality = REVIEW_QUALITY_CORRECT if is_correct else REVIEW_QUALITY_WRONG
+    ease, interval_days, repetitions = sm2_schedule(
+        float(row["ease"]),
+        float(row["interval_days"]),
+        int(row["repetitions"]),
+        quality,
+    )
+    conn.execute(
+        """
+        UPDATE review_items
+        SET ease = ?, interval_days = ?, repetitions = ?, lapses = lapses + ?,
+            due_at = ?, last_reviewed_at = ?
+        WHERE id = ?
+        """,
+        (
+            ease,
+            interval_days,
+            repetitions,
+            0 if is_correct else 1,
+            format_db_timestamp(now + timedelta(days=interval_days)),
+            format_db_timestamp(now),
+            row["id"],
+        ),
+    )
+
+
+def list_due_review_items(limit: int = 20, source_file: str = "", now: Optional[datetime] = None) -> List[Dict]:
+    now = now or datetime.now(timezone.utc)
+    conn = get_db_connection()
+    try:
+        # Both queries are a range scan on a due_at index, so cost is O(log n + limit).
+        if source_file:
+            rows = conn.execute(
+                """
+                SELECT id, source_file, question, options_json, correct_index, ease, interval_days,
+                       repetitions, lapses, due_at
+                FROM review_items
+                WHERE source_file = ? AND due_at <= ?
+                ORDER BY due_at
+                LIMIT ?
+                """,
+                (source_file, format_db_timestamp(now), limit),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                """
+                SELECT id, source_file, question, options_json, correct_index, ease, interval_days,
+                       repetitions, lapses, due_at
+                FROM review_items
+                WHERE due_at <= ?
+                ORDER BY due_at
+                LIMIT ?
+                """,
+                (format_db_timestamp(now), limit),
+            ).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "source_file": row["source_file"],
+                "question": row["question"],
+                "options": serialization.loads(row["options_json"]) if row["options_json"] else [],
+                "correct_index": row["correct_index"],
+                "ease": row["ease"],
+                "interval_days": row["interval_days"],
+                "repetitions": row["repetitions"],
+                "lapses": row["lapses"],
+                "due_at": row["due_at"],
+            }
+            for row in rows
+        ]
     finally:
         conn.close()
 
 
-def list_wrong_answers(limit: int = 100) -> List[Dict]:
-    conn = get_db_connection()
+def store_answer_batch(session_id: str, events: List[Dict]) -> Dict:
+    def write(conn: sqlite3.Connection) -> Dict:
+        inserted = 0
+        duplicates = 0
+        stored_wrong = 0
+        touched_sources = set()
+        for event in events:
+            is_correct = event["selected_index"] == event["correct_index"]
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO answer_events
+                (idempotency_key, session_id, source_file, question, correct_index, selected_index, is_correct, model)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    event["idempotency_key"],
+                    session_id,
+                    event["source_file"],
+                    event["question"],
+                    event["correct_index"],
+                    event["selected_index"],
+                    int(is_correct),
+                    event["model"],
+                ),
+            )
+            if cur.rowcount == 0:
+                duplicates += 1
+                continue
+            inserted += 1
+            touched_sources.add(event["source_file"])
+            record_review_result(
+                conn,
+                source_file=event["source_file"],
+                question=event["question"],
+                options=event["options"],
+                correct_index=event["correct_index"],
+                is_correct=is_correct,
+            )
+            if not is_correct:
+                insert_wrong_answer(
+                    conn,
+                    source_file=event["source_file"],
+                    question=event["question"],
+                    options=event["options"],
+                    correct_index=event["correct_index"],
+                    selected_index=event["selected_index"],
+                    model=event["model"],
+                )
+                stored_wrong += 1
+        for source_file in sorted(touched_sources):
+            bump_data_version(conn, source_file)
+        return {
+            "received": len(events),
+            "inserted": inserted,
+            "duplicates": duplicates,
+            "stored_wrong": stored_wrong,
+        }
+
+    return run_write(write)
+
+
+def list_wrong_answers(limit: int = 100, conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     try:
         rows = conn.execute(
             """
@@ -159,7 +1021,7 @@ def list_wrong_answers(limit: int = 100) -> List[Dict]:
         ).fetchall()
         result: List[Dict] = []
         for row in rows:
-            options = json.loads(row["options_json"]) if row["options_json"] else []
+            options = serialization.loads(row["options_json"]) if row["options_json"] else []
             result.append(
                 {
                     "id": row["id"],
@@ -174,11 +1036,13 @@ def list_wrong_answers(limit: int = 100) -> List[Dict]:
             )
         return result
     finally:
-        conn.close()
+        if owned:
+            conn.close()
 
 
-def list_wrong_answers_by_source(source_file: str, limit: int = 200) -> List[Dict]:
-    conn = get_db_connection()
+def list_wrong_answers_by_source(source_file: str, limit: int = 200, conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     try:
         rows = conn.execute(
             """
@@ -192,7 +1056,7 @@ def list_wrong_answers_by_source(source_file: str, limit: int = 200) -> List[Dic
         ).fetchall()
         result: List[Dict] = []
         for row in rows:
-            options = json.loads(row["options_json"]) if row["options_json"] else []
+            options = serialization.loads(row["options_json"]) if row["options_json"] else []
             result.append(
                 {
                     "id": row["id"],
@@ -207,11 +1071,13 @@ def list_wrong_answers_by_source(source_file: str, limit: int = 200) -> List[Dic
             )
         return result
     finally:
-        conn.close()
+        if owned:
+            conn.close()
 
 
-def list_error_collections() -> List[Dict]:
-    conn = get_db_connection()
+def list_error_collections(conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     try:
         rows = conn.execute(
             """
@@ -235,24 +1101,26 @@ def list_error_collections() -> List[Dict]:
             for row in rows
         ]
     finally:
-        conn.close()
+        if owned:
+            conn.close()
 
 
 def delete_error_collection(source_file: str) -> int:
-    conn = get_db_connection()
-    try:
+    def write(conn: sqlite3.Connection) -> int:
         cur = conn.execute(
             "DELETE FROM wrong_answers WHERE source_file = ?",
             (source_file,),
         )
-        conn.commit()
+        conn.execute("DELETE FROM review_items WHERE source_file = ?", (source_file,))
+        bump_data_version(conn, source_file)
         return cur.rowcount
-    finally:
-        conn.close()
 
+    return run_write(write)
 
-def list_generated_collections() -> List[Dict]:
-    conn = get_db_connection()
+
+def list_generated_collections(conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     try:
         rows = conn.execute(
             """
@@ -276,11 +1144,13 @@ def list_generated_collections() -> List[Dict]:
             for row in rows
         ]
     finally:
-        conn.close()
+        if owned:
+            conn.close()
 
 
-def list_generated_questions_by_source(source_file: str, limit: int = 500) -> List[Dict]:
-    conn = get_db_connection()
+def list_generated_questions_by_source(source_file: str, limit: int = 500, conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     try:
         rows = conn.execute(
             """
@@ -296,7 +1166,7 @@ def list_generated_questions_by_source(source_file: str, limit: int = 500) -> Li
         for row in rows:
             parsed: Dict = {}
             try:
-                parsed = json.loads(row["question_json"]) if row["question_json"] else {}
+                parsed = serialization.loads(row["question_json"]) if row["question_json"] else {}
             except json.JSONDecodeError:
                 parsed = {}
             result.append(
@@ -313,11 +1183,13 @@ def list_generated_questions_by_source(source_file: str, limit: int = 500) -> Li
             )
         return result
     finally:
-        conn.close()
+        if owned:
+            conn.close()
 
 
-def count_generated_questions_by_source(source_file: str) -> int:
-    conn = get_db_connection()
+def count_generated_questions_by_source(source_file: str, conn: Optional[sqlite3.Connection] = None) -> int:
+    owned = conn is None
+    conn = conn or get_db_connection()
     try:
         row = conn.execute(
             "SELECT COUNT(*) AS cnt FROM generated_questions WHERE source_file = ?",
@@ -325,20 +1197,46 @@ def count_generated_questions_by_source(source_file: str) -> int:
         ).fetchone()
         return int(row["cnt"] if row and row["cnt"] is not None else 0)
     finally:
-        conn.close()
+        if owned:
+            conn.close()
 
 
-def delete_generated_collection(source_file: str) -> int:
+def load_bootstrap(source_file: str = "", limit: int = 100) -> Dict:
+    """Every collection summary, plus the first page of one source, from one read transaction."""
     conn = get_db_connection()
     try:
+        # In WAL mode every query of a read transaction sees the same snapshot,
+        # so the summaries and the page cannot disagree about a concurrent write.
+        conn.execute("BEGIN")
+        payload: Dict = {
+            "error_collections": list_error_collections(conn=conn),
+            "favorite_collections": list_generated_collections(conn=conn),
+            "wrong_answers": list_wrong_answers(limit=limit, conn=conn),
+            "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
+        }
+        if source_file:
+            payload["source"] = {
+                "source_file": source_file,
+                "generated_questions": list_generated_questions_by_source(source_file, limit=limit, conn=conn),
+                "wrong_answers": list_wrong_answers_by_source(source_file, limit=limit, conn=conn),
+                "total_questions_for_source": count_generated_questions_by_source(source_file, conn=conn),
+            }
+        conn.rollback()
+        return payload
+    finally:
+        conn.close()
+
+
+def delete_generated_collection(source_file: str) -> int:
+    def write(conn: sqlite3.Connection) -> int:
         cur = conn.execute(
             "DELETE FROM generated_questions WHERE source_file = ?",
             (source_file,),
         )
-        conn.commit()
+        bump_data_version(conn, source_file)
         return cur.rowcount
-    finally:
-        conn.close()
+
+    return run_write(write)
 
 
 def has_uploaded_file(file_name: str) -> bool:
@@ -353,9 +1251,22 @@ def has_uploaded_file(file_name: str) -> bool:
         conn.close()
 
 
-def upsert_uploaded_file(file_name: str) -> None:
+def existing_uploaded_files(file_names: List[str]) -> set:
+    if not file_names:
+        return set()
     conn = get_db_connection()
     try:
+        rows = conn.execute(
+            f"SELECT file_name FROM uploaded_files WHERE file_name IN ({', '.join('?' for _ in file_names)})",
+            file_names,
+        ).fetchall()
+        return {row["file_name"] for row in rows}
+    finally:
+        conn.close()
+
+
+def upsert_uploaded_file(file_name: str) -> None:
+    def write(conn: sqlite3.Connection) -> None:
         conn.execute(
             """
             INSERT INTO uploaded_files (file_name)
@@ -364,27 +1275,27 @@ def upsert_uploaded_file(file_name: str) -> None:
             """,
             (file_name,),
         )
-        conn.commit()
-    finally:
-        conn.close()
+        bump_data_version(conn, file_name)
 
+    run_write(write)
 
-def upsert_uploaded_file_source(file_name: str, file_data: bytes) -> None:
-    conn = get_db_connection()
-    try:
+
+def upsert_uploaded_file_source(file_name: str, file_data: bytes, pdf_kind: Optional[str] = None) -> None:
+    def write(conn: sqlite3.Connection) -> None:
         conn.execute(
             """
-            INSERT INTO uploaded_file_sources (file_name, file_data)
-            VALUES (?, ?)
+            INSERT INTO uploaded_file_sources (file_name, file_data, pdf_kind)
+            VALUES (?, ?, ?)
             ON CONFLICT(file_name) DO UPDATE SET
                 file_data = excluded.file_data,
+                pdf_kind = excluded.pdf_kind,
                 updated_at = CURRENT_TIMESTAMP
             """,
-            (file_name, file_data),
+            (file_name, file_data, pdf_kind),
         )
-        conn.commit()
-    finally:
-        conn.close()
+        bump_data_version(conn, file_name)
+
+    run_write(write)
 
 
 def get_uploaded_file_source(file_name: str) -> bytes:
@@ -401,17 +1312,524 @@ def get_uploaded_file_source(file_name: str) -> bytes:
         conn.close()
 
 
-init_db()
-
-
-def get_openai_api_key() -> str:
-    raw = os.environ.get("OPENAI_API_KEY", "")
-    return raw.strip().strip('"').strip("'")
+def iter_bank_records(source_files: Optional[List[str]] = None, include_sources: bool = True) -> Iterator[Dict]:
+    """Yield every bank row as an export record, one row in memory at a time.
 
+    The connection is opened before the first record is requested, so a
+    streamed response still reads the tenant database of its request.
+    """
+    return _iter_bank_rows(get_db_connection(), source_files, include_sources)
 
-def get_openrouter_api_key() -> str:
-    raw = os.environ.get("OPENROUTER_API_KEY", "")
-    return raw.strip().strip('"').strip("'")
+
+def _iter_bank_rows(conn: sqlite3.Connection, source_files: Optional[List[str]], include_sources: bool) -> Iterator[Dict]:
+    where = ""
+    params: Tuple = ()
+    if source_files:
+        params = tuple(source_files)
+        where = f"IN ({', '.join('?' for _ in params)})"
+
+    try:
+        # One read transaction so the export is a consistent snapshot.
+        conn.execute("BEGIN")
+        file_data_column = "ufs.file_data" if include_sources else "NULL"
+        for row in conn.execute(
+            f"""
+            SELECT uf.file_name, uf.created_at, uf.updated_at, ufs.pdf_kind, {file_data_column} AS file_data
+            FROM uploaded_files uf
+            LEFT JOIN uploaded_file_sources ufs ON ufs.file_name = uf.file_name
+            {"WHERE uf.file_name " + where if where else ""}
+            ORDER BY uf.id
+            """,
+            params,
+        ):
+            record = {
+                "type": "uploaded_file",
+                "file_name": row["file_name"],
+                "created_at": row["created_at"],
+                "updated_at": row["updated_at"],
+            }
+            if row["file_data"] is not None:
+                record["file_data"] = base64.b64encode(bytes(row["file_data"])).decode("ascii")
+                record["pdf_kind"] = row["pdf_kind"]
+            yield record
+
+        for row in conn.execute(
+            f"""
+            SELECT source_file, model, question_json, created_at
+            FROM generated_questions
+            {"WHERE source_file " + where if where else ""}
+            ORDER BY id
+            """,
+            params,
+        ):
+            yield {
+                "type": "generated_question",
+                "source_file": row["source_file"],
+                "model": row["model"],
+                "question": serialization.loads(row["question_json"]),
+                "created_at": row["created_at"],
+            }
+
+        for row in conn.execute(
+            f"""
+            SELECT source_file, question, options_json, correct_index, selected_index, model, created_at
+            FROM wrong_answers
+            {"WHERE source_file " + where if where else ""}
+            ORDER BY id
+            """,
+            params,
+        ):
+            yield {
+                "type": "wrong_answer",
+                "source_file": row["source_file"] or "",
+                "question": row["question"],
+                "options": serialization.loads(row["options_json"]) if row["options_json"] else [],
+                "correct_index": row["correct_index"],
+                "selected_index": row["selected_index"],
+                "model": row["model"] or "",
+                "created_at": row["created_at"],
+            }
+    finally:
+        conn.close()
+
+
+def bank_record_source(record: Dict) -> str:
+    return str(record.get("file_name") if record["type"] == "uploaded_file" else record.get("source_file") or "")
+
+
+def bank_record_key(record: Dict) -> str:
+    """Identity used to skip records that are already in the bank."""
+    if record["type"] == "generated_question":
+        return review_question_key(record["source_file"], str(record["question"].get("question", "")))
+    return hashlib.sha256(
+        json.dumps(
+            [record["source_file"], record["question"], record["selected_index"], record.get("created_at")],
+            ensure_ascii=False,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def load_bank_keys(conn: sqlite3.Connection, record_type: str, source_file: str) -> set:
+    if record_type == "generated_question":
+        rows = conn.execute(
+            "SELECT question_json FROM generated_questions WHERE source_file = ?",
+            (source_file,),
+        )
+        return {
+            review_question_key(source_file, str(serialization.loads(row["question_json"]).get("question", "")))
+            for row in rows
+        }
+    rows = conn.execute(
+        "SELECT question, selected_index, created_at FROM wrong_answers WHERE source_file = ?",
+        (source_file,),
+    )
+    return {
+        bank_record_key(
+            {
+                "type": "wrong_answer",
+                "source_file": source_file,
+                "question": row["question"],
+                "selected_index": row["selected_index"],
+                "created_at": row["created_at"],
+            }
+        )
+        for row in rows
+    }
+
+
+def apply_bank_batch(conn: sqlite3.Connection, batch: List[Dict], known: Dict[Tuple[str, str], set], counts: Dict) -> None:
+    touched = set()
+    questions: List[Tuple] = []
+    wrong: List[Tuple] = []
+    for record in batch:
+        source_file = bank_record_source(record)
+        if record["type"] == "uploaded_file":
+            cur = conn.execute(
+                """
+                INSERT INTO uploaded_files (file_name, created_at, updated_at)
+                VALUES (?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+                ON CONFLICT(file_name) DO NOTHING
+                """,
+                (source_file, record.get("created_at"), record.get("updated_at")),
+            )
+            if record.get("file_data"):
+                conn.execute(
+                    """
+                    INSERT INTO uploaded_file_sources (file_name, file_data, pdf_kind)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(file_name) DO NOTHING
+                    """,
+                    (source_file, base64.b64decode(record["file_data"]), record.get("pdf_kind")),
+                )
+            counts["uploaded_files" if cur.rowcount else "duplicates"] += 1
+            touched.add(source_file)
+            continue
+
+        cache_key = (record["type"], source_file)
+        keys = known.get(cache_key)
+        if keys is None:
+            keys = load_bank_keys(conn, record["type"], source_file)
+            known[cache_key] = keys
+        key = bank_record_key(record)
+        if key in keys:
+            counts["duplicates"] += 1
+            continue
+        keys.add(key)
+        touched.add(source_file)
+        if record["type"] == "generated_question":
+            questions.append(
+                (
+                    source_file,
+                    record.get("model") or "unknown",
+                    serialization.dumps(record["question"]),
+                    record.get("created_at"),
+                )
+            )
+        else:
+            wrong.append(
+                (
+                    source_file,
+                    record["question"],
+                    serialization.dumps(record["options"]),
+                    record["correct_index"],
+                    record["selected_index"],
+                    record.get("model") or "",
+                    record.get("created_at"),
+                )
+            )
+
+    conn.executemany(
+        """
+        INSERT INTO generated_questions (source_file, model, question_json, created_at)
+        VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        questions,
+    )
+    conn.executemany(
+        """
+        INSERT INTO wrong_answers (source_file, question, options_json, correct_index, selected_index, model, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        wrong,
+    )
+    counts["generated_questions"] += len(questions)
+    counts["wrong_answers"] += len(wrong)
+    for source_file in touched:
+        bump_data_version(conn, source_file)
+
+
+def validate_bank_record(record: Dict) -> None:
+    if record["type"] == "uploaded_file":
+        if not isinstance(record.get("file_name"), str) or not record["file_name"].strip():
+            raise ValueError("uploaded_file records need a file_name.")
+        return
+    if not isinstance(record.get("source_file"), str):
+        raise ValueError(f"{record['type']} records need a source_file.")
+    if record["type"] == "generated_question":
+        if not validate_questions({"questions": [record.get("question")]}):
+            raise ValueError(f"Invalid question in generated_question record for '{record['source_file']}'.")
+        return
+    parse_answer_event(record)
+
+
+def import_bank_records(
+    records: Iterable[Dict],
+    source_files: Optional[List[str]] = None,
+    batch_size: int = BANK_IMPORT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Insert exported records in batches of `batch_size`, skipping ones already present."""
+    wanted = set(source_files) if source_files else None
+    counts = {"uploaded_files": 0, "generated_questions": 0, "wrong_answers": 0, "duplicates": 0, "filtered": 0}
+    known: Dict[Tuple[str, str], set] = {}
+    batch: List[Dict] = []
+
+    def flush() -> None:
+        if batch:
+            pending = list(batch)
+            batch.clear()
+            run_write(lambda conn: apply_bank_batch(conn, pending, known, counts))
+
+    for record in records:
+        if wanted is not None and bank_record_source(record) not in wanted:
+            counts["filtered"] += 1
+            continue
+        validate_bank_record(record)
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    increment_metric("bank_import_rows", counts["generated_questions"] + counts["wrong_answers"])
+    return counts
+
+
+def collect_orphaned_sources(limit: int) -> int:
+    """Delete up to `limit` uploads that no question, wrong answer or reservation refers to."""
+    cutoff = format_db_timestamp(datetime.now(timezone.utc) - timedelta(seconds=MAINTENANCE_ORPHAN_GRACE_SECONDS))
+
+    def write(conn: sqlite3.Connection) -> List[str]:
+        rows = conn.execute(
+            """
+            SELECT uf.file_name
+            FROM uploaded_files uf
+            WHERE uf.updated_at < ?
+                AND NOT EXISTS (SELECT 1 FROM generated_questions gq WHERE gq.source_file = uf.file_name)
+                AND NOT EXISTS (SELECT 1 FROM wrong_answers wa WHERE wa.source_file = uf.file_name)
+                AND NOT EXISTS (SELECT 1 FROM generation_reservations gr WHERE gr.source_file = uf.file_name)
+            LIMIT ?
+            """,
+            (cutoff, limit),
+        ).fetchall()
+        names = [row["file_name"] for row in rows]
+        for name in names:
+            conn.execute("DELETE FROM uploaded_file_sources WHERE file_name = ?", (name,))
+            conn.execute("DELETE FROM uploaded_files WHERE file_name = ?", (name,))
+            bump_data_version(conn, name)
+        # Sources whose uploaded_files row is already gone.
+        stray = conn.execute(
+            """
+            DELETE FROM uploaded_file_sources
+            WHERE updated_at < ?
+                AND file_name NOT IN (SELECT file_name FROM uploaded_files)
+            """,
+            (cutoff,),
+        ).rowcount
+        return len(names) + max(0, stray)
+
+    return run_write(write)
+
+
+def release_expired_provider_files(now: datetime) -> List[Tuple[str, str, str]]:
+    """Delete expired handles' files on the provider; returns the handles to drop.
+
+    Deletes are best-effort: a failure is logged and counted, and the row is
+    dropped anyway. Handles of another provider than the configured client's
+    cannot be deleted remotely and are only dropped.
+    """
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT provider, content_hash, file_id FROM provider_file_handles WHERE expires_at <= ? LIMIT ?",
+            (format_db_timestamp(now), MAINTENANCE_DELETE_BATCH),
+        ).fetchall()
+    finally:
+        conn.close()
+    client = provider_file_client
+    for row in rows:
+        if row["provider"] != client.provider:
+            continue
+        try:
+            client.delete(row["file_id"])
+        except Exception as exc:
+            increment_metric("provider_file_delete_failed")
+            app.logger.warning("Could not delete expired provider file %s: %s", row["file_id"], exc)
+    return [(row["provider"], row["content_hash"], row["file_id"]) for row in rows]
+
+
+def purge_expired_rows() -> int:
+    now = datetime.now(timezone.utc)
+    expired_handles = release_expired_provider_files(now)
+
+    def write(conn: sqlite3.Connection) -> int:
+        reservations = conn.execute(
+            "DELETE FROM generation_reservations WHERE created_at < ?",
+            (format_db_timestamp(now - timedelta(seconds=RESERVATION_TTL_SECONDS)),),
+        ).rowcount
+        # Matching on file_id keeps a handle that was re-uploaded meanwhile.
+        handles = 0
+        for provider, content_hash, file_id in expired_handles:
+            handles += conn.execute(
+                "DELETE FROM provider_file_handles WHERE provider = ? AND content_hash = ? AND file_id = ?",
+                (provider, content_hash, file_id),
+            ).rowcount
+        usage = 0
+        if USAGE_RETENTION_DAYS > 0:
+            usage = conn.execute(
+                "DELETE FROM provider_usage WHERE created_at < ?",
+                (format_db_timestamp(now - timedelta(days=USAGE_RETENTION_DAYS)),),
+            ).rowcount
+        return reservations + handles + usage
+
+    return run_write(write)
+
+
+def incremental_vacuum_step(pages: int) -> int:
+    """Return up to `pages` free pages to the OS; returns the freelist size left."""
+
+    def write(conn: sqlite3.Connection) -> int:
+        # The sqlite3 module steps the pragma once, and each step frees one page.
+        for _ in range(pages):
+            conn.execute("PRAGMA incremental_vacuum(1)")
+        return int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+    return run_write(write)
+
+
+def optimize_database(conn: sqlite3.Connection) -> None:
+    # PRAGMA optimize only re-analyzes tables that already have statistics.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize").fetchall()
+
+
+def database_file_stats() -> Dict:
+    conn = get_db_connection()
+    try:
+        page_size = int(conn.execute("PRAGMA page_size").fetchone()[0])
+        page_count = int(conn.execute("PRAGMA page_count").fetchone()[0])
+        return {
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(
+                int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]), "unknown"
+            ),
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_count": int(conn.execute("PRAGMA freelist_count").fetchone()[0]),
+            "size_bytes": page_size * page_count,
+        }
+    finally:
+        conn.close()
+
+
+def maintenance_tenants() -> List[str]:
+    if not DB_SHARD_DIR:
+        return [current_tenant()]
+    return list_shard_tenants(Path(DB_SHARD_DIR))
+
+
+class DatabaseMaintenance:
+    """Background housekeeping for the SQLite store.
+
+    Each cycle garbage-collects uploads nothing refers to anymore, purges
+    expired reservations and file handles, returns free pages to the OS with
+    paced `incremental_vacuum` steps, refreshes planner statistics with
+    `PRAGMA optimize`, and truncates the WAL. Deletes and vacuum steps go
+    through the writer thread in small batches so requests are never blocked
+    for long.
+    """
+
+    def __init__(self, interval_seconds: float) -> None:
+        self._interval = interval_seconds
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict = {
+            "runs": 0,
+            "failures": 0,
+            "last_run_at": None,
+            "last_duration_ms": 0.0,
+            "last_error": None,
+            "orphaned_sources_removed": 0,
+            "expired_rows_removed": 0,
+            "pages_reclaimed": 0,
+            "optimize_runs": 0,
+        }
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.run_once()
+            except Exception:
+                pass  # Recorded in stats by run_once.
+
+    def run_once(self, full_vacuum: bool = False) -> Dict:
+        with self._run_lock:
+            started = time.perf_counter()
+            summary = {"orphaned_sources_removed": 0, "expired_rows_removed": 0, "pages_reclaimed": 0}
+            tenants = maintenance_tenants()
+            try:
+                for tenant in tenants:
+                    with tenant_context(tenant):
+                        self._run_shard(summary, full_vacuum)
+            except Exception as exc:
+                with self._stats_lock:
+                    self._stats["failures"] += 1
+                    self._stats["last_error"] = str(exc)
+                raise
+
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+            with self._stats_lock:
+                self._stats["runs"] += 1
+                self._stats["optimize_runs"] += 1
+                self._stats["last_run_at"] = format_db_timestamp(datetime.now(timezone.utc))
+                self._stats["last_duration_ms"] = elapsed_ms
+                self._stats["last_error"] = None
+                for key, value in summary.items():
+                    self._stats[key] += value
+            return {**summary, "shards": len(tenants), "duration_ms": elapsed_ms, "database": database_file_stats()}
+
+    def _run_shard(self, summary: Dict, full_vacuum: bool) -> None:
+        while True:
+            removed = collect_orphaned_sources(MAINTENANCE_DELETE_BATCH)
+            summary["orphaned_sources_removed"] += removed
+            if removed < MAINTENANCE_DELETE_BATCH:
+                break
+            time.sleep(MAINTENANCE_STEP_PAUSE_SECONDS)
+        summary["expired_rows_removed"] += purge_expired_rows()
+
+        if full_vacuum:
+            self._full_vacuum()
+        before = database_file_stats()
+        if before["auto_vacuum"] == "incremental":
+            for _ in range(MAINTENANCE_VACUUM_MAX_STEPS):
+                if incremental_vacuum_step(MAINTENANCE_VACUUM_PAGES) == 0:
+                    break
+                time.sleep(MAINTENANCE_STEP_PAUSE_SECONDS)
+        run_write(optimize_database)
+        self._checkpoint()
+        after = database_file_stats()
+        summary["pages_reclaimed"] += max(0, before["page_count"] - after["page_count"])
+
+    def _full_vacuum(self) -> None:
+        # VACUUM cannot run inside the writer's transaction; busy_timeout covers the lock wait.
+        conn = get_db_connection()
+        try:
+            conn.isolation_level = None
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def _checkpoint(self) -> None:
+        conn = get_db_connection()
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            result = dict(self._stats)
+        result["enabled"] = MAINTENANCE_ENABLED
+        result["running"] = self._thread is not None and self._thread.is_alive()
+        result["interval_seconds"] = self._interval
+        result["database"] = database_file_stats()
+        return result
+
+
+db_maintenance = DatabaseMaintenance(MAINTENANCE_INTERVAL_SECONDS)
+
+
+init_db()
+
+
+def get_openai_api_key() -> str:
+    raw = os.environ.get("OPENAI_API_KEY", "")
+    return raw.strip().strip('"').strip("'")
+
+
+def get_openrouter_api_key() -> str:
+    raw = os.environ.get("OPENROUTER_API_KEY", "")
+    return raw.strip().strip('"').strip("'")
 
 
 def read_text_file(path: Path) -> str:
@@ -426,17 +1844,227 @@ def normalize_upload_filename(filename: str) -> str:
     return name
 
 
-def encode_pdf_for_input(path: Path) -> str:
-    raw = path.read_bytes()
-    return encode_pdf_bytes(raw)
-
-
 def encode_pdf_bytes(raw: bytes) -> str:
     encoded = base64.b64encode(raw).decode("ascii")
     return f"data:application/pdf;base64,{encoded}"
 
 
+def get_provider_file_handle(provider: str, content_hash: str) -> Tuple[Optional[str], bool]:
+    """Return (file_id, expired) for a cached upload, or (None, False) if there is none."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT file_id, expires_at FROM provider_file_handles WHERE provider = ? AND content_hash = ?",
+            (provider, content_hash),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None, False
+    return row["file_id"], row["expires_at"] <= format_db_timestamp(datetime.now(timezone.utc))
+
+
+def store_provider_file_handle(provider: str, content_hash: str, file_id: str) -> None:
+    expires_at = format_db_timestamp(datetime.now(timezone.utc) + timedelta(seconds=PROVIDER_FILE_TTL_SECONDS))
+
+    def write(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            INSERT INTO provider_file_handles (provider, content_hash, file_id, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(provider, content_hash) DO UPDATE SET
+                file_id = excluded.file_id,
+                expires_at = excluded.expires_at,
+                created_at = CURRENT_TIMESTAMP
+            """,
+            (provider, content_hash, file_id, expires_at),
+        )
+
+    run_write(write)
+
+
+def upload_provider_file(file_name: str, data: bytes, content_hash: str) -> str:
+    client = provider_file_client
+    file_id, expired = get_provider_file_handle(client.provider, content_hash)
+    if file_id is not None and not expired:
+        increment_metric("provider_file_cache_hits")
+        return file_id
+
+    # Uploads share the provider's admission lane with generation calls and
+    # have their own `<provider>/files` lane. They are not priced in input
+    # tokens; the generation request that references the file is.
+    deadline = current_deadline()
+    ticket = admission.acquire(
+        client.provider,
+        PROVIDER_FILES_LANE,
+        0,
+        timeout=call_timeout(deadline, "admission", ADMISSION_MAX_WAIT_SECONDS),
+    )
+    try:
+        new_file_id = client.upload(
+            file_name, data, timeout=call_timeout(deadline, "file_upload", PROVIDER_TIMEOUT_SECONDS)
+        )
+    except requests.Timeout as exc:
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded("file_upload", deadline.budget) from exc
+        raise
+    finally:
+        admission.release(ticket)
+    store_provider_file_handle(client.provider, content_hash, new_file_id)
+    increment_metric("provider_file_uploads")
+    increment_metric("provider_file_bytes_uploaded", len(data))
+    if file_id is not None:
+        try:
+            client.delete(file_id)
+        except Exception:
+            increment_metric("provider_file_delete_failed")
+    return new_file_id
+
+
+def pdf_input_item(file_name: str, data: bytes) -> Dict:
+    """Content item for a PDF in a pro-tier request.
+
+    With PROVIDER_FILE_UPLOADS on, each distinct PDF is uploaded once through the
+    provider's files API and later requests reference the cached file ID until
+    it expires. Otherwise, or if the upload fails, the PDF is inlined as base64.
+    """
+    if PROVIDER_FILE_UPLOADS:
+        content_hash = hashlib.sha256(data).hexdigest()
+        try:
+            file_id, _ = file_upload_flights.do(
+                ("provider_file", current_tenant(), content_hash),
+                lambda: upload_provider_file(file_name, data, content_hash),
+            )
+            return provider_file_client.input_item(file_id)
+        except (DeadlineExceeded, RequestCancelled):
+            raise
+        except Exception:
+            increment_metric("provider_file_upload_failed")
+    increment_metric("pdf_inline_bytes", len(data))
+    return {"type": "input_file", "filename": file_name, "file_data": encode_pdf_bytes(data)}
+
+
 def extract_text_from_pdf_bytes(data: bytes) -> str:
+    return "\n".join(extract_pdf_pages(data)).strip()
+
+
+PDF_TEXT_OPERATOR_RE = re.compile(rb"(?:^|[\s\]\)>])(?:Tj|TJ|'|\")(?=[\s]|$)")
+PDF_IMAGE_DRAW_RE = re.compile(
+    rb"([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+[-\d.]+\s+[-\d.]+\s+cm\s+/([^\s/]+)\s+Do\b"
+)
+# Type0 fonts with these encodings are handled by PyPDF2; other predefined CMaps
+# (UniGB-UCS2-H, UniJIS-UTF16-H, ...) need pdfminer.
+PDF_SIMPLE_CID_ENCODINGS = {"/Identity-H", "/Identity-V"}
+
+pdf_classifications: "OrderedDict[str, Dict]" = OrderedDict()
+_pdf_classifications_lock = threading.Lock()
+
+
+def sample_page_indexes(page_count: int, sample_size: int) -> List[int]:
+    if page_count <= sample_size:
+        return list(range(page_count))
+    step = (page_count - 1) / (sample_size - 1)
+    return sorted({round(i * step) for i in range(sample_size)})
+
+
+def inspect_pdf_page(page) -> Dict:
+    resources = page.get("/Resources")
+    resources = resources.get_object() if resources is not None else {}
+    fonts = resources.get("/Font")
+    fonts = fonts.get_object() if fonts is not None else {}
+    xobjects = resources.get("/XObject")
+    xobjects = xobjects.get_object() if xobjects is not None else {}
+
+    cid_encoded = False
+    for font_ref in fonts.values():
+        font = font_ref.get_object()
+        encoding = font.get("/Encoding")
+        if font.get("/Subtype") == "/Type0" and isinstance(encoding, str) and encoding not in PDF_SIMPLE_CID_ENCODINGS:
+            cid_encoded = True
+
+    images = set()
+    form_with_fonts = False
+    for name, xobject_ref in xobjects.items():
+        xobject = xobject_ref.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            images.add(name.lstrip("/"))
+        elif xobject.get("/Subtype") == "/Form":
+            form_resources = xobject.get("/Resources")
+            if form_resources is not None and "/Font" in form_resources.get_object():
+                form_with_fonts = True
+
+    contents = page.get_contents()
+    stream = contents.get_data() if contents is not None else b""
+    has_text_ops = bool(PDF_TEXT_OPERATOR_RE.search(stream))
+
+    page_area = abs(float(page.mediabox.width) * float(page.mediabox.height)) or 1.0
+    image_area = 0.0
+    for match in PDF_IMAGE_DRAW_RE.finditer(stream):
+        if match.group(5).decode("latin-1") in images:
+            a, b, c, d = (float(match.group(i)) for i in range(1, 5))
+            image_area += abs(a * d - b * c)
+
+    return {
+        "has_text": (has_text_ops and bool(fonts)) or form_with_fonts,
+        "cid_encoded": cid_encoded,
+        "image_coverage": min(1.0, image_area / page_area),
+    }
+
+
+def classify_pdf(data: bytes) -> Dict:
+    """Cheaply decide how a PDF should be extracted, without extracting it.
+
+    Looks at fonts, text-showing operators and image coverage on a sample of
+    pages. `kind` is "text" (PyPDF2), "cjk" (straight to pdfminer), "image_only"
+    (no extractable text, fail fast) or "unknown" (inspection failed; run the
+    full extraction path). Results are cached by content hash.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    with _pdf_classifications_lock:
+        cached = pdf_classifications.get(digest)
+        if cached is not None:
+            pdf_classifications.move_to_end(digest)
+            return dict(cached)
+
+    started = time.perf_counter()
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        page_count = len(reader.pages)
+        sampled = [inspect_pdf_page(reader.pages[i]) for i in sample_page_indexes(page_count, PDF_CLASSIFY_SAMPLE_PAGES)]
+    except Exception:
+        page_count, sampled = 0, []
+
+    if not sampled:
+        kind = "unknown"
+    elif any(page["cid_encoded"] for page in sampled):
+        kind = "cjk"
+    elif any(page["has_text"] for page in sampled):
+        kind = "text"
+    else:
+        kind = "image_only"
+
+    result = {
+        "kind": kind,
+        "pages": page_count,
+        "sampled_pages": len(sampled),
+        "text_pages": sum(1 for page in sampled if page["has_text"]),
+        "image_coverage": round(sum(page["image_coverage"] for page in sampled) / len(sampled), 3) if sampled else 0.0,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    with _pdf_classifications_lock:
+        pdf_classifications[digest] = result
+        while len(pdf_classifications) > DOCUMENT_STATS_CACHE_SIZE:
+            pdf_classifications.popitem(last=False)
+    increment_metric(f"pdf_classified_{kind}")
+    return dict(result)
+
+
+def extract_pdf_pages(data: bytes, kind: Optional[str] = None) -> List[str]:
+    if kind == "image_only":
+        return []
+    if kind == "cjk":
+        return extract_pdf_pages_pdfminer(data)
+
     pages: List[str] = []
     saw_advanced_encoding_warning = False
 
@@ -444,6 +2072,7 @@ def extract_text_from_pdf_bytes(data: bytes) -> str:
         warnings.simplefilter("always", PdfReadWarning)
         reader = PdfReader(io.BytesIO(data))
         for page in reader.pages:
+            check_deadline("extract")
             page_text = page.extract_text() or ""
             if page_text.strip():
                 pages.append(page_text.strip())
@@ -454,23 +2083,142 @@ def extract_text_from_pdf_bytes(data: bytes) -> str:
                 saw_advanced_encoding_warning = True
                 break
 
-    extracted = "\n".join(pages).strip()
-    if extracted and not saw_advanced_encoding_warning:
-        return extracted
+    if pages and not saw_advanced_encoding_warning:
+        return pages
 
     # Fallback extractor for CJK/complex encodings where PyPDF2 can be incomplete.
-    fallback = pdfminer_extract_text(io.BytesIO(data)) or ""
-    return fallback.strip() if fallback.strip() else extracted
+    return extract_pdf_pages_pdfminer(data) or pages
 
 
-def load_notes_content(notes_dir: Path) -> Tuple[List[Dict], List[Dict], List[str]]:
+def extract_pdf_pages_pdfminer(data: bytes) -> List[str]:
+    text = pdfminer_extract_text(io.BytesIO(data)) or ""
+    # pdfminer separates pages with form feeds.
+    return [page.strip() for page in text.split("\f") if page.strip()]
+
+
+PAGE_NUMBER_RE = re.compile(r"^(?:page\s*)?[-\u2013]?\s*\d{1,4}\s*[-\u2013]?(?:\s*(?:/|of)\s*\d{1,4})?$", re.IGNORECASE)
+HYPHEN_BREAK_RE = re.compile(r"([A-Za-z])-\n(?=[a-z])")
+INLINE_WHITESPACE_RE = re.compile(r"[ \t\u00a0\u3000]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+# Keyed by (tenant, file name): tenants may upload files with the same name.
+document_stats: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+_document_stats_lock = threading.Lock()
+
+
+def estimate_text_tokens(text: str) -> int:
+    # CJK characters are roughly one token each; other text roughly four characters per token.
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def boilerplate_signature(line: str) -> str:
+    # Page numbers inside headers/footers vary per page, so compare with digits masked.
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def normalize_notes_pages(pages: List[str]) -> Tuple[str, Dict]:
+    """Strip page furniture and whitespace noise from extracted notes.
+
+    Deterministic: the same pages always produce the same text. Removes header
+    and footer lines repeated across pages, bare page numbers at page edges,
+    hyphenation breaks and whitespace runs, and drops empty pages.
+    """
+    page_lines = [[INLINE_WHITESPACE_RE.sub(" ", line).strip() for line in page.splitlines()] for page in pages]
+
+    edge_indexes: List[set] = []
+    for lines in page_lines:
+        non_empty = [i for i, line in enumerate(lines) if line]
+        edge_indexes.append(set(non_empty[:NORMALIZE_EDGE_LINES] + non_empty[-NORMALIZE_EDGE_LINES:]))
+
+    repeated: set = set()
+    if len(page_lines) >= 2:
+        counts: Counter = Counter()
+        for lines, edges in zip(page_lines, edge_indexes):
+            counts.update({boilerplate_signature(lines[i]) for i in edges})
+        threshold = max(2, math.ceil(len(page_lines) * NORMALIZE_REPEAT_RATIO))
+        repeated = {signature for signature, count in counts.items() if count >= threshold}
+
+    removed_lines = 0
+    cleaned_pages: List[str] = []
+    for lines, edges in zip(page_lines, edge_indexes):
+        kept: List[str] = []
+        for i, line in enumerate(lines):
+            if i in edges and (PAGE_NUMBER_RE.match(line) or boilerplate_signature(line) in repeated):
+                removed_lines += 1
+                continue
+            kept.append(line)
+        text = HYPHEN_BREAK_RE.sub(r"\1", "\n".join(kept))
+        text = BLANK_LINES_RE.sub("\n\n", text).strip()
+        if text:
+            cleaned_pages.append(text)
+
+    result = "\n\n".join(cleaned_pages)
+    original = "\n".join(pages)
+    tokens_before = estimate_text_tokens(original)
+    tokens_after = estimate_text_tokens(result)
+    stats = {
+        "pages": len(pages),
+        "empty_pages_dropped": len(pages) - len(cleaned_pages),
+        "boilerplate_lines_removed": removed_lines,
+        "chars_before": len(original),
+        "chars_after": len(result),
+        "estimated_tokens_before": tokens_before,
+        "estimated_tokens_after": tokens_after,
+        "estimated_tokens_saved": tokens_before - tokens_after,
+    }
+    return result, stats
+
+
+def record_document_stats(file_name: str, stats: Dict) -> None:
+    key = (current_tenant(), file_name)
+    with _document_stats_lock:
+        document_stats[key] = stats
+        document_stats.move_to_end(key)
+        while len(document_stats) > DOCUMENT_STATS_CACHE_SIZE:
+            document_stats.popitem(last=False)
+    increment_metric("normalized_documents")
+    increment_metric("normalization_tokens_saved", stats["estimated_tokens_saved"])
+
+
+def get_document_stats(file_name: str) -> Optional[Dict]:
+    with _document_stats_lock:
+        stats = document_stats.get((current_tenant(), file_name))
+        return dict(stats) if stats is not None else None
+
+
+def normalize_document_text(file_name: str, pages: List[str]) -> str:
+    text, stats = normalize_notes_pages(pages)
+    record_document_stats(file_name, stats)
+    return text
+
+
+def upload_normalization_stats(file_name: str, text_inputs: List[Dict]) -> Optional[Dict]:
+    """Stats for an uploaded PDF whose text this request extracted and normalized, else None.
+
+    `.txt` notes are not normalized, and a PDF sent as a file input has no text to clean.
+    """
+    if not text_inputs or Path(file_name).suffix.lower() != ".pdf":
+        return None
+    return get_document_stats(file_name)
+
+
+def estimate_pdf_tokens(data: bytes) -> int:
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", PdfReadWarning)
+            pages = len(PdfReader(io.BytesIO(data)).pages)
+    except Exception:
+        return max(1, len(data) // 40)
+    return max(1, pages) * PDF_PAGE_TOKEN_ESTIMATE
+
+
+def load_notes_documents(notes_dir: Path) -> List[Dict]:
+    """Read each notes file into its own prompt inputs, with a size estimate in tokens."""
     if not notes_dir.exists() or not notes_dir.is_dir():
         raise FileNotFoundError(f"Notes directory not found: {notes_dir}")
 
-    text_inputs: List[Dict] = []
-    pdf_inputs: List[Dict] = []
-    used_files: List[str] = []
-
+    documents: List[Dict] = []
     for path in sorted(notes_dir.iterdir()):
         if not path.is_file() or path.suffix.lower() not in SUPPORTED_SUFFIXES:
             continue
@@ -479,29 +2227,157 @@ def load_notes_content(notes_dir: Path) -> Tuple[List[Dict], List[Dict], List[st
             text = read_text_file(path).strip()
             if not text:
                 continue
-            text_inputs.append(
+            documents.append(
                 {
-                    "type": "input_text",
-                    "text": f"# Source: {path.name}\n{text}",
+                    "source_file": path.name,
+                    "text_inputs": [{"type": "input_text", "text": f"# Source: {path.name}\n{text}"}],
+                    "pdf_inputs": [],
+                    "tokens": estimate_text_tokens(text),
                 }
             )
-            used_files.append(path.name)
             continue
 
         if path.suffix.lower() == ".pdf":
-            pdf_inputs.append(
+            data = path.read_bytes()
+            documents.append(
                 {
-                    "type": "input_file",
-                    "filename": path.name,
-                    "file_data": encode_pdf_for_input(path),
+                    "source_file": path.name,
+                    "text_inputs": [],
+                    "pdf_inputs": [pdf_input_item(path.name, data)],
+                    "tokens": estimate_pdf_tokens(data),
                 }
             )
-            used_files.append(path.name)
 
-    if not text_inputs and not pdf_inputs:
+    if not documents:
         raise ValueError("No readable .txt or .pdf files found in notes directory.")
+    return documents
+
+
+def load_notes_content(notes_dir: Path) -> Tuple[List[Dict], List[Dict], List[str]]:
+    documents = load_notes_documents(notes_dir)
+    return (
+        [item for doc in documents for item in doc["text_inputs"]],
+        [item for doc in documents for item in doc["pdf_inputs"]],
+        [doc["source_file"] for doc in documents],
+    )
+
 
-    return text_inputs, pdf_inputs, used_files
+def allocate_proportionally(total: int, weights: List[int]) -> List[int]:
+    """Split `total` by weight with largest remainders; ties go to the earlier entry."""
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        return [0] * len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    counts = [math.floor(value) for value in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: (-(exact[i] - counts[i]), i))
+    for index in by_remainder[: total - sum(counts)]:
+        counts[index] += 1
+    return counts
+
+
+def plan_notes_groups(documents: List[Dict], question_count: int, group_tokens: int = NOTES_GROUP_TOKENS) -> List[Dict]:
+    """One generation call per large file; small files are packed together up to `group_tokens`.
+
+    `question_count` is divided across the groups in proportion to their size.
+    Each group lists its largest file first.
+    """
+    ordered = sorted(documents, key=lambda doc: (-doc["tokens"], doc["source_file"]))
+    packs: List[List[Dict]] = []
+    small: List[Dict] = []
+    small_tokens = 0
+    for doc in ordered:
+        if doc["tokens"] >= group_tokens:
+            packs.append([doc])
+            continue
+        if small and small_tokens + doc["tokens"] > group_tokens:
+            packs.append(small)
+            small, small_tokens = [], 0
+        small.append(doc)
+        small_tokens += doc["tokens"]
+    if small:
+        packs.append(small)
+
+    counts = allocate_proportionally(question_count, [sum(doc["tokens"] for doc in pack) for pack in packs])
+    return [
+        {
+            "source_files": [doc["source_file"] for doc in pack],
+            "text_inputs": [item for doc in pack for item in doc["text_inputs"]],
+            "pdf_inputs": [item for doc in pack for item in doc["pdf_inputs"]],
+            "tokens": sum(doc["tokens"] for doc in pack),
+            "question_count": count,
+        }
+        for pack, count in zip(packs, counts)
+    ]
+
+
+def generate_notes_group(group: Dict, model: str, model_tier: str) -> List[Tuple[str, Dict]]:
+    names = group["source_files"]
+    with usage_source(names[0]):
+        questions_data = generate_questions(
+            group["text_inputs"],
+            group["pdf_inputs"],
+            group["question_count"],
+            model,
+            model_tier=model_tier,
+            source_names=names if len(names) > 1 else None,
+        )
+    return attribute_group_questions(group, questions_data)
+
+
+def attribute_group_questions(group: Dict, questions_data: List[Dict]) -> List[Tuple[str, Dict]]:
+    # Untagged questions from a grouped call go to the group's largest file.
+    primary = group["source_files"][0]
+    return [(question.pop("source", primary), question) for question in questions_data]
+
+
+def collect_notes_results(groups: List[Dict], outcomes: List[object], model: str) -> Dict:
+    """Store the questions of every successful group under their own source files.
+
+    `outcomes` holds, per group with a non-zero count, either the attributed
+    questions or the exception it failed with. Fails only if every group did.
+    """
+    attributed: List[Tuple[str, Dict]] = []
+    reports: List[Dict] = []
+    errors: List[Exception] = []
+    active = [group for group in groups if group["question_count"] > 0]
+    for group, outcome in zip(active, outcomes):
+        report = {"source_files": group["source_files"], "question_count": group["question_count"]}
+        if isinstance(outcome, Exception):
+            errors.append(outcome)
+            report.update({"generated": 0, "error": str(outcome)})
+        else:
+            attributed.extend(outcome)
+            report["generated"] = len(outcome)
+        reports.append(report)
+    if errors and not attributed:
+        raise errors[0]
+    if attributed:
+        store_attributed_questions(model, attributed)
+    for group in groups:
+        if group["question_count"] == 0:
+            reports.append({"source_files": group["source_files"], "question_count": 0, "generated": 0})
+    return {
+        "questions": [{**question, "source_file": source} for source, question in attributed],
+        "source_files": [name for group in groups for name in group["source_files"]],
+        "groups": reports,
+    }
+
+
+def generate_notes_per_file(documents: List[Dict], question_count: int, model: str, model_tier: str) -> Dict:
+    groups = plan_notes_groups(documents, question_count)
+    futures = [
+        # Each task gets its own context copy so the tenant follows it to the worker.
+        notes_executor.submit(contextvars.copy_context().run, generate_notes_group, group, model, model_tier)
+        for group in groups
+        if group["question_count"] > 0
+    ]
+    outcomes: List[object] = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as exc:
+            outcomes.append(exc)
+    return collect_notes_results(groups, outcomes, model)
 
 
 def load_uploaded_file_content(
@@ -509,6 +2385,7 @@ def load_uploaded_file_content(
     data: bytes,
     model_tier: str = "pro",
 ) -> Tuple[List[Dict], List[Dict], List[str]]:
+    check_deadline("extract")
     clean_name = normalize_upload_filename(filename)
     suffix = Path(clean_name).suffix.lower()
     if suffix not in SUPPORTED_SUFFIXES:
@@ -526,7 +2403,10 @@ def load_uploaded_file_content(
 
     if suffix == ".pdf":
         if str(model_tier).strip().lower() == "free":
-            text = extract_text_from_pdf_bytes(data)
+            kind = classify_pdf(data)["kind"]
+            if kind == "image_only":
+                raise ValueError("Uploaded PDF does not contain extractable text (it appears to be scanned images).")
+            text = normalize_document_text(clean_name, extract_pdf_pages(data, kind))
             if not text:
                 raise ValueError("Uploaded PDF does not contain extractable text.")
             return (
@@ -536,14 +2416,19 @@ def load_uploaded_file_content(
             )
         return (
             [],
-            [{"type": "input_file", "filename": clean_name, "file_data": encode_pdf_bytes(data)}],
+            [pdf_input_item(clean_name, data)],
             [clean_name],
         )
 
     raise ValueError("Unsupported file type.")
 
 
-def build_prompt(question_count: int, language_hint: str = "unknown") -> str:
+def build_prompt(
+    question_count: int,
+    language_hint: str = "unknown",
+    avoid_questions: Optional[List[str]] = None,
+    source_names: Optional[List[str]] = None,
+) -> str:
     language_rule = (
         "- Use the same language as the source notes for question, options, and explanation.\\n"
         "- Do NOT translate to English unless the source notes are English.\\n"
@@ -553,6 +2438,19 @@ def build_prompt(question_count: int, language_hint: str = "unknown") -> str:
     elif language_hint == "english":
         language_rule += "- Language hint: source notes are primarily English, so output English.\\n"
 
+    avoid_rule = ""
+    if avoid_questions:
+        avoid_rule = "- Do NOT repeat or paraphrase these existing questions:\\n" + "".join(
+            f"  - {stem}\\n" for stem in avoid_questions
+        )
+
+    source_rule = ""
+    if source_names:
+        source_rule = (
+            "- Each question must also have a \"source\" field: the file name from the \"# Source:\" "
+            f"heading (or PDF file) it is based on, one of: {', '.join(source_names)}.\\n"
+        )
+
     return (
         "Generate multiple-choice study questions from the provided notes. "
         f"Create exactly {question_count} questions.\\n\\n"
@@ -566,6 +2464,8 @@ def build_prompt(question_count: int, language_hint: str = "unknown") -> str:
         "- Exactly one option is correct.\\n"
         "- Keep explanation concise.\\n"
         f"{language_rule}"
+        f"{avoid_rule}"
+        f"{source_rule}"
     )
 
 
@@ -583,13 +2483,78 @@ def extract_text_from_response(response_json: Dict) -> str:
     return "\n".join(texts).strip()
 
 
+THINK_BLOCK_RE = re.compile(r"<think>.*?(</think>|$)", re.DOTALL | re.IGNORECASE)
+CODE_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+QUESTIONS_ARRAY_RE = re.compile(r'"questions"\s*:\s*\[')
+
+
 def parse_model_json(text: str) -> Dict:
-    cleaned = text.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.strip("`")
-        if cleaned.startswith("json"):
-            cleaned = cleaned[4:].strip()
-    return json.loads(cleaned)
+    """Parse model output into {"questions": [...]}, salvaging what it can.
+
+    Reasoning preambles (<think>...</think>), code fences and surrounding prose
+    are ignored. If the document as a whole is not valid JSON, every complete
+    question object in the questions array is kept, so a truncated or chatty
+    response still yields its good questions instead of failing outright.
+    """
+    cleaned = THINK_BLOCK_RE.sub("", text)
+    cleaned = CODE_FENCE_RE.sub("", cleaned).strip()
+
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        increment_metric("model_json_clean")
+        return data
+    if isinstance(data, list):
+        increment_metric("model_json_clean")
+        return {"questions": data}
+
+    items = salvage_question_objects(cleaned)
+    if not items:
+        increment_metric("model_json_unparseable")
+        raise ValueError("Model response did not contain parseable JSON questions.")
+    increment_metric("model_json_salvaged")
+    increment_metric("model_json_salvaged_questions", len(items))
+    return {"questions": items}
+
+
+def salvage_question_objects(text: str) -> List[Dict]:
+    """Decode each syntactically complete object in the questions array."""
+    match = QUESTIONS_ARRAY_RE.search(text)
+    if match is not None:
+        pos = match.end()
+    else:
+        first_array = text.find("[")
+        first_object = text.find("{")
+        if first_array == -1 and first_object == -1:
+            return []
+        starts = [p for p in (first_array, first_object) if p != -1]
+        pos = min(starts)
+        if pos == first_array:
+            pos += 1
+
+    decoder = json.JSONDecoder()
+    items: List[Dict] = []
+    while pos < len(text):
+        start = text.find("{", pos)
+        if start == -1:
+            break
+        try:
+            value, pos = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            # Malformed or truncated object: resume scanning after its opening brace.
+            pos = start + 1
+            continue
+        if isinstance(value, dict) and isinstance(value.get("questions"), list):
+            items.extend(item for item in value["questions"] if isinstance(item, dict))
+        elif isinstance(value, dict):
+            items.append(value)
+        # Stop at the end of the questions array so trailing prose is not scanned.
+        rest = text[pos:].lstrip(" \t\r\n,")
+        if rest.startswith("]"):
+            break
+    return items
 
 
 def text_from_content_items(items: List[Dict]) -> str:
@@ -617,13 +2582,15 @@ def detect_language_hint_from_text(text: str) -> str:
     return "unknown"
 
 
-def validate_questions(data: Dict) -> List[Dict]:
+def validate_questions(data: Dict, source_names: Optional[List[str]] = None) -> List[Dict]:
     questions = data.get("questions")
     if not isinstance(questions, list) or not questions:
         raise ValueError("Model response did not include a valid questions list.")
 
     validated: List[Dict] = []
     for item in questions:
+        if not isinstance(item, dict):
+            continue
         question = item.get("question")
         options = item.get("options")
         correct_index = item.get("correct_index")
@@ -638,14 +2605,17 @@ def validate_questions(data: Dict) -> List[Dict]:
         if not isinstance(explanation, str):
             explanation = ""
 
-        validated.append(
-            {
-                "question": question.strip(),
-                "options": [o.strip() for o in options],
-                "correct_index": correct_index,
-                "explanation": explanation.strip(),
-            }
-        )
+        entry = {
+            "question": question.strip(),
+            "options": [o.strip() for o in options],
+            "correct_index": correct_index,
+            "explanation": explanation.strip(),
+        }
+        source = item.get("source")
+        # Only requested for grouped notes files; an unknown name is dropped and attributed by the caller.
+        if source_names and isinstance(source, str) and source.strip() in source_names:
+            entry["source"] = source.strip()
+        validated.append(entry)
 
     if not validated:
         raise ValueError("No valid questions were produced by the model.")
@@ -653,13 +2623,20 @@ def validate_questions(data: Dict) -> List[Dict]:
     return validated
 
 
-def generate_questions(
+def build_generation_request(
     text_inputs: List[Dict],
     pdf_inputs: List[Dict],
     question_count: int,
     model: str,
     model_tier: str = "pro",
-) -> List[Dict]:
+    avoid_questions: Optional[List[str]] = None,
+    source_names: Optional[List[str]] = None,
+) -> Dict:
+    """Build the provider URL, headers and payload for one generation call.
+
+    Shared by the blocking requests path and the async (ASGI) path so both send
+    byte-identical requests.
+    """
     tier = str(model_tier).strip().lower()
     if tier not in {"pro", "free"}:
         raise ValueError("model_tier must be either 'pro' or 'free'.")
@@ -674,7 +2651,7 @@ def generate_questions(
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY is not set.")
 
-        user_content: List[Dict] = [{"type": "input_text", "text": build_prompt(question_count, language_hint)}]
+        user_content: List[Dict] = [{"type": "input_text", "text": build_prompt(question_count, language_hint, avoid_questions, source_names)}]
         user_content.extend(text_inputs)
         user_content.extend(pdf_inputs)
 
@@ -691,53 +2668,58 @@ def generate_questions(
                 },
             ],
         }
-
-        response = requests.post(
-            OPENAI_URL,
-            headers={
+        return {
+            "tier": tier,
+            "model": model_name,
+            "provider": "OpenAI",
+            "source_names": source_names,
+            "url": OPENAI_URL,
+            "headers": {
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json",
             },
-            json=payload,
-            timeout=300,
-        )
-
-        if response.status_code >= 400:
-            raise RuntimeError(f"OpenAI request failed ({response.status_code}): {response.text}")
+            "payload": payload,
+        }
 
-        raw_text = extract_text_from_response(response.json())
-    else:
-        api_key = get_openrouter_api_key()
-        if not api_key:
-            raise RuntimeError("OPENROUTER_API_KEY is not set.")
-        if pdf_inputs:
-            raise RuntimeError("Free mode currently supports text files only. Use Pro for PDF files.")
+    api_key = get_openrouter_api_key()
+    if not api_key:
+        raise RuntimeError("OPENROUTER_API_KEY is not set.")
+    if pdf_inputs:
+        raise RuntimeError("Free mode currently supports text files only. Use Pro for PDF files.")
 
-        prompt = (
-            f"{build_prompt(question_count, language_hint)}\n\n"
-            f"NOTES:\n{notes_text}"
-        )
-        payload = {
-            "model": model_name,
-            "messages": [
-                {"role": "system", "content": "You are a strict JSON generator for study questions."},
-                {"role": "user", "content": prompt},
-            ],
-            "temperature": 0.2,
-        }
-        headers = {
+    prompt = (
+        f"{build_prompt(question_count, language_hint, avoid_questions, source_names)}\n\n"
+        f"NOTES:\n{notes_text}"
+    )
+    payload = {
+        "model": model_name,
+        "messages": [
+            {"role": "system", "content": "You are a strict JSON generator for study questions."},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.2,
+    }
+    return {
+        "tier": tier,
+        "model": model_name,
+        "provider": "OpenRouter",
+        "source_names": source_names,
+        "url": OPENROUTER_URL,
+        "headers": {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
-        }
-        response = requests.post(
-            OPENROUTER_URL,
-            headers=headers,
-            json=payload,
-            timeout=300,
-        )
-        if response.status_code >= 400:
-            raise RuntimeError(f"OpenRouter request failed ({response.status_code}): {response.text}")
-        body = response.json()
+        },
+        "payload": payload,
+    }
+
+
+def extract_generation_text(generation_request: Dict, status_code: int, body_text: str, body: Dict) -> str:
+    if status_code >= 400:
+        raise RuntimeError(f"{generation_request['provider']} request failed ({status_code}): {body_text}")
+
+    if generation_request["tier"] == "pro":
+        raw_text = extract_text_from_response(body)
+    else:
         raw_text = (
             body.get("choices", [{}])[0]
             .get("message", {})
@@ -747,9 +2729,786 @@ def generate_questions(
 
     if not raw_text:
         raise RuntimeError("Model response did not include text output.")
+    return raw_text
 
-    parsed = parse_model_json(raw_text)
-    return validate_questions(parsed)
+
+def generate_questions(
+    text_inputs: List[Dict],
+    pdf_inputs: List[Dict],
+    question_count: int,
+    model: str,
+    model_tier: str = "pro",
+    source_names: Optional[List[str]] = None,
+) -> List[Dict]:
+    questions_data = request_questions(
+        text_inputs,
+        pdf_inputs,
+        question_count,
+        model,
+        model_tier=model_tier,
+        source_names=source_names,
+    )
+
+    # Top up a shortfall with small follow-up requests instead of returning fewer questions.
+    attempts = 0
+    while len(questions_data) < question_count and attempts < GENERATION_TOPUP_ATTEMPTS:
+        attempts += 1
+        missing = question_count - len(questions_data)
+        check_deadline("topup")
+        increment_metric("topup_requests")
+        try:
+            extra = request_questions(
+                text_inputs,
+                pdf_inputs,
+                missing,
+                model,
+                model_tier=model_tier,
+                avoid_questions=[q["question"] for q in questions_data],
+                retry_count=attempts,
+                source_names=source_names,
+            )
+        except Exception:
+            increment_metric("topup_failures")
+            break
+        questions_data = merge_topup_questions(questions_data, extra, question_count)
+    return questions_data[:question_count]
+
+
+def merge_topup_questions(accepted: List[Dict], extra: List[Dict], question_count: int) -> List[Dict]:
+    seen = {q["question"].casefold() for q in accepted}
+    merged = list(accepted)
+    for question in extra:
+        key = question["question"].casefold()
+        if key in seen or len(merged) >= question_count:
+            continue
+        seen.add(key)
+        merged.append(question)
+    increment_metric("topup_questions", len(merged) - len(accepted))
+    return merged
+
+
+def request_questions(
+    text_inputs: List[Dict],
+    pdf_inputs: List[Dict],
+    question_count: int,
+    model: str,
+    model_tier: str = "pro",
+    avoid_questions: Optional[List[str]] = None,
+    retry_count: int = 0,
+    source_names: Optional[List[str]] = None,
+) -> List[Dict]:
+    generation_request = build_generation_request(
+        text_inputs,
+        pdf_inputs,
+        question_count,
+        model,
+        model_tier=model_tier,
+        avoid_questions=avoid_questions,
+        source_names=source_names,
+    )
+    backup_request = build_backup_request(
+        text_inputs,
+        pdf_inputs,
+        question_count,
+        generation_request,
+        avoid_questions=avoid_questions,
+    )
+    label_usage(generation_request, backup_request, question_count, retry_count)
+    attach_deadline(generation_request, backup_request)
+    if backup_request is None:
+        return call_provider(generation_request)
+
+    questions_data, winner = run_hedged(
+        lambda: call_provider(generation_request),
+        lambda: call_provider(backup_request),
+        hedge_delay_seconds(generation_request),
+        hedge_executor,
+        on_hedge=lambda reason: increment_metric(f"hedges_started_{reason}"),
+        on_skip=lambda reason: increment_metric(f"hedges_skipped_{reason}"),
+    )
+    if winner == "backup":
+        increment_metric("hedge_backup_wins")
+    return questions_data
+
+
+def label_usage(
+    generation_request: Dict,
+    backup_request: Optional[Dict],
+    question_count: int,
+    retry_count: int,
+) -> None:
+    # Captured here because hedged calls run on executor threads without the request's context.
+    labels = {
+        "tenant": current_tenant(),
+        "source_file": current_usage_source(),
+        "requested_questions": question_count,
+        "retry_count": retry_count,
+    }
+    generation_request["usage"] = {**labels, "hedge": False}
+    if backup_request is not None:
+        backup_request["usage"] = {**labels, "hedge": True}
+
+
+def attach_deadline(generation_request: Dict, backup_request: Optional[Dict]) -> None:
+    # Like the usage labels: hedge threads cannot see the request's context variables.
+    deadline = current_deadline()
+    generation_request["deadline"] = deadline
+    if backup_request is not None:
+        backup_request["deadline"] = deadline
+
+
+def provider_call_status(exc: BaseException) -> str:
+    """Usage status of a failed provider call, the same in Flask and ASGI mode."""
+    if isinstance(exc, DeadlineExceeded):
+        return "timeout"
+    if isinstance(exc, RequestCancelled):
+        return "cancelled"
+    return "error"
+
+
+def record_provider_usage(
+    generation_request: Dict,
+    estimated_tokens: int,
+    body: Dict,
+    latency_seconds: float,
+    validated_questions: int,
+    status: str,
+) -> None:
+    # The request's own budget or client ran out; that says nothing about the provider.
+    if status not in ("cancelled", "timeout"):
+        provider_outcomes.record(0.0 if status == "ok" else 1.0)
+    labels = generation_request.get("usage") or {}
+    tokens = parse_provider_usage(body)
+    usage_recorder.record(
+        {
+            "tenant": labels.get("tenant", current_tenant()),
+            "created_at": format_db_timestamp(datetime.now(timezone.utc)),
+            "source_file": labels.get("source_file"),
+            "provider": generation_request["provider"],
+            "model": generation_request["model"],
+            "model_tier": generation_request["tier"],
+            "status": status,
+            "retry_count": labels.get("retry_count", 0),
+            "hedge": int(labels.get("hedge", False)),
+            "requested_questions": labels.get("requested_questions", 0),
+            "validated_questions": validated_questions,
+            "estimated_input_tokens": estimated_tokens,
+            **tokens,
+            "cache_hit": int(tokens["cached_input_tokens"] > 0),
+            "latency_ms": round(latency_seconds * 1000, 1),
+            "cost_usd": estimate_cost(MODEL_PRICING, generation_request["model"], tokens),
+        }
+    )
+
+
+USAGE_ROW_COLUMNS = (
+    "created_at",
+    "source_file",
+    "provider",
+    "model",
+    "model_tier",
+    "status",
+    "retry_count",
+    "hedge",
+    "requested_questions",
+    "validated_questions",
+    "estimated_input_tokens",
+    "input_tokens",
+    "cached_input_tokens",
+    "output_tokens",
+    "cache_hit",
+    "latency_ms",
+    "cost_usd",
+)
+
+
+def write_usage_rows(rows: List[Dict]) -> None:
+    by_tenant: Dict[str, List[Tuple]] = {}
+    for row in rows:
+        by_tenant.setdefault(row["tenant"], []).append(tuple(row[column] for column in USAGE_ROW_COLUMNS))
+    insert = (
+        f"INSERT INTO provider_usage ({', '.join(USAGE_ROW_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in USAGE_ROW_COLUMNS)})"
+    )
+    for tenant, values in by_tenant.items():
+        with tenant_context(tenant):
+            run_write(lambda conn, values=values: conn.executemany(insert, values))
+
+
+usage_recorder = UsageRecorder(write_usage_rows, USAGE_BATCH_SIZE, USAGE_FLUSH_INTERVAL_SECONDS)
+
+
+def aggregate_usage(
+    bucket: str = "day",
+    group_by: Iterable[str] = ("source_file", "model"),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    source_file: str = "",
+    model: str = "",
+) -> Dict:
+    """Sum usage rows per time bucket and the requested dimensions."""
+    if bucket != "none" and bucket not in USAGE_BUCKETS:
+        raise ValueError("bucket must be one of: hour, day, month, none.")
+    group_by = [column for column in group_by if column]
+    unknown = [column for column in group_by if column not in USAGE_GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"group_by must be drawn from: {', '.join(USAGE_GROUP_COLUMNS)}.")
+
+    conditions, params = [], []
+    for op, value in ((">=", since), ("<", until)):
+        if value:
+            try:
+                parsed = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError("since/until must be ISO dates, e.g. 2026-01-31 or 2026-01-31T12:00:00.") from None
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc)
+            conditions.append(f"created_at {op} ?")
+            params.append(parsed.strftime("%Y-%m-%d %H:%M:%S"))
+    for column, value in (("source_file", source_file), ("model", model)):
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+
+    keys = list(group_by)
+    select = list(group_by)
+    if bucket != "none":
+        select.insert(0, f"strftime('{USAGE_BUCKETS[bucket]}', created_at) AS bucket")
+        keys.insert(0, "bucket")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    group = f"GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}" if keys else ""
+
+    # Pending rows are buffered in memory; write them so the report is current.
+    usage_recorder.flush()
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT
+                {''.join(column + ', ' for column in select)}
+                COUNT(*) AS calls,
+                SUM(status != 'ok') AS errors,
+                SUM(retry_count > 0) AS retries,
+                SUM(hedge) AS hedged_calls,
+                SUM(cache_hit) AS cache_hits,
+                SUM(requested_questions) AS requested_questions,
+                SUM(validated_questions) AS validated_questions,
+                SUM(estimated_input_tokens) AS estimated_input_tokens,
+                SUM(input_tokens) AS input_tokens,
+                SUM(cached_input_tokens) AS cached_input_tokens,
+                SUM(output_tokens) AS output_tokens,
+                AVG(latency_ms) AS avg_latency_ms,
+                MAX(latency_ms) AS max_latency_ms,
+                SUM(latency_ms) AS total_latency_ms,
+                SUM(cost_usd) AS cost_usd,
+                SUM(cost_usd IS NULL) AS unpriced_calls
+            FROM provider_usage
+            {where}
+            {group}
+            """,
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    items = []
+    for row in rows:
+        item = dict(row)
+        if not item["calls"]:
+            continue
+        item["avg_latency_ms"] = round(item["avg_latency_ms"], 1)
+        input_tokens = item["input_tokens"] or item["estimated_input_tokens"]
+        # How latency scales with prompt size, for capacity planning.
+        item["latency_ms_per_1k_input_tokens"] = (
+            round(item.pop("total_latency_ms") / input_tokens * 1000, 1) if input_tokens else None
+        )
+        item["cost_usd"] = round(item["cost_usd"], 6) if item["cost_usd"] is not None else None
+        items.append(item)
+    return {"bucket": bucket, "group_by": group_by, "items": items}
+
+
+def latency_key(generation_request: Dict) -> str:
+    return f"{generation_request['provider']}/{generation_request['model']}".lower()
+
+
+def hedge_delay_seconds(generation_request: Dict) -> float:
+    observed = provider_latency.percentile(latency_key(generation_request), HEDGE_PERCENTILE)
+    return observed if observed is not None else HEDGE_DEFAULT_DELAY_SECONDS
+
+
+def build_backup_request(
+    text_inputs: List[Dict],
+    pdf_inputs: List[Dict],
+    question_count: int,
+    generation_request: Dict,
+    avoid_questions: Optional[List[str]] = None,
+) -> Optional[Dict]:
+    if not HEDGE_ENABLED:
+        return None
+    backup = HEDGE_BACKUPS.get(generation_request["model"])
+    if not isinstance(backup, dict) or not backup.get("model"):
+        return None
+    try:
+        return build_generation_request(
+            text_inputs,
+            pdf_inputs,
+            question_count,
+            backup["model"],
+            model_tier=backup.get("model_tier", generation_request["tier"]),
+            avoid_questions=avoid_questions,
+            source_names=generation_request.get("source_names"),
+        )
+    except (RuntimeError, ValueError):
+        # Backup cannot serve these inputs (e.g. PDFs on the free tier, missing key).
+        return None
+
+
+def call_provider(generation_request: Dict) -> List[Dict]:
+    """One admitted provider round trip, returning validated questions."""
+    deadline = generation_request.get("deadline")
+    estimated_tokens = estimate_input_tokens(generation_request["payload"])
+    ticket = admission.acquire(
+        generation_request["provider"],
+        generation_request["model"],
+        estimated_tokens,
+        timeout=call_timeout(deadline, "admission", ADMISSION_MAX_WAIT_SECONDS),
+    )
+    started = time.perf_counter()
+    body: Dict = {}
+    try:
+        try:
+            response = requests.post(
+                generation_request["url"],
+                headers=generation_request["headers"],
+                json=generation_request["payload"],
+                timeout=call_timeout(deadline, "provider", PROVIDER_TIMEOUT_SECONDS),
+            )
+        except requests.Timeout as exc:
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded("provider", deadline.budget) from exc
+            raise
+        finally:
+            admission.release(ticket)
+        body = response.json() if response.status_code < 400 else {}
+        raw_text = extract_generation_text(generation_request, response.status_code, response.text, body)
+
+        parsed = parse_model_json(raw_text)
+        questions_data = validate_questions(parsed, generation_request.get("source_names"))
+    except Exception as exc:
+        record_provider_usage(
+            generation_request, estimated_tokens, body, time.perf_counter() - started, 0, provider_call_status(exc)
+        )
+        raise
+    elapsed = time.perf_counter() - started
+    provider_latency.record(latency_key(generation_request), elapsed)
+    record_provider_usage(generation_request, estimated_tokens, body, elapsed, len(questions_data), "ok")
+    return questions_data
+
+
+def parse_questions_options(body: Dict) -> Dict:
+    model_tier = body.get("model_tier", "pro")
+    tier = str(model_tier).strip().lower()
+    default_model = DEFAULT_MODEL if tier == "pro" else DEFAULT_OPENROUTER_MODEL
+    model = body.get("model", default_model)
+    question_count = int(body.get("question_count", 5))
+    if question_count < 1 or question_count > 30:
+        raise ValueError("question_count must be between 1 and 30.")
+
+    mode = str(body.get("mode", "combined")).strip().lower()
+    if mode not in {"combined", "per_file"}:
+        raise ValueError("mode must be either 'combined' or 'per_file'.")
+
+    notes_dir_value = body.get("notes_dir")
+    notes_dir = Path(notes_dir_value).expanduser().resolve() if notes_dir_value else DEFAULT_NOTES_DIR
+    return {
+        "question_count": question_count,
+        "model_tier": model_tier,
+        "model": model,
+        "notes_dir": notes_dir,
+        "mode": mode,
+    }
+
+
+def parse_upload_options(form) -> Dict:
+    model_tier = form.get("model_tier", "pro")
+    default_model = DEFAULT_MODEL if str(model_tier).lower() == "pro" else DEFAULT_OPENROUTER_MODEL
+    model = form.get("model", default_model)
+    question_count = int(form.get("question_count", 10))
+    override = str(form.get("override", "false")).lower() == "true"
+    if question_count < 1 or question_count > 30:
+        raise ValueError("question_count must be between 1 and 30.")
+    return {
+        "question_count": question_count,
+        "model_tier": model_tier,
+        "model": model,
+        "override": override,
+    }
+
+
+def parse_more_options(body: Dict) -> Dict:
+    source_file = normalize_upload_filename(str(body.get("source_file", "")))
+    model_tier = str(body.get("model_tier", "pro")).strip().lower()
+    if model_tier not in {"pro", "free"}:
+        raise ValueError("model_tier must be either 'pro' or 'free'.")
+    default_model = DEFAULT_MODEL if model_tier == "pro" else DEFAULT_OPENROUTER_MODEL
+    model = str(body.get("model", default_model)).strip() or default_model
+    return {
+        "source_file": source_file,
+        "model_tier": model_tier,
+        "model": model,
+    }
+
+
+def file_exists_error(file_name: str) -> Dict:
+    return {
+        "error": f"File '{file_name}' is already uploaded.",
+        "code": "file_exists",
+        "file_name": file_name,
+    }
+
+
+def max_reached_error(source_file: str, current_total: int) -> Dict:
+    return {
+        "error": f"Maximum {MAX_QUESTIONS_PER_SOURCE} questions reached for '{source_file}'.",
+        "code": "max_reached",
+        "total_questions_for_source": current_total,
+        "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
+    }
+
+
+def parse_answer_event(body: Dict) -> Dict:
+    question = body.get("question", "")
+    options = body.get("options", [])
+    correct_index = body.get("correct_index")
+    selected_index = body.get("selected_index")
+    source_file = body.get("source_file", "")
+    model = body.get("model", DEFAULT_MODEL)
+
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("question is required.")
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(o, str) for o in options):
+        raise ValueError("options must be a list of exactly 4 strings.")
+    if not isinstance(correct_index, int) or correct_index < 0 or correct_index > 3:
+        raise ValueError("correct_index must be 0..3.")
+    if not isinstance(selected_index, int) or selected_index < 0 or selected_index > 3:
+        raise ValueError("selected_index must be 0..3.")
+
+    return {
+        "source_file": source_file,
+        "question": question.strip(),
+        "options": [str(o).strip() for o in options],
+        "correct_index": correct_index,
+        "selected_index": selected_index,
+        "model": str(model),
+    }
+
+
+def versioned_json_response(scope: str, build_payload: Callable[[], Dict]):
+    """Serve a listing with an ETag tied to a data version counter.
+
+    A matching If-None-Match returns 304 before the listing query runs.
+    If-Modified-Since is not honoured: `updated_at` has one-second resolution,
+    so a write in the same second as the cached response would look unchanged.
+    """
+    with stage("version_check"):
+        version, updated_at, epoch = get_data_version(scope)
+    # Tenants' shards count versions independently, so the tenant and the
+    # shard's epoch are part of the tag.
+    etag_key = f"{current_tenant()}|{epoch}|{request.full_path}|{scope}|{version}"
+    etag = hashlib.sha1(etag_key.encode("utf-8")).hexdigest()[:20]
+    last_modified = (
+        datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc) if updated_at else None
+    )
+
+    not_modified = bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        with stage("query"):
+            payload = build_payload()
+        with stage("serialize"):
+            response = jsonify(payload)
+    annotate(not_modified=not_modified)
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add(TENANT_HEADER)
+    return response
+
+
+def rate_limited_error(exc: AdmissionRejected) -> Dict:
+    return {
+        "error": str(exc),
+        "code": "rate_limited",
+        "retry_after": exc.retry_after,
+    }
+
+
+def deadline_error(exc: Exception) -> Tuple[Dict, int]:
+    """Body and status for a request stopped by its deadline or abandoned by its client."""
+    if isinstance(exc, RequestCancelled):
+        increment_metric("requests_cancelled")
+        increment_metric(f"requests_cancelled_{exc.stage}")
+        # 499 is nginx's "client closed request"; nobody is left to read it.
+        return {"error": str(exc), "code": "cancelled"}, 499
+    increment_metric("deadline_exceeded")
+    increment_metric(f"deadline_exceeded_{exc.stage}")
+    return {"error": str(exc), "code": "deadline_exceeded", "budget_seconds": exc.budget}, 504
+
+
+def generation_flight_key(
+    kind: str,
+    file_name: str,
+    data: bytes,
+    model_tier: str,
+    model: str,
+    question_count: int,
+) -> Tuple:
+    return (
+        kind,
+        current_tenant(),
+        file_name,
+        hashlib.sha256(data).hexdigest(),
+        str(model_tier).strip().lower(),
+        str(model).strip(),
+        question_count,
+    )
+
+
+def plan_batch_upload(uploads: List[Tuple[str, bytes]], override: bool) -> Tuple[List[Tuple[int, str, bytes]], List[Dict]]:
+    """Split a multi-file upload into files to generate and immediate per-file errors.
+
+    Duplicate names are checked against the database in one query.
+    """
+    if not uploads:
+        raise ValueError("No files uploaded.")
+    if len(uploads) > MAX_UPLOAD_BATCH_FILES:
+        raise ValueError(f"At most {MAX_UPLOAD_BATCH_FILES} files can be uploaded at once.")
+
+    accepted: List[Tuple[int, str, bytes]] = []
+    rejected: List[Dict] = []
+    seen = set()
+    for index, (raw_name, data) in enumerate(uploads):
+        try:
+            file_name = normalize_upload_filename(raw_name)
+        except ValueError as exc:
+            rejected.append(batch_upload_error(index, raw_name, 400, {"error": str(exc)}))
+            continue
+        if file_name in seen:
+            rejected.append(batch_upload_error(index, file_name, 400, {"error": "File name appears more than once."}))
+        elif not data:
+            rejected.append(batch_upload_error(index, file_name, 400, {"error": "Uploaded file is empty."}))
+        else:
+            seen.add(file_name)
+            accepted.append((index, file_name, data))
+
+    existing = set() if override else existing_uploaded_files([name for _, name, _ in accepted])
+    for index, file_name, _data in accepted:
+        if file_name in existing:
+            rejected.append(batch_upload_error(index, file_name, 409, file_exists_error(file_name)))
+    return [item for item in accepted if item[1] not in existing], rejected
+
+
+def batch_upload_error(index: int, file_name: str, status: int, body: Dict) -> Dict:
+    return {"index": index, "file_name": file_name, "status": status, **body}
+
+
+def batch_upload_failure(index: int, file_name: str, exc: Exception) -> Dict:
+    if isinstance(exc, AdmissionRejected):
+        return batch_upload_error(index, file_name, 429, rate_limited_error(exc))
+    if isinstance(exc, (DeadlineExceeded, RequestCancelled)):
+        body, status = deadline_error(exc)
+        return batch_upload_error(index, file_name, status, body)
+    if isinstance(exc, SourceCapReached):
+        return batch_upload_error(index, file_name, 400, max_reached_error(exc.source_file, exc.current_total))
+    return batch_upload_error(index, file_name, 400, {"error": str(exc)})
+
+
+def batch_upload_summary(outcomes: List[Dict], started: float) -> Dict:
+    succeeded = sum(1 for outcome in outcomes if outcome["status"] == 200)
+    return {
+        "type": "summary",
+        "files": len(outcomes),
+        "succeeded": succeeded,
+        "failed": len(outcomes) - succeeded,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def generate_batch_upload_file(index: int, file_name: str, file_bytes: bytes, options: Dict) -> Dict:
+    started = time.perf_counter()
+    try:
+        key = generation_flight_key(
+            "upload",
+            file_name,
+            file_bytes,
+            options["model_tier"],
+            options["model"],
+            options["question_count"],
+        )
+        payload, coalesced = generation_flights.do(
+            key,
+            lambda: generate_for_upload(file_name, file_bytes, options),
+        )
+    except Exception as exc:
+        outcome = batch_upload_failure(index, file_name, exc)
+    else:
+        outcome = {"index": index, "file_name": file_name, "status": 200, **payload, "coalesced": coalesced}
+    outcome["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return outcome
+
+
+def upload_pdf_classification(file_name: str, file_bytes: bytes) -> Optional[Dict]:
+    if Path(file_name).suffix.lower() != ".pdf":
+        return None
+    return classify_pdf(file_bytes)
+
+
+def generate_for_upload(file_name: str, file_bytes: bytes, options: Dict) -> Dict:
+    model = options["model"]
+    model_tier = options["model_tier"]
+    with stage("extract"):
+        text_inputs, pdf_inputs, source_files = load_uploaded_file_content(
+            file_name,
+            file_bytes,
+            model_tier=model_tier,
+        )
+        pdf_classification = upload_pdf_classification(file_name, file_bytes)
+    # Uploads are not capped, but their reservation is visible to concurrent "more" calls.
+    with stage("reserve"):
+        reservation_id, question_count = reserve_generation_slots(
+            file_name,
+            options["question_count"],
+            enforce_cap=False,
+        )
+    try:
+        with stage("generate"), usage_source(source_files[0]):
+            questions_data = generate_questions(
+                text_inputs,
+                pdf_inputs,
+                question_count,
+                model,
+                model_tier=model_tier,
+            )[:question_count]
+        with stage("store"):
+            check_deadline("store")
+            upsert_uploaded_file(file_name)
+            upsert_uploaded_file_source(
+                file_name,
+                file_bytes,
+                pdf_kind=pdf_classification["kind"] if pdf_classification else None,
+            )
+            store_generated_questions(source_files, model, questions_data, reservation_id=reservation_id)
+    except Exception:
+        release_generation_reservation(reservation_id)
+        raise
+
+    return {
+        "questions": questions_data,
+        "source_files": source_files,
+        "model": model,
+        "model_tier": model_tier,
+        "total_questions_for_source": count_generated_questions_by_source(file_name),
+        "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
+        "normalization": upload_normalization_stats(file_name, text_inputs),
+        "pdf_classification": pdf_classification,
+    }
+
+
+def generate_more_for_source(source_file: str, source_data: bytes, options: Dict) -> Dict:
+    model = options["model"]
+    model_tier = options["model_tier"]
+    with stage("reserve"):
+        reservation_id, question_count = reserve_generation_slots(source_file, MORE_QUESTIONS_BATCH)
+    try:
+        with stage("extract"):
+            text_inputs, pdf_inputs, source_files = load_uploaded_file_content(
+                source_file,
+                source_data,
+                model_tier=model_tier,
+            )
+        with stage("generate"), usage_source(source_files[0]):
+            questions_data = generate_questions(
+                text_inputs,
+                pdf_inputs,
+                question_count,
+                model,
+                model_tier=model_tier,
+            )[:question_count]
+        with stage("store"):
+            store_generated_questions(source_files, model, questions_data, reservation_id=reservation_id)
+    except Exception:
+        release_generation_reservation(reservation_id)
+        raise
+
+    return {
+        "questions": questions_data,
+        "source_files": source_files,
+        "model": model,
+        "model_tier": model_tier,
+        "total_questions_for_source": count_generated_questions_by_source(source_file),
+        "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
+    }
+
+
+@app.before_request
+def bind_tenant():
+    try:
+        tenant = normalize_tenant_id(request.headers.get(TENANT_HEADER))
+    except ValueError as exc:
+        return jsonify({"error": str(exc), "code": "invalid_tenant"}), 400
+    g.tenant_token = set_current_tenant(tenant)
+    return None
+
+
+@app.teardown_request
+def unbind_tenant(_exc: Optional[BaseException]) -> None:
+    token = g.pop("tenant_token", None)
+    if token is not None:
+        reset_current_tenant(token)
+
+
+@app.before_request
+def start_generation_request() -> None:
+    if request.endpoint in GENERATION_ENDPOINTS:
+        g.deadline_token = set_current_deadline(Deadline(GENERATION_BUDGET_SECONDS))
+        generations_in_flight.enter()
+
+
+@app.teardown_request
+def finish_generation_request(_exc: Optional[BaseException]) -> None:
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        reset_current_deadline(token)
+        generations_in_flight.exit()
+
+
+@app.before_request
+def start_request_trace() -> None:
+    if not request_profiler.enabled or request.endpoint not in PROFILED_ENDPOINTS:
+        return
+    g.request_trace = request_profiler.start(request.method, request.path, request.headers)
+    annotate(tenant=current_tenant())
+
+
+@app.after_request
+def finish_request_trace(response: Response) -> Response:
+    trace = g.pop("request_trace", None)
+    if trace is not None:
+        profile_file = request_profiler.finish(trace, response.status_code)
+        if profile_file:
+            response.headers["X-Profile-Id"] = profile_file
+    return response
+
+
+@app.teardown_request
+def abandon_request_trace(_exc: Optional[BaseException]) -> None:
+    # after_request is skipped when a view raises; still stop the profiler.
+    trace = g.pop("request_trace", None)
+    if trace is not None:
+        request_profiler.finish(trace, 500)
 
 
 @app.route("/")
@@ -762,31 +3521,100 @@ def health() -> Dict:
     return jsonify({"ok": True})
 
 
+def readiness_report() -> Dict:
+    writer_stats = db_writer_stats()
+    signals = {
+        "in_flight_generations": generations_in_flight.value,
+        "admission_queue_depth": admission.snapshot()["max_provider_queue_depth"],
+        "db_write_queue_depth": writer_stats["queue_depth"],
+        "db_write_p95_ms": percentile(db_write_latency_ms.values(), 0.95),
+        "provider_error_rate": error_rate(provider_outcomes.values(), READY_MIN_PROVIDER_CALLS),
+    }
+    limits = {
+        "in_flight_generations": READY_MAX_IN_FLIGHT,
+        "admission_queue_depth": READY_MAX_ADMISSION_QUEUE,
+        "db_write_queue_depth": READY_MAX_DB_WRITE_QUEUE,
+        "db_write_p95_ms": READY_MAX_DB_WRITE_P95_MS,
+        "provider_error_rate": READY_MAX_PROVIDER_ERROR_RATE,
+    }
+    failing = failing_checks(signals, limits)
+    return {
+        "ready": not failing,
+        "failing": failing,
+        "signals": {name: round(value, 3) if isinstance(value, float) else value for name, value in signals.items()},
+        "limits": limits,
+        "window_seconds": READY_WINDOW_SECONDS,
+    }
+
+
+@app.route("/api/ready")
+def ready() -> Tuple[Dict, int]:
+    """Readiness for load balancers: 503 while any load signal is past its limit.
+
+    Liveness stays on /api/health, so a busy instance is taken out of rotation
+    without being restarted.
+    """
+    report = readiness_report()
+    if not report["ready"]:
+        increment_metric("readiness_not_ready")
+    return jsonify(report), 200 if report["ready"] else 503
+
+
+@app.route("/api/metrics")
+def metrics() -> Dict:
+    return jsonify(
+        {
+            "admission": admission.snapshot(),
+            "db_writer": db_writer_stats(),
+            "counters": metric_snapshot(),
+            "json_backend": serialization.serializer.name,
+            "documents": {"tracked": len(document_stats)},
+            "usage": usage_recorder.stats(),
+            "profiling": request_profiler.snapshot(),
+            "provider_latency": provider_latency.snapshot(),
+            "generation_flights": {
+                "in_flight": generation_flights.in_flight(),
+                "coalesced_waiters": generation_flights.waiting(),
+            },
+        }
+    )
+
+
 @app.route("/api/questions", methods=["POST"])
 def questions() -> Tuple[Dict, int]:
     body = request.get_json(silent=True) or {}
-    question_count = body.get("question_count", 5)
-    model_tier = body.get("model_tier", "pro")
-    tier = str(model_tier).strip().lower()
-    default_model = DEFAULT_MODEL if tier == "pro" else DEFAULT_OPENROUTER_MODEL
-    model = body.get("model", default_model)
 
     try:
-        question_count = int(question_count)
-        if question_count < 1 or question_count > 30:
-            raise ValueError("question_count must be between 1 and 30.")
+        options = parse_questions_options(body)
+        model = options["model"]
+        model_tier = options["model_tier"]
 
-        notes_dir_value = body.get("notes_dir")
-        notes_dir = Path(notes_dir_value).expanduser().resolve() if notes_dir_value else DEFAULT_NOTES_DIR
+        if options["mode"] == "per_file":
+            documents = load_notes_documents(options["notes_dir"])
+            result = generate_notes_per_file(documents, options["question_count"], model, model_tier)
+            return (
+                jsonify(
+                    {
+                        **result,
+                        "model": model,
+                        "model_tier": model_tier,
+                        "notes_dir": str(options["notes_dir"]),
+                        "mode": "per_file",
+                    }
+                ),
+                200,
+            )
 
-        text_inputs, pdf_inputs, source_files = load_notes_content(notes_dir)
-        questions_data = generate_questions(
-            text_inputs,
-            pdf_inputs,
-            question_count,
-            model,
-            model_tier=model_tier,
-        )
+        text_inputs, pdf_inputs, source_files = load_notes_content(options["notes_dir"])
+        # Attributed like the stored questions: to the first source file.
+        with usage_source(source_files[0] if source_files else None):
+            questions_data = generate_questions(
+                text_inputs,
+                pdf_inputs,
+                options["question_count"],
+                model,
+                model_tier=model_tier,
+            )
         store_generated_questions(source_files, model, questions_data)
 
         return (
@@ -796,11 +3624,16 @@ def questions() -> Tuple[Dict, int]:
                     "source_files": source_files,
                     "model": model,
                     "model_tier": model_tier,
-                    "notes_dir": str(notes_dir),
+                    "notes_dir": str(options["notes_dir"]),
                 }
             ),
             200,
         )
+    except AdmissionRejected as exc:
+        return jsonify(rate_limited_error(exc)), 429, {"Retry-After": str(exc.retry_after)}
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        body, status = deadline_error(exc)
+        return jsonify(body), status
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
@@ -808,160 +3641,193 @@ def questions() -> Tuple[Dict, int]:
 @app.route("/api/questions/upload", methods=["POST"])
 def questions_upload() -> Tuple[Dict, int]:
     try:
-        model_tier = request.form.get("model_tier", "pro")
-        default_model = DEFAULT_MODEL if str(model_tier).lower() == "pro" else DEFAULT_OPENROUTER_MODEL
-        model = request.form.get("model", default_model)
-        question_count = int(request.form.get("question_count", 10))
-        override = str(request.form.get("override", "false")).lower() == "true"
-        if question_count < 1 or question_count > 30:
-            raise ValueError("question_count must be between 1 and 30.")
+        options = parse_upload_options(request.form)
+        model = options["model"]
+        model_tier = options["model_tier"]
 
         upload = request.files.get("file")
         if upload is None or not upload.filename:
             raise ValueError("No file uploaded.")
 
         file_name = normalize_upload_filename(upload.filename)
-        if has_uploaded_file(file_name) and not override:
-            return (
-                jsonify(
-                    {
-                        "error": f"File '{file_name}' is already uploaded.",
-                        "code": "file_exists",
-                        "file_name": file_name,
-                    }
-                ),
-                409,
-            )
+        if has_uploaded_file(file_name) and not options["override"]:
+            return jsonify(file_exists_error(file_name)), 409
 
-        file_bytes = upload.read()
+        with stage("read_upload"):
+            file_bytes = upload.read()
         if not file_bytes:
             raise ValueError("Uploaded file is empty.")
+        annotate(file_name=file_name, file_bytes=len(file_bytes), model=model, model_tier=model_tier)
 
-        text_inputs, pdf_inputs, source_files = load_uploaded_file_content(
-            file_name,
-            file_bytes,
-            model_tier=model_tier,
+        key = generation_flight_key("upload", file_name, file_bytes, model_tier, model, options["question_count"])
+        payload, coalesced = generation_flights.do(
+            key,
+            lambda: generate_for_upload(file_name, file_bytes, options),
         )
-        questions_data = generate_questions(
-            text_inputs,
-            pdf_inputs,
-            question_count,
-            model,
-            model_tier=model_tier,
-        )
-        upsert_uploaded_file(file_name)
-        upsert_uploaded_file_source(file_name, file_bytes)
-        store_generated_questions(source_files, model, questions_data)
-        total_questions_for_source = count_generated_questions_by_source(file_name)
+        annotate(coalesced=coalesced)
+        return jsonify({**payload, "coalesced": coalesced}), 200
+    except AdmissionRejected as exc:
+        return jsonify(rate_limited_error(exc)), 429, {"Retry-After": str(exc.retry_after)}
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        body, status = deadline_error(exc)
+        return jsonify(body), status
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
 
-        return (
-            jsonify(
-                {
-                    "questions": questions_data,
-                    "source_files": source_files,
-                    "model": model,
-                    "model_tier": model_tier,
-                    "total_questions_for_source": total_questions_for_source,
-                    "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
-                }
-            ),
-            200,
-        )
+
+@app.route("/api/questions/upload/batch", methods=["POST"])
+def questions_upload_batch():
+    """Generate for several uploaded files at once.
+
+    Files are processed concurrently on `upload_executor`. With `stream=true`
+    (or `Accept: application/x-ndjson`) each file's result is sent as an NDJSON
+    line as soon as it completes, followed by a summary line; otherwise one
+    JSON object with all results is returned.
+    """
+    started = time.perf_counter()
+    try:
+        options = parse_upload_options(request.form)
+        uploads = [
+            (upload.filename or "", upload.read())
+            for upload in request.files.getlist("files") + request.files.getlist("file")
+        ]
+        accepted, rejected = plan_batch_upload(uploads, options["override"])
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
+    futures = [
+        # Each task gets its own context copy so the tenant follows it to the worker.
+        upload_executor.submit(contextvars.copy_context().run, generate_batch_upload_file, index, name, data, options)
+        for index, name, data in accepted
+    ]
+    stream = (
+        request.args.get("stream", "").strip().lower() == "true"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    )
+    if stream:
+        deadline = current_deadline()
+
+        def lines() -> Iterator[bytes]:
+            outcomes = list(rejected)
+            finished = False
+            try:
+                for outcome in rejected:
+                    yield serialization.serializer.dumps_bytes({"type": "file", **outcome}) + b"\n"
+                for future in as_completed(futures):
+                    outcome = future.result()
+                    outcomes.append(outcome)
+                    yield serialization.serializer.dumps_bytes({"type": "file", **outcome}) + b"\n"
+                finished = True
+                yield serialization.serializer.dumps_bytes(batch_upload_summary(outcomes, started)) + b"\n"
+            finally:
+                if not finished:
+                    # The server closes the generator when the client disconnects:
+                    # drop queued files and stop running ones at their next check.
+                    increment_metric("batch_streams_abandoned")
+                    for future in futures:
+                        future.cancel()
+                    if deadline is not None:
+                        deadline.cancel()
+
+        # Keeping the request context open until the stream ends defers the
+        # teardown, so the request stays counted as in flight while files are
+        # still being generated.
+        return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+    outcomes = rejected + [future.result() for future in futures]
+    outcomes.sort(key=lambda outcome: outcome["index"])
+    summary = batch_upload_summary(outcomes, started)
+    summary.pop("type")
+    return jsonify({"files": outcomes, "summary": summary}), 200
+
 
 @app.route("/api/wrong-answer", methods=["POST"])
 def wrong_answer() -> Tuple[Dict, int]:
     try:
         body = request.get_json(silent=True) or {}
-        question = body.get("question", "")
-        options = body.get("options", [])
-        correct_index = body.get("correct_index")
-        selected_index = body.get("selected_index")
-        source_file = body.get("source_file", "")
-        model = body.get("model", DEFAULT_MODEL)
-
-        if not isinstance(question, str) or not question.strip():
-            raise ValueError("question is required.")
-        if not isinstance(options, list) or len(options) != 4 or not all(isinstance(o, str) for o in options):
-            raise ValueError("options must be a list of exactly 4 strings.")
-        if not isinstance(correct_index, int) or correct_index < 0 or correct_index > 3:
-            raise ValueError("correct_index must be 0..3.")
-        if not isinstance(selected_index, int) or selected_index < 0 or selected_index > 3:
-            raise ValueError("selected_index must be 0..3.")
-        if selected_index == correct_index:
+        event = parse_answer_event(body)
+        if event["selected_index"] == event["correct_index"]:
+            # Not a wrong answer, but a question under review still moves on its schedule.
+            store_correct_answer(
+                source_file=event["source_file"],
+                question=event["question"],
+                options=event["options"],
+                correct_index=event["correct_index"],
+            )
             return jsonify({"ok": True, "stored": False}), 200
 
-        store_wrong_answer(
-            source_file=source_file,
-            question=question.strip(),
-            options=[str(o).strip() for o in options],
-            correct_index=correct_index,
-            selected_index=selected_index,
-            model=str(model),
-        )
+        store_wrong_answer(**event)
         return jsonify({"ok": True, "stored": True}), 200
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
 
+@app.route("/api/answers/batch", methods=["POST"])
+def answers_batch() -> Tuple[Dict, int]:
+    try:
+        body = request.get_json(silent=True) or {}
+        session_id = str(body.get("session_id", "")).strip()
+        answers = body.get("answers")
+        if not session_id:
+            raise ValueError("session_id is required.")
+        if not isinstance(answers, list) or not answers:
+            raise ValueError("answers must be a non-empty list.")
+        if len(answers) > MAX_ANSWER_BATCH:
+            raise ValueError(f"answers must contain at most {MAX_ANSWER_BATCH} items.")
+
+        events: List[Dict] = []
+        for position, item in enumerate(answers):
+            if not isinstance(item, dict):
+                raise ValueError(f"answers[{position}] must be an object.")
+            try:
+                event = parse_answer_event(item)
+            except ValueError as exc:
+                raise ValueError(f"answers[{position}]: {exc}") from None
+            event["idempotency_key"] = answer_idempotency_key(
+                session_id,
+                position,
+                event,
+                item.get("idempotency_key"),
+            )
+            events.append(event)
+
+        result = store_answer_batch(session_id, events)
+        return jsonify({"ok": True, "session_id": session_id, **result}), 200
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+
 @app.route("/api/questions/more", methods=["POST"])
 def more_questions() -> Tuple[Dict, int]:
     try:
         body = request.get_json(silent=True) or {}
-        source_file = normalize_upload_filename(str(body.get("source_file", "")))
-        model_tier = str(body.get("model_tier", "pro")).strip().lower()
-        if model_tier not in {"pro", "free"}:
-            raise ValueError("model_tier must be either 'pro' or 'free'.")
-        default_model = DEFAULT_MODEL if model_tier == "pro" else DEFAULT_OPENROUTER_MODEL
-        model = str(body.get("model", default_model)).strip() or default_model
+        options = parse_more_options(body)
+        source_file = options["source_file"]
+        model = options["model"]
+        model_tier = options["model_tier"]
 
+        # Cheap early exit; the reservation inside the flight is the authoritative check.
         current_total = count_generated_questions_by_source(source_file)
         if current_total >= MAX_QUESTIONS_PER_SOURCE:
-            return (
-                jsonify(
-                    {
-                        "error": f"Maximum {MAX_QUESTIONS_PER_SOURCE} questions reached for '{source_file}'.",
-                        "code": "max_reached",
-                        "total_questions_for_source": current_total,
-                        "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
-                    }
-                ),
-                400,
-            )
-
-        remaining = MAX_QUESTIONS_PER_SOURCE - current_total
-        question_count = min(MORE_QUESTIONS_BATCH, remaining)
-        source_data = get_uploaded_file_source(source_file)
-        text_inputs, pdf_inputs, source_files = load_uploaded_file_content(
-            source_file,
-            source_data,
-            model_tier=model_tier,
-        )
-        questions_data = generate_questions(
-            text_inputs,
-            pdf_inputs,
-            question_count,
-            model,
-            model_tier=model_tier,
-        )
-        store_generated_questions(source_files, model, questions_data)
-        updated_total = count_generated_questions_by_source(source_file)
-
-        return (
-            jsonify(
-                {
-                    "questions": questions_data,
-                    "source_files": source_files,
-                    "model": model,
-                    "model_tier": model_tier,
-                    "total_questions_for_source": updated_total,
-                    "max_questions_per_source": MAX_QUESTIONS_PER_SOURCE,
-                }
-            ),
-            200,
+            return jsonify(max_reached_error(source_file, current_total)), 400
+
+        with stage("load_source"):
+            source_data = get_uploaded_file_source(source_file)
+        annotate(source_file=source_file, model=model, model_tier=model_tier)
+        key = generation_flight_key("more", source_file, source_data, model_tier, model, MORE_QUESTIONS_BATCH)
+        payload, coalesced = generation_flights.do(
+            key,
+            lambda: generate_more_for_source(source_file, source_data, options),
         )
+        annotate(coalesced=coalesced)
+        return jsonify({**payload, "coalesced": coalesced}), 200
+    except SourceCapReached as exc:
+        return jsonify(max_reached_error(exc.source_file, exc.current_total)), 400
+    except AdmissionRejected as exc:
+        return jsonify(rate_limited_error(exc)), 429, {"Retry-After": str(exc.retry_after)}
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        body, status = deadline_error(exc)
+        return jsonify(body), status
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
@@ -974,9 +3840,23 @@ def wrong_answers() -> Tuple[Dict, int]:
             raise ValueError("limit must be between 1 and 500.")
         source_file = request.args.get("source_file", "").strip()
         if source_file:
-            items = list_wrong_answers_by_source(source_file=source_file, limit=limit)
-        else:
-            items = list_wrong_answers(limit=limit)
+            return versioned_json_response(
+                source_version_scope(source_file),
+                lambda: {"items": list_wrong_answers_by_source(source_file=source_file, limit=limit)},
+            )
+        return versioned_json_response(GLOBAL_VERSION_SCOPE, lambda: {"items": list_wrong_answers(limit=limit)})
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+
+@app.route("/api/review/next", methods=["GET"])
+def review_next() -> Tuple[Dict, int]:
+    try:
+        limit = int(request.args.get("limit", 20))
+        if limit < 1 or limit > 200:
+            raise ValueError("limit must be between 1 and 200.")
+        source_file = request.args.get("source_file", "").strip()
+        items = list_due_review_items(limit=limit, source_file=source_file)
         return jsonify({"items": items}), 200
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
@@ -985,8 +3865,7 @@ def wrong_answers() -> Tuple[Dict, int]:
 @app.route("/api/error-collections", methods=["GET"])
 def error_collections() -> Tuple[Dict, int]:
     try:
-        items = list_error_collections()
-        return jsonify({"items": items}), 200
+        return versioned_json_response(GLOBAL_VERSION_SCOPE, lambda: {"items": list_error_collections()})
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
@@ -1007,8 +3886,7 @@ def delete_error_collections() -> Tuple[Dict, int]:
 @app.route("/api/favorite-collections", methods=["GET"])
 def favorite_collections() -> Tuple[Dict, int]:
     try:
-        items = list_generated_collections()
-        return jsonify({"items": items}), 200
+        return versioned_json_response(GLOBAL_VERSION_SCOPE, lambda: {"items": list_generated_collections()})
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
@@ -1035,11 +3913,104 @@ def generated_questions() -> Tuple[Dict, int]:
         source_file = request.args.get("source_file", "").strip()
         if not source_file:
             raise ValueError("source_file is required.")
-        items = list_generated_questions_by_source(source_file=source_file, limit=limit)
-        return jsonify({"items": items}), 200
+        return versioned_json_response(
+            source_version_scope(source_file),
+            lambda: {"items": list_generated_questions_by_source(source_file=source_file, limit=limit)},
+        )
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
 
+@app.route("/api/bootstrap", methods=["GET"])
+def bootstrap() -> Tuple[Dict, int]:
+    """Start-up data in one round trip.
+
+    Returns the error and favorite collection summaries and the latest wrong
+    answers. With `source_file`, it also returns that source's first page of
+    generated questions and wrong answers.
+    """
+    try:
+        limit = int(request.args.get("limit", 100))
+        if limit < 1 or limit > 500:
+            raise ValueError("limit must be between 1 and 500.")
+        source_file = request.args.get("source_file", "").strip()
+        # The global version moves on every change, including the selected source's.
+        return versioned_json_response(
+            GLOBAL_VERSION_SCOPE,
+            lambda: load_bootstrap(source_file=source_file, limit=limit),
+        )
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+
+@app.route("/api/usage", methods=["GET"])
+def usage_report() -> Tuple[Dict, int]:
+    try:
+        group_by = request.args.get("group_by", "source_file,model")
+        return (
+            jsonify(
+                aggregate_usage(
+                    bucket=request.args.get("bucket", "day").strip().lower(),
+                    group_by=[column.strip() for column in group_by.split(",")],
+                    since=request.args.get("since", "").strip() or None,
+                    until=request.args.get("until", "").strip() or None,
+                    source_file=request.args.get("source_file", "").strip(),
+                    model=request.args.get("model", "").strip(),
+                )
+            ),
+            200,
+        )
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+
+@app.route("/api/export", methods=["GET"])
+def export_bank():
+    try:
+        compression = require_compression(request.args.get("compression", "none"))
+        source_files = [name.strip() for name in request.args.getlist("source_file") if name.strip()]
+        include_sources = request.args.get("include_sources", "true").strip().lower() != "false"
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    suffix = {"none": "", "gzip": ".gz", "zstd": ".zst"}[compression]
+    mimetype = {"none": "application/x-ndjson", "gzip": "application/gzip", "zstd": "application/zstd"}[compression]
+    chunks = encode_ndjson(iter_bank_records(source_files or None, include_sources=include_sources), compression)
+    return Response(
+        chunks,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=question-bank.ndjson{suffix}"},
+    )
+
+
+@app.route("/api/import", methods=["POST"])
+def import_bank() -> Tuple[Dict, int]:
+    try:
+        source_files = [name.strip() for name in request.args.getlist("source_file") if name.strip()]
+        counts = import_bank_records(decode_ndjson(request.stream), source_files or None)
+        return jsonify({"ok": True, **counts}), 200
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+
+@app.route("/api/maintenance", methods=["GET"])
+def maintenance_stats() -> Dict:
+    return jsonify(db_maintenance.stats())
+
+
+@app.route("/api/maintenance/run", methods=["POST"])
+def maintenance_run() -> Tuple[Dict, int]:
+    try:
+        body = request.get_json(silent=True) or {}
+        return jsonify(db_maintenance.run_once(full_vacuum=bool(body.get("full_vacuum", False)))), 200
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
+
+
 if __name__ == "__main__":
-    app.run(host="localhost", port=8080, debug=True)
+    if MAINTENANCE_ENABLED:
+        db_maintenance.start()
+    try:
+        app.run(host="localhost", port=8080, debug=True)
+    finally:
+        usage_recorder.close()
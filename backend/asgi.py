@@ -0,0 +1,728 @@
+"""ASGI serving mode with non-blocking provider calls.
+
+The generation routes (`/api/questions`, `/api/questions/upload`,
+`/api/questions/upload/batch`, `/api/questions/more`) are served natively
+here: provider calls go through a shared `httpx.AsyncClient`, and PDF
+extraction plus SQLite work run on a bounded thread pool so the event loop
+never blocks. Every other route is delegated to the Flask app unchanged.
+
+Generation runs under the request's deadline and is cancelled when the
+client disconnects, so an abandoned request stops its provider calls and
+stores nothing.
+
+Usage:
+  python3 -m pip install -r requirements-async.txt
+  uvicorn asgi:application --host localhost --port 8080
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from typing import Awaitable, Dict, List, Optional, TypeVar
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse
+from starlette.responses import StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as app_module
+import serialization
+from admission import AdmissionRejected, estimate_input_tokens
+from deadlines import (
+    DeadlineExceeded,
+    RequestCancelled,
+    call_timeout,
+    current_deadline,
+    deadline_scope,
+)
+from hedging import run_hedged_async
+from profiling import annotate, stage
+from sharding import TENANT_HEADER, normalize_tenant_id, reset_current_tenant, set_current_tenant
+from singleflight import AsyncSingleFlight
+from usage import usage_source
+
+ASYNC_EXECUTOR_WORKERS = int(os.environ.get("ASYNC_EXECUTOR_WORKERS", "16"))
+ASYNC_MAX_PROVIDER_CONNECTIONS = int(os.environ.get("ASYNC_MAX_PROVIDER_CONNECTIONS", "500"))
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", "0.5"))
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="asgi-blocking")
+_http_client: Optional[httpx.AsyncClient] = None
+generation_flights = AsyncSingleFlight()
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSON response encoded with the app's serializer (orjson when available)."""
+
+    def render(self, content) -> bytes:
+        return serialization.serializer.dumps_bytes(content)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=app_module.PROVIDER_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_PROVIDER_CONNECTIONS,
+                max_keepalive_connections=min(ASYNC_MAX_PROVIDER_CONNECTIONS, 100),
+            ),
+        )
+    return _http_client
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Copy the context so the worker thread sees the request's tenant.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(context.run, func, *args, **kwargs))
+
+
+def submit_blocking(func, *args) -> None:
+    """Fire-and-forget variant of run_blocking that survives task cancellation."""
+    _executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def traced(handler):
+    """Slow-request logging and stage timings for a native route.
+
+    Per-request profiling is not started here: cProfile and the stack sampler
+    follow one thread, while an async handler shares the event loop with
+    every other request in flight. Profile through the Flask routes instead.
+    """
+
+    @wraps(handler)
+    async def wrapper(request: Request) -> JSONResponse:
+        profiler = app_module.request_profiler
+        if not profiler.enabled:
+            return await handler(request)
+        trace = profiler.start(request.method, request.url.path, request.headers, allow_profile=False)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            return response
+        finally:
+            profiler.finish(trace, status)
+
+    return wrapper
+
+
+def generation_route(handler):
+    """Run a generation route under its deadline and count it as in flight for readiness."""
+
+    @wraps(handler)
+    async def wrapper(request: Request):
+        with deadline_scope(app_module.GENERATION_BUDGET_SECONDS), app_module.generations_in_flight.track():
+            return await handler(request)
+
+    return wrapper
+
+
+async def until_done_or_abandoned(request: Request, work: Awaitable[T]) -> T:
+    """Await `work`, cancelling it when the client disconnects or the deadline passes.
+
+    Call only after the request body has been read: checking for a disconnect
+    consumes a receive message.
+    """
+    task = asyncio.ensure_future(work)
+    deadline = current_deadline()
+    try:
+        while True:
+            timeout = DISCONNECT_POLL_SECONDS if deadline is None else min(DISCONNECT_POLL_SECONDS, deadline.remaining())
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                if deadline is not None:
+                    deadline.cancel()
+                raise RequestCancelled("generate")
+            if deadline is not None:
+                deadline.check("generate")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+class TenantMiddleware:
+    """Binds the X-Tenant-ID header to the tenant context for the whole request."""
+
+    def __init__(self, asgi_app) -> None:
+        self.app = asgi_app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = TENANT_HEADER.lower().encode("latin-1")
+        raw = next((value for name, value in scope["headers"] if name == header), b"")
+        try:
+            tenant = normalize_tenant_id(raw.decode("latin-1"))
+        except ValueError as exc:
+            await JSONResponse({"error": str(exc), "code": "invalid_tenant"}, status_code=400)(scope, receive, send)
+            return
+        token = set_current_tenant(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_current_tenant(token)
+
+
+async def agenerate_questions(
+    text_inputs: List[Dict],
+    pdf_inputs: List[Dict],
+    question_count: int,
+    model: str,
+    model_tier: str = "pro",
+    source_names: Optional[List[str]] = None,
+) -> List[Dict]:
+    questions_data = await arequest_questions(
+        text_inputs,
+        pdf_inputs,
+        question_count,
+        model,
+        model_tier=model_tier,
+        source_names=source_names,
+    )
+
+    attempts = 0
+    while len(questions_data) < question_count and attempts < app_module.GENERATION_TOPUP_ATTEMPTS:
+        attempts += 1
+        missing = question_count - len(questions_data)
+        app_module.check_deadline("topup")
+        app_module.increment_metric("topup_requests")
+        try:
+            extra = await arequest_questions(
+                text_inputs,
+                pdf_inputs,
+                missing,
+                model,
+                model_tier=model_tier,
+                avoid_questions=[q["question"] for q in questions_data],
+                retry_count=attempts,
+                source_names=source_names,
+            )
+        except Exception:
+            app_module.increment_metric("topup_failures")
+            break
+        questions_data = app_module.merge_topup_questions(questions_data, extra, question_count)
+    return questions_data[:question_count]
+
+
+async def arequest_questions(
+    text_inputs: List[Dict],
+    pdf_inputs: List[Dict],
+    question_count: int,
+    model: str,
+    model_tier: str = "pro",
+    avoid_questions: Optional[List[str]] = None,
+    retry_count: int = 0,
+    source_names: Optional[List[str]] = None,
+) -> List[Dict]:
+    generation_request = app_module.build_generation_request(
+        text_inputs,
+        pdf_inputs,
+        question_count,
+        model,
+        model_tier=model_tier,
+        avoid_questions=avoid_questions,
+        source_names=source_names,
+    )
+    backup_request = app_module.build_backup_request(
+        text_inputs,
+        pdf_inputs,
+        question_count,
+        generation_request,
+        avoid_questions=avoid_questions,
+    )
+    app_module.label_usage(generation_request, backup_request, question_count, retry_count)
+    app_module.attach_deadline(generation_request, backup_request)
+    if backup_request is None:
+        return await acall_provider(generation_request)
+
+    questions_data, winner = await run_hedged_async(
+        lambda: acall_provider(generation_request),
+        lambda: acall_provider(backup_request),
+        app_module.hedge_delay_seconds(generation_request),
+        on_hedge=lambda reason: app_module.increment_metric(f"hedges_started_{reason}"),
+    )
+    if winner == "backup":
+        app_module.increment_metric("hedge_backup_wins")
+    return questions_data
+
+
+async def acall_provider(generation_request: Dict) -> List[Dict]:
+    deadline = generation_request.get("deadline")
+    estimated_tokens = estimate_input_tokens(generation_request["payload"])
+    ticket = await app_module.admission.acquire_async(
+        generation_request["provider"],
+        generation_request["model"],
+        estimated_tokens,
+        timeout=call_timeout(deadline, "admission", app_module.ADMISSION_MAX_WAIT_SECONDS),
+    )
+    started = time.perf_counter()
+    body: Dict = {}
+    try:
+        try:
+            response = await get_http_client().post(
+                generation_request["url"],
+                headers=generation_request["headers"],
+                json=generation_request["payload"],
+                timeout=call_timeout(deadline, "provider", app_module.PROVIDER_TIMEOUT_SECONDS),
+            )
+        except httpx.TimeoutException as exc:
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded("provider", deadline.budget) from exc
+            raise
+        finally:
+            app_module.admission.release(ticket)
+        body = response.json() if response.status_code < 400 else {}
+        raw_text = app_module.extract_generation_text(generation_request, response.status_code, response.text, body)
+
+        parsed = app_module.parse_model_json(raw_text)
+        questions_data = app_module.validate_questions(parsed, generation_request.get("source_names"))
+    except BaseException as exc:
+        # A hedged loser or a cancelled request is cancelled, not failed.
+        status = "cancelled" if isinstance(exc, asyncio.CancelledError) else app_module.provider_call_status(exc)
+        app_module.record_provider_usage(
+            generation_request, estimated_tokens, body, time.perf_counter() - started, 0, status
+        )
+        raise
+    elapsed = time.perf_counter() - started
+    app_module.provider_latency.record(app_module.latency_key(generation_request), elapsed)
+    app_module.record_provider_usage(generation_request, estimated_tokens, body, elapsed, len(questions_data), "ok")
+    return questions_data
+
+
+def rate_limited_response(exc: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        app_module.rate_limited_error(exc),
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def deadline_response(exc: Exception) -> JSONResponse:
+    body, status = app_module.deadline_error(exc)
+    return JSONResponse(body, status_code=status)
+
+
+async def read_json_body(request: Request) -> Dict:
+    # Mirrors request.get_json(silent=True) or {} in the Flask routes.
+    try:
+        body = await request.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+async def questions(request: Request) -> JSONResponse:
+    body = await read_json_body(request)
+
+    try:
+        options = app_module.parse_questions_options(body)
+        model = options["model"]
+        model_tier = options["model_tier"]
+
+        if options["mode"] == "per_file":
+            documents = await run_blocking(app_module.load_notes_documents, options["notes_dir"])
+            result = await until_done_or_abandoned(
+                request,
+                agenerate_notes_per_file(documents, options["question_count"], model, model_tier),
+            )
+            return JSONResponse(
+                {
+                    **result,
+                    "model": model,
+                    "model_tier": model_tier,
+                    "notes_dir": str(options["notes_dir"]),
+                    "mode": "per_file",
+                },
+                status_code=200,
+            )
+
+        text_inputs, pdf_inputs, source_files = await run_blocking(
+            app_module.load_notes_content,
+            options["notes_dir"],
+        )
+        with usage_source(source_files[0] if source_files else None):
+            questions_data = await until_done_or_abandoned(
+                request,
+                agenerate_questions(
+                    text_inputs,
+                    pdf_inputs,
+                    options["question_count"],
+                    model,
+                    model_tier=model_tier,
+                ),
+            )
+        await run_blocking(app_module.store_generated_questions, source_files, model, questions_data)
+
+        return JSONResponse(
+            {
+                "questions": questions_data,
+                "source_files": source_files,
+                "model": model,
+                "model_tier": model_tier,
+                "notes_dir": str(options["notes_dir"]),
+            },
+            status_code=200,
+        )
+    except AdmissionRejected as exc:
+        return rate_limited_response(exc)
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        return deadline_response(exc)
+    except Exception as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+
+async def agenerate_notes_group(group: Dict, model: str, model_tier: str, limit: asyncio.Semaphore):
+    names = group["source_files"]
+    async with limit:
+        with usage_source(names[0]):
+            questions_data = await agenerate_questions(
+                group["text_inputs"],
+                group["pdf_inputs"],
+                group["question_count"],
+                model,
+                model_tier=model_tier,
+                source_names=names if len(names) > 1 else None,
+            )
+    return app_module.attribute_group_questions(group, questions_data)
+
+
+async def agenerate_notes_per_file(documents: List[Dict], question_count: int, model: str, model_tier: str) -> Dict:
+    groups = app_module.plan_notes_groups(documents, question_count)
+    limit = asyncio.Semaphore(app_module.NOTES_PARALLEL_WORKERS)
+    outcomes = await asyncio.gather(
+        *(agenerate_notes_group(group, model, model_tier, limit) for group in groups if group["question_count"] > 0),
+        return_exceptions=True,
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException) and not isinstance(outcome, Exception):
+            raise outcome
+    return await run_blocking(app_module.collect_notes_results, groups, list(outcomes), model)
+
+
+async def agenerate_for_upload(file_name: str, file_bytes: bytes, options: Dict) -> Dict:
+    model = options["model"]
+    model_tier = options["model_tier"]
+    with stage("extract"):
+        text_inputs, pdf_inputs, source_files = await run_blocking(
+            app_module.load_uploaded_file_content,
+            file_name,
+            file_bytes,
+            model_tier=model_tier,
+        )
+        pdf_classification = await run_blocking(app_module.upload_pdf_classification, file_name, file_bytes)
+    with stage("reserve"):
+        reservation_id, question_count = await run_blocking(
+            app_module.reserve_generation_slots,
+            file_name,
+            options["question_count"],
+            enforce_cap=False,
+        )
+    try:
+        with stage("generate"), usage_source(source_files[0]):
+            questions_data = (
+                await agenerate_questions(
+                    text_inputs,
+                    pdf_inputs,
+                    question_count,
+                    model,
+                    model_tier=model_tier,
+                )
+            )[:question_count]
+
+        def persist() -> None:
+            app_module.check_deadline("store")
+            app_module.upsert_uploaded_file(file_name)
+            app_module.upsert_uploaded_file_source(
+                file_name,
+                file_bytes,
+                pdf_kind=pdf_classification["kind"] if pdf_classification else None,
+            )
+            app_module.store_generated_questions(source_files, model, questions_data, reservation_id=reservation_id)
+
+        with stage("store"):
+            await run_blocking(persist)
+    except BaseException:
+        # Not awaited, so the reservation is released even when this task is cancelled.
+        submit_blocking(app_module.release_generation_reservation, reservation_id)
+        raise
+
+    return {
+        "questions": questions_data,
+        "source_files": source_files,
+        "model": model,
+        "model_tier": model_tier,
+        "total_questions_for_source": await run_blocking(app_module.count_generated_questions_by_source, file_name),
+        "max_questions_per_source": app_module.MAX_QUESTIONS_PER_SOURCE,
+        "normalization": app_module.upload_normalization_stats(file_name, text_inputs),
+        "pdf_classification": pdf_classification,
+    }
+
+
+async def agenerate_more_for_source(source_file: str, source_data: bytes, options: Dict) -> Dict:
+    model = options["model"]
+    model_tier = options["model_tier"]
+    with stage("reserve"):
+        reservation_id, question_count = await run_blocking(
+            app_module.reserve_generation_slots,
+            source_file,
+            app_module.MORE_QUESTIONS_BATCH,
+        )
+    try:
+        with stage("extract"):
+            text_inputs, pdf_inputs, source_files = await run_blocking(
+                app_module.load_uploaded_file_content,
+                source_file,
+                source_data,
+                model_tier=model_tier,
+            )
+        with stage("generate"), usage_source(source_files[0]):
+            questions_data = (
+                await agenerate_questions(
+                    text_inputs,
+                    pdf_inputs,
+                    question_count,
+                    model,
+                    model_tier=model_tier,
+                )
+            )[:question_count]
+        with stage("store"):
+            await run_blocking(
+                app_module.store_generated_questions,
+                source_files,
+                model,
+                questions_data,
+                reservation_id=reservation_id,
+            )
+    except BaseException:
+        submit_blocking(app_module.release_generation_reservation, reservation_id)
+        raise
+
+    return {
+        "questions": questions_data,
+        "source_files": source_files,
+        "model": model,
+        "model_tier": model_tier,
+        "total_questions_for_source": await run_blocking(app_module.count_generated_questions_by_source, source_file),
+        "max_questions_per_source": app_module.MAX_QUESTIONS_PER_SOURCE,
+    }
+
+
+async def questions_upload(request: Request) -> JSONResponse:
+    try:
+        form = await request.form()
+        options = app_module.parse_upload_options(form)
+        model = options["model"]
+        model_tier = options["model_tier"]
+
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str) or not upload.filename:
+            raise ValueError("No file uploaded.")
+
+        file_name = app_module.normalize_upload_filename(upload.filename)
+        if await run_blocking(app_module.has_uploaded_file, file_name) and not options["override"]:
+            return JSONResponse(app_module.file_exists_error(file_name), status_code=409)
+
+        with stage("read_upload"):
+            file_bytes = await upload.read()
+        if not file_bytes:
+            raise ValueError("Uploaded file is empty.")
+        annotate(file_name=file_name, file_bytes=len(file_bytes), model=model, model_tier=model_tier)
+
+        key = app_module.generation_flight_key(
+            "upload",
+            file_name,
+            file_bytes,
+            model_tier,
+            model,
+            options["question_count"],
+        )
+        payload, coalesced = await until_done_or_abandoned(
+            request,
+            generation_flights.do(key, lambda: agenerate_for_upload(file_name, file_bytes, options)),
+        )
+        annotate(coalesced=coalesced)
+        return JSONResponse({**payload, "coalesced": coalesced}, status_code=200)
+    except AdmissionRejected as exc:
+        return rate_limited_response(exc)
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        return deadline_response(exc)
+    except Exception as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+
+async def agenerate_batch_upload_file(
+    index: int,
+    file_name: str,
+    file_bytes: bytes,
+    options: Dict,
+    limit: asyncio.Semaphore,
+) -> Dict:
+    async with limit:
+        started = time.perf_counter()
+        try:
+            key = app_module.generation_flight_key(
+                "upload",
+                file_name,
+                file_bytes,
+                options["model_tier"],
+                options["model"],
+                options["question_count"],
+            )
+            payload, coalesced = await generation_flights.do(
+                key,
+                lambda: agenerate_for_upload(file_name, file_bytes, options),
+            )
+        except Exception as exc:
+            outcome = app_module.batch_upload_failure(index, file_name, exc)
+        else:
+            outcome = {"index": index, "file_name": file_name, "status": 200, **payload, "coalesced": coalesced}
+        outcome["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return outcome
+
+
+async def questions_upload_batch(request: Request):
+    started = time.perf_counter()
+    try:
+        form = await request.form()
+        options = app_module.parse_upload_options(form)
+        uploads = [
+            (upload.filename or "", await upload.read())
+            for upload in form.getlist("files") + form.getlist("file")
+            if not isinstance(upload, str)
+        ]
+        accepted, rejected = await run_blocking(app_module.plan_batch_upload, uploads, options["override"])
+    except Exception as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+    limit = asyncio.Semaphore(app_module.UPLOAD_BATCH_WORKERS)
+    tasks = [
+        asyncio.create_task(agenerate_batch_upload_file(index, name, data, options, limit))
+        for index, name, data in accepted
+    ]
+    stream = (
+        request.query_params.get("stream", "").strip().lower() == "true"
+        or "application/x-ndjson" in request.headers.get("accept", "")
+    )
+    if stream:
+        deadline = current_deadline()
+
+        async def lines():
+            # `generation_route` stops counting once this handler returns, while
+            # the files are still generating; the stream counts itself instead.
+            app_module.generations_in_flight.enter()
+            outcomes = list(rejected)
+            finished = False
+            try:
+                for outcome in rejected:
+                    yield serialization.serializer.dumps_bytes({"type": "file", **outcome}) + b"\n"
+                for next_done in asyncio.as_completed(tasks):
+                    outcome = await next_done
+                    outcomes.append(outcome)
+                    yield serialization.serializer.dumps_bytes({"type": "file", **outcome}) + b"\n"
+                finished = True
+                yield serialization.serializer.dumps_bytes(app_module.batch_upload_summary(outcomes, started)) + b"\n"
+            finally:
+                # StreamingResponse cancels this generator when the client disconnects.
+                if not finished:
+                    app_module.increment_metric("batch_streams_abandoned")
+                    if deadline is not None:
+                        deadline.cancel()
+                for task in tasks:
+                    task.cancel()
+                app_module.generations_in_flight.exit()
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    try:
+        outcomes = rejected + list(await until_done_or_abandoned(request, asyncio.gather(*tasks)))
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        return deadline_response(exc)
+    outcomes.sort(key=lambda outcome: outcome["index"])
+    summary = app_module.batch_upload_summary(outcomes, started)
+    summary.pop("type")
+    return JSONResponse({"files": outcomes, "summary": summary}, status_code=200)
+
+
+async def more_questions(request: Request) -> JSONResponse:
+    try:
+        body = await read_json_body(request)
+        options = app_module.parse_more_options(body)
+        source_file = options["source_file"]
+        model = options["model"]
+        model_tier = options["model_tier"]
+
+        current_total = await run_blocking(app_module.count_generated_questions_by_source, source_file)
+        if current_total >= app_module.MAX_QUESTIONS_PER_SOURCE:
+            return JSONResponse(app_module.max_reached_error(source_file, current_total), status_code=400)
+
+        with stage("load_source"):
+            source_data = await run_blocking(app_module.get_uploaded_file_source, source_file)
+        annotate(source_file=source_file, model=model, model_tier=model_tier)
+        key = app_module.generation_flight_key(
+            "more",
+            source_file,
+            source_data,
+            model_tier,
+            model,
+            app_module.MORE_QUESTIONS_BATCH,
+        )
+        payload, coalesced = await until_done_or_abandoned(
+            request,
+            generation_flights.do(key, lambda: agenerate_more_for_source(source_file, source_data, options)),
+        )
+        annotate(coalesced=coalesced)
+        return JSONResponse({**payload, "coalesced": coalesced}, status_code=200)
+    except app_module.SourceCapReached as exc:
+        return JSONResponse(app_module.max_reached_error(exc.source_file, exc.current_total), status_code=400)
+    except AdmissionRejected as exc:
+        return rate_limited_response(exc)
+    except (DeadlineExceeded, RequestCancelled) as exc:
+        return deadline_response(exc)
+    except Exception as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+
+@asynccontextmanager
+async def lifespan(_app: Starlette):
+    get_http_client()
+    if app_module.MAINTENANCE_ENABLED:
+        app_module.db_maintenance.start()
+    try:
+        yield
+    finally:
+        global _http_client
+        if _http_client is not None:
+            await _http_client.aclose()
+            _http_client = None
+        await run_blocking(app_module.usage_recorder.close)
+
+
+application = Starlette(
+    routes=[
+        Route("/api/questions", generation_route(questions), methods=["POST"]),
+        Route("/api/questions/upload", generation_route(traced(questions_upload)), methods=["POST"]),
+        Route("/api/questions/upload/batch", generation_route(questions_upload_batch), methods=["POST"]),
+        Route("/api/questions/more", generation_route(traced(more_questions)), methods=["POST"]),
+        Mount("/", app=WsgiToAsgi(app_module.app)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(TenantMiddleware),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,195 @@
+"""Streaming NDJSON export/import of the question bank.
+
+The format is one JSON object per line: a header, then `uploaded_file`,
+`generated_question` and `wrong_answer` records. Streams may be gzip- or
+zstd-compressed (zstd needs the optional `zstandard` package); compression is
+detected from the stream itself on import. Everything here works one record at
+a time, so memory use does not grow with the size of the bank.
+
+Command line:
+
+    python3 bank_transfer.py export bank.ndjson.gz [--source-file notes.pdf] [--no-sources]
+    python3 bank_transfer.py import bank.ndjson.gz [--source-file notes.pdf] [--tenant alice]
+"""
+
+import argparse
+import gzip
+import io
+import json
+import sys
+import zlib
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+import serialization
+from sharding import normalize_tenant_id, tenant_context
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+BANK_FORMAT = "qastudytool-bank"
+BANK_FORMAT_VERSION = 1
+RECORD_TYPES = {"uploaded_file", "generated_question", "wrong_answer"}
+COMPRESSIONS = {"none", "gzip", "zstd"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def bank_header() -> Dict:
+    return {"type": "header", "format": BANK_FORMAT, "version": BANK_FORMAT_VERSION}
+
+
+def compression_for_path(path: str) -> str:
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def require_compression(compression: str) -> str:
+    compression = (compression or "none").strip().lower()
+    if compression not in COMPRESSIONS:
+        raise ValueError("compression must be one of: none, gzip, zstd.")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package.")
+    return compression
+
+
+def encode_ndjson(records: Iterable[Dict], compression: str = "none", chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield the header plus `records` as NDJSON bytes, compressed in chunks."""
+    compression = require_compression(compression)
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = None
+
+    buffer: List[bytes] = []
+    buffered = 0
+    for record in _with_header(records):
+        line = serialization.serializer.dumps_bytes(record) + b"\n"
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= chunk_size:
+            data = b"".join(buffer)
+            buffer, buffered = [], 0
+            data = compressor.compress(data) if compressor is not None else data
+            if data:
+                yield data
+
+    data = b"".join(buffer)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def _with_header(records: Iterable[Dict]) -> Iterator[Dict]:
+    yield bank_header()
+    yield from records
+
+
+class _PrefixedStream(io.RawIOBase):
+    """Replays bytes already read for format sniffing in front of the rest of a stream."""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO) -> None:
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def open_decompressed(stream: BinaryIO) -> BinaryIO:
+    prefix = stream.read(4)
+    raw = io.BufferedReader(_PrefixedStream(prefix, stream))
+    if prefix.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if prefix.startswith(ZSTD_MAGIC):
+        require_compression("zstd")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return raw
+
+
+def decode_ndjson(stream: BinaryIO) -> Iterator[Dict]:
+    """Yield bank records from an NDJSON stream (optionally compressed), checking the header."""
+    lines = io.TextIOWrapper(open_decompressed(stream), encoding="utf-8")
+    saw_header = False
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = serialization.loads(line)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"line {line_number}: invalid JSON ({exc.msg}).") from None
+        if not isinstance(record, dict):
+            raise ValueError(f"line {line_number}: expected a JSON object.")
+        if not saw_header:
+            if record.get("type") != "header" or record.get("format") != BANK_FORMAT:
+                raise ValueError("Not a question bank export (missing header).")
+            if record.get("version") != BANK_FORMAT_VERSION:
+                raise ValueError(f"Unsupported bank format version: {record.get('version')}.")
+            saw_header = True
+            continue
+        if record.get("type") not in RECORD_TYPES:
+            raise ValueError(f"line {line_number}: unknown record type {record.get('type')!r}.")
+        yield record
+    if not saw_header:
+        raise ValueError("Not a question bank export (missing header).")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export or import the question bank as NDJSON.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="File to write or read; '-' for stdout/stdin. .gz/.zst select compression.")
+    parser.add_argument("--source-file", action="append", dest="source_files", help="Only this source (repeatable).")
+    parser.add_argument("--compression", choices=sorted(COMPRESSIONS), help="Override compression for export.")
+    parser.add_argument("--no-sources", action="store_true", help="Export without uploaded file contents.")
+    parser.add_argument("--tenant", help="Tenant whose shard to use when DB_SHARD_DIR is set.")
+    args = parser.parse_args(argv)
+
+    # Imported here so `--help` works without opening the database.
+    import app as app_module
+
+    with tenant_context(normalize_tenant_id(args.tenant)):
+        return run_command(app_module, args)
+
+
+def run_command(app_module, args: argparse.Namespace) -> int:
+    if args.command == "export":
+        compression = args.compression or compression_for_path(args.path)
+        records = app_module.iter_bank_records(args.source_files, include_sources=not args.no_sources)
+        output = sys.stdout.buffer if args.path == "-" else open(args.path, "wb")
+        try:
+            for chunk in encode_ndjson(records, compression):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        return 0
+
+    source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        counts = app_module.import_bank_records(decode_ndjson(source), args.source_files)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    print(json.dumps(counts))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Compare the stdlib and orjson serializer paths on question-bank shaped data.
+
+Usage:
+  python3 bench_serialization.py [--questions 5000] [--repeat 5]
+
+Measures the three hot paths: encoding questions for storage, decoding stored
+rows for listings, and encoding a whole listing response.
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from serialization import OrjsonSerializer, StdlibSerializer, orjson
+
+
+def sample_questions(count: int) -> List[Dict]:
+    return [
+        {
+            "question": f"第{i}题：线粒体的主要功能是什么？ Which organelle produces ATP ({i})?",
+            "options": ["合成蛋白质", "Produce ATP via respiration", "储存遗传信息", "Transport lipids"],
+            "correct_index": 1,
+            "explanation": "线粒体通过有氧呼吸产生ATP。Mitochondria are the site of aerobic respiration. " * 3,
+        }
+        for i in range(count)
+    ]
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench(serializer: StdlibSerializer, questions: List[Dict], repeat: int) -> Dict[str, float]:
+    rows = [serializer.dumps(question) for question in questions]
+    listing = {"items": [{"id": i, "source_file": "notes.pdf", **q} for i, q in enumerate(questions)]}
+    return {
+        "store (dumps per question)": best_of(repeat, lambda: [serializer.dumps(q) for q in questions]),
+        "list (loads per row)": best_of(repeat, lambda: [serializer.loads(row) for row in rows]),
+        "response (dumps_bytes listing)": best_of(repeat, lambda: serializer.dumps_bytes(listing)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    questions = sample_questions(args.questions)
+    results = {"stdlib": bench(StdlibSerializer(), questions, args.repeat)}
+    if orjson is not None:
+        results["orjson"] = bench(OrjsonSerializer(), questions, args.repeat)
+    else:
+        print("orjson is not installed; only the stdlib path was measured.")
+
+    print(f"{args.questions} questions, best of {args.repeat} runs (ms)")
+    for case in results["stdlib"]:
+        line = f"  {case:<32} stdlib {results['stdlib'][case] * 1000:8.2f}"
+        if "orjson" in results:
+            fast = results["orjson"][case]
+            line += f"   orjson {fast * 1000:8.2f}   x{results['stdlib'][case] / fast:.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
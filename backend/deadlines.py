@@ -0,0 +1,159 @@
+"""Request deadlines and cancellation.
+
+A generation route opens a `Deadline` with the overall budget for the request.
+The deadline follows the request through a context variable, the same way the
+tenant does. Extraction, every provider call and the final database write
+check it. Provider timeouts are cut to whatever budget is left. Once the
+budget is spent or the request has been cancelled (the client went away),
+the next check raises, so nothing is generated or stored for a response
+nobody will read.
+
+Code running outside a request (the pre-generation CLI, tests) has no
+deadline, and every check is a no-op there.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Iterator, List, Optional
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str, budget: float) -> None:
+        super().__init__(f"Request took longer than its {budget:g}s budget (during {stage}).")
+        self.stage = stage
+        self.budget = budget
+
+
+class RequestCancelled(Exception):
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"Request was cancelled by the client (during {stage}).")
+        self.stage = stage
+
+
+class Deadline:
+    """An absolute expiry plus a cancelled flag; safe to share between threads."""
+
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def check(self, stage: str) -> None:
+        if self.cancelled:
+            raise RequestCancelled(stage)
+        if self.expired:
+            raise DeadlineExceeded(stage, self.budget)
+
+    def timeout(self, stage: str, cap: float) -> float:
+        """Seconds a blocking call made during `stage` may take, never more than `cap`."""
+        self.check(stage)
+        return min(cap, self.remaining())
+
+
+class SharedDeadline(Deadline):
+    """Deadline of work shared by several requests (a single-flight call).
+
+    It runs until the last waiter's deadline and counts as cancelled only
+    when every waiter has been cancelled or has left. One client going away
+    does not stop work that another client is still waiting for.
+    """
+
+    def __init__(self) -> None:
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._waiters: List[Optional[Deadline]] = []
+
+    def join(self, deadline: Optional[Deadline]) -> None:
+        """Add a waiter; None (no deadline) keeps the shared work unbounded."""
+        with self._lock:
+            self._waiters.append(deadline)
+
+    def leave(self, deadline: Optional[Deadline]) -> None:
+        with self._lock:
+            for index, waiter in enumerate(self._waiters):
+                if waiter is deadline:
+                    del self._waiters[index]
+                    break
+
+    def _snapshot(self) -> List[Optional[Deadline]]:
+        with self._lock:
+            return list(self._waiters)
+
+    @property
+    def budget(self) -> float:
+        waiters = self._snapshot()
+        if not waiters or any(waiter is None for waiter in waiters):
+            return math.inf
+        return max(waiter.budget for waiter in waiters)
+
+    @property
+    def expires_at(self) -> float:
+        waiters = self._snapshot()
+        if any(waiter is None for waiter in waiters):
+            return math.inf
+        return max((waiter.expires_at for waiter in waiters), default=-math.inf)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        if self._cancelled.is_set():
+            return True
+        return all(waiter is not None and waiter.cancelled for waiter in self._snapshot())
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def set_current_deadline(deadline: Optional[Deadline]) -> Token:
+    return _current_deadline.set(deadline)
+
+
+def reset_current_deadline(token: Token) -> None:
+    _current_deadline.reset(token)
+
+
+@contextmanager
+def deadline_scope(budget: float) -> Iterator[Deadline]:
+    deadline = Deadline(budget)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def check_deadline(stage: str) -> None:
+    """Raise if the current request is out of budget or cancelled; no-op outside a request."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def call_timeout(deadline: Optional[Deadline], stage: str, cap: float) -> float:
+    return cap if deadline is None else deadline.timeout(stage, cap)
@@ -0,0 +1,210 @@
+"""Latency tracking and hedged provider calls.
+
+A hedged call starts the primary attempt and, if it has not produced a valid
+result within the model's rolling p95 latency (or fails outright), starts a
+backup attempt. The first valid result wins and the other attempt is cancelled.
+
+Thread-based hedging never queues an attempt behind other calls. A queued
+primary would use up its hedge delay before it even started, and hedging a
+saturated pool only adds load when it should back off. When `HedgeExecutor`
+has no free worker, the primary runs unhedged on the calling thread and a
+"slow" backup is skipped.
+"""
+
+import asyncio
+import math
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._window = window
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = deque(maxlen=self._window)
+                self._samples[key] = samples
+            samples.append(seconds)
+
+    def percentile(self, key: str, pct: float) -> Optional[float]:
+        """Nearest-rank percentile, or None until enough samples have been seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self._min_samples:
+            return None
+        rank = max(1, int(math.ceil(pct * len(samples))))
+        return samples[rank - 1]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            keys = list(self._samples)
+        result: Dict[str, Dict] = {}
+        for key in sorted(keys):
+            with self._lock:
+                count = len(self._samples[key])
+            result[key] = {
+                "samples": count,
+                "p50": self.percentile(key, 0.50),
+                "p95": self.percentile(key, 0.95),
+                "p99": self.percentile(key, 0.99),
+            }
+        return result
+
+
+class HedgeExecutor:
+    """Thread pool that only accepts work a free worker can start right away."""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "") -> None:
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self.busy = 0
+
+    def try_submit(self, fn: Callable[[], T]) -> Optional["Future[T]"]:
+        """Start `fn` on a free worker, or return None when every worker is busy."""
+        with self._lock:
+            if self.busy >= self._max_workers:
+                return None
+            self.busy += 1
+        future = self._pool.submit(fn)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, _future: Future) -> None:
+        with self._lock:
+            self.busy -= 1
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+def run_hedged(
+    primary: Callable[[], T],
+    backup: Callable[[], T],
+    hedge_after: float,
+    executor: HedgeExecutor,
+    on_hedge: Optional[Callable[[str], None]] = None,
+    on_skip: Optional[Callable[[str], None]] = None,
+) -> Tuple[T, str]:
+    """Run `primary`, hedging with `backup` after `hedge_after` seconds or on failure.
+
+    Returns (result, "primary" | "backup"). Threads cannot be interrupted, so a
+    losing attempt is left to finish in the background with its result
+    discarded. Attempts start as soon as they are submitted, so the hedge
+    delay counts from when the primary began running. `on_skip` is told why
+    a hedge was not started ("primary" or "slow") when no worker was free.
+    """
+    def fail_over_here(error: BaseException) -> Tuple[T, str]:
+        # The primary is done, so failing over on this thread adds no load.
+        if on_hedge is not None:
+            on_hedge("failed")
+        try:
+            return backup(), "backup"
+        except Exception:
+            raise error
+
+    primary_future = executor.try_submit(primary)
+    if primary_future is None:
+        if on_skip is not None:
+            on_skip("primary")
+        try:
+            return primary(), "primary"
+        except Exception as exc:
+            return fail_over_here(exc)
+
+    pending = {primary_future: "primary"}
+    backup_started = False
+    errors: List[BaseException] = []
+
+    def start_backup(reason: str) -> bool:
+        """Submit the backup; False when no worker is free."""
+        nonlocal backup_started
+        backup_started = True
+        future = executor.try_submit(backup)
+        if future is None:
+            return False
+        if on_hedge is not None:
+            on_hedge(reason)
+        pending[future] = "backup"
+        return True
+
+    while pending:
+        done, _ = wait(
+            list(pending),
+            timeout=None if backup_started else hedge_after,
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            if not start_backup("slow") and on_skip is not None:
+                # Keep waiting for the primary rather than add load to a full pool.
+                on_skip("slow")
+            continue
+        for future in done:
+            label = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as exc:
+                errors.append(exc)
+                if not backup_started and not start_backup("failed"):
+                    return fail_over_here(exc)
+                continue
+            for loser in pending:
+                loser.cancel()
+            return result, label
+    raise errors[0]
+
+
+async def run_hedged_async(
+    primary: Callable[[], Awaitable[T]],
+    backup: Callable[[], Awaitable[T]],
+    hedge_after: float,
+    on_hedge: Optional[Callable[[str], None]] = None,
+) -> Tuple[T, str]:
+    """Event-loop variant of run_hedged; the losing attempt is really cancelled."""
+    pending: Dict[asyncio.Task, str] = {asyncio.ensure_future(primary()): "primary"}
+    backup_started = False
+    errors: List[BaseException] = []
+
+    def start_backup(reason: str) -> None:
+        nonlocal backup_started
+        backup_started = True
+        if on_hedge is not None:
+            on_hedge(reason)
+        pending[asyncio.ensure_future(backup())] = "backup"
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                list(pending),
+                timeout=None if backup_started else hedge_after,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                start_backup("slow")
+                continue
+            for task in done:
+                label = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as exc:
+                    errors.append(exc)
+                    if not backup_started:
+                        start_backup("failed")
+                    continue
+                return result, label
+        raise errors[0]
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,308 @@
+"""Offline bulk pre-generation of question banks over a notes tree.
+
+Walks a directory for `.txt`/`.pdf` files and fills each one up to
+`MAX_QUESTIONS_PER_SOURCE` questions, several files at a time. Files are
+stored as uploads under their base name, so the app shows them as regular
+sources and "more questions" keeps working.
+
+Progress is checkpointed per file in a small SQLite database. After a crash
+or Ctrl-C, running the same command again skips finished files and tops up
+the rest. Finished files are redone only if their content changed. The
+question counts in the app database are authoritative, so a half-finished
+file resumes at the right count.
+
+Command line:
+
+    python3 pregenerate.py ../notes --workers 4 [--model-tier pro] [--model gpt-5.2]
+        [--checkpoint pregenerate.db] [--batch-size 25] [--target 50] [--tenant alice]
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from admission import AdmissionRejected
+from sharding import normalize_tenant_id, tenant_context
+from usage import usage_source
+
+DEFAULT_CHECKPOINT = "pregenerate.db"
+DEFAULT_BATCH_SIZE = 25
+# Batches that add no new question before a file is given up on.
+MAX_EMPTY_BATCHES = 2
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def find_note_files(root: Path, suffixes: set) -> List[Path]:
+    return sorted(p for p in Path(root).rglob("*") if p.is_file() and p.suffix.lower() in suffixes)
+
+
+class Checkpoint:
+    """Per-file progress shared by the worker threads."""
+
+    def __init__(self, path: Path) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pregeneration_files (
+                source_file TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                questions_stored INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, source_file: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM pregeneration_files WHERE source_file = ?",
+                (source_file,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def update(self, source_file: str, path: str, content_hash: str, status: str, questions_stored: int,
+               error: Optional[str] = None, new_attempt: bool = False) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO pregeneration_files
+                    (source_file, path, content_hash, status, questions_stored, attempts, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(source_file) DO UPDATE SET
+                    path = excluded.path,
+                    content_hash = excluded.content_hash,
+                    status = excluded.status,
+                    questions_stored = excluded.questions_stored,
+                    attempts = attempts + ?,
+                    last_error = excluded.last_error,
+                    updated_at = excluded.updated_at
+                """,
+                (source_file, path, content_hash, status, questions_stored, int(new_attempt), error, utc_now(),
+                 int(new_attempt)),
+            )
+            self._conn.commit()
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS files FROM pregeneration_files GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["files"] for row in rows}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class Progress:
+    """Thread-safe counters with a throughput line per finished file."""
+
+    def __init__(self, total_files: int, report: Callable[[str], None]) -> None:
+        self._lock = threading.Lock()
+        self._report = report
+        self.started = time.perf_counter()
+        self.total_files = total_files
+        self.finished_files = 0
+        self.questions = 0
+        self.provider_batches = 0
+        self.counts = {"done": 0, "skipped": 0, "failed": 0}
+
+    def add_batch(self, questions: int) -> None:
+        with self._lock:
+            self.questions += questions
+            self.provider_batches += 1
+
+    def file_finished(self, source_file: str, outcome: str) -> None:
+        with self._lock:
+            self.finished_files += 1
+            self.counts[outcome] += 1
+            elapsed = time.perf_counter() - self.started
+            rate = self.questions / elapsed * 60 if elapsed else 0.0
+            line = (
+                f"[{self.finished_files}/{self.total_files}] {outcome:<7} {source_file} "
+                f"| {self.questions} questions, {rate:.1f}/min, {elapsed:.0f}s elapsed"
+            )
+        self._report(line)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            return {
+                "files": self.total_files,
+                **self.counts,
+                "questions_generated": self.questions,
+                "provider_batches": self.provider_batches,
+                "elapsed_seconds": round(elapsed, 1),
+                "questions_per_minute": round(self.questions / elapsed * 60, 1) if elapsed else 0.0,
+                "files_per_minute": round(self.finished_files / elapsed * 60, 2) if elapsed else 0.0,
+            }
+
+
+class Pregenerator:
+    def __init__(
+        self,
+        app_module,
+        checkpoint: Checkpoint,
+        model: str,
+        model_tier: str = "pro",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        target: Optional[int] = None,
+        tenant: str = "default",
+        report: Callable[[str], None] = lambda line: print(line, file=sys.stderr, flush=True),
+    ) -> None:
+        self.app = app_module
+        self.checkpoint = checkpoint
+        self.model = model
+        self.model_tier = model_tier
+        self.batch_size = max(1, batch_size)
+        cap = app_module.MAX_QUESTIONS_PER_SOURCE
+        self.target = cap if target is None else max(1, min(target, cap))
+        self.tenant = tenant
+        self.report = report
+
+    def run(self, root: Path, workers: int = 4) -> Dict:
+        files = find_note_files(root, self.app.SUPPORTED_SUFFIXES)
+        by_name: Dict[str, Path] = {}
+        for path in files:
+            name = self.app.normalize_upload_filename(path.name)
+            if name in by_name:
+                raise ValueError(f"Two notes files share the name {name!r}: {by_name[name]} and {path}.")
+            by_name[name] = path
+
+        progress = Progress(len(by_name), self.report)
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pregenerate") as executor:
+            futures = {
+                executor.submit(self._run_file, name, path, progress): name for name, path in by_name.items()
+            }
+            for future in as_completed(futures):
+                progress.file_finished(futures[future], future.result())
+        return {**progress.snapshot(), "checkpoint": self.checkpoint.summary()}
+
+    def _run_file(self, source_file: str, path: Path, progress: Progress) -> str:
+        data = path.read_bytes()
+        content_hash = hashlib.sha256(data).hexdigest()
+        previous = self.checkpoint.get(source_file)
+        if previous and previous["status"] == "done" and previous["content_hash"] == content_hash:
+            return "skipped"
+
+        with tenant_context(self.tenant):
+            stored = self.app.count_generated_questions_by_source(source_file)
+            self.checkpoint.update(source_file, str(path), content_hash, "running", stored, new_attempt=True)
+            try:
+                stored = self._fill(source_file, path, data, content_hash, stored, progress)
+            except Exception as exc:
+                stored = self.app.count_generated_questions_by_source(source_file)
+                self.checkpoint.update(source_file, str(path), content_hash, "failed", stored, error=str(exc))
+                return "failed"
+        self.checkpoint.update(source_file, str(path), content_hash, "done", stored)
+        return "done"
+
+    def _fill(self, source_file: str, path: Path, data: bytes, content_hash: str, stored: int,
+              progress: Progress) -> int:
+        app = self.app
+        if stored >= self.target:
+            return stored
+        text_inputs, pdf_inputs, source_files = app.load_uploaded_file_content(
+            source_file,
+            data,
+            model_tier=self.model_tier,
+        )
+        pdf_classification = app.upload_pdf_classification(source_file, data)
+        app.upsert_uploaded_file(source_file)
+        app.upsert_uploaded_file_source(
+            source_file,
+            data,
+            pdf_kind=pdf_classification["kind"] if pdf_classification else None,
+        )
+
+        empty_batches = 0
+        while stored < self.target and empty_batches < MAX_EMPTY_BATCHES:
+            try:
+                reservation_id, count = app.reserve_generation_slots(
+                    source_file,
+                    min(self.batch_size, self.target - stored),
+                )
+            except app.SourceCapReached:
+                break
+            try:
+                with usage_source(source_file):
+                    questions_data = self._generate(text_inputs, pdf_inputs, count)[:count]
+                app.store_generated_questions(source_files, self.model, questions_data, reservation_id=reservation_id)
+            except BaseException:
+                app.release_generation_reservation(reservation_id)
+                raise
+            progress.add_batch(len(questions_data))
+            empty_batches = 0 if questions_data else empty_batches + 1
+            stored = app.count_generated_questions_by_source(source_file)
+            self.checkpoint.update(source_file, str(path), content_hash, "running", stored)
+        return stored
+
+    def _generate(self, text_inputs: List[Dict], pdf_inputs: List[Dict], count: int) -> List[Dict]:
+        # Admission rejections mean "too busy right now", not a bad file: wait and retry.
+        while True:
+            try:
+                return self.app.generate_questions(
+                    text_inputs,
+                    pdf_inputs,
+                    count,
+                    self.model,
+                    model_tier=self.model_tier,
+                )
+            except AdmissionRejected as exc:
+                time.sleep(exc.retry_after)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate question banks for every notes file under a directory.")
+    parser.add_argument("root", help="Directory tree with .txt/.pdf notes.")
+    parser.add_argument("--workers", type=int, default=4, help="Files generated in parallel (default 4).")
+    parser.add_argument("--model-tier", choices=["pro", "free"], default="pro")
+    parser.add_argument("--model", help="Defaults to the tier's default model.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Questions per provider call.")
+    parser.add_argument("--target", type=int, help="Questions per file (default and maximum MAX_QUESTIONS_PER_SOURCE).")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="SQLite file for resumable progress.")
+    parser.add_argument("--tenant", help="Tenant whose shard to fill when DB_SHARD_DIR is set.")
+    args = parser.parse_args(argv)
+
+    # Imported here so `--help` works without opening the database.
+    import app as app_module
+
+    model = args.model or (app_module.DEFAULT_MODEL if args.model_tier == "pro" else app_module.DEFAULT_OPENROUTER_MODEL)
+    checkpoint = Checkpoint(Path(args.checkpoint))
+    try:
+        summary = Pregenerator(
+            app_module,
+            checkpoint,
+            model,
+            model_tier=args.model_tier,
+            batch_size=args.batch_size,
+            target=args.target,
+            tenant=normalize_tenant_id(args.tenant),
+        ).run(Path(args.root), workers=args.workers)
+    finally:
+        checkpoint.close()
+        app_module.usage_recorder.close()
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""Opt-in request profiling and slow-request logging.
+
+A `RequestTrace` follows one request through a context variable. Code marks
+its phases with `stage("name")`, and the trace records how long each took.
+When a request is selected for profiling (a trigger header or a sample rate),
+it also runs either cProfile (`.prof` files for pstats/snakeviz) or a stack
+sampler (`.collapsed` files for flamegraph.pl/speedscope). Profiles go to a
+directory that keeps only the newest files. Requests slower than the threshold
+are logged as one JSON line with their stage timings.
+
+With profiling and the slow log both off, `start` returns None and `stage`
+returns a shared no-op context manager, so instrumented code pays only for a
+context variable lookup.
+"""
+
+import cProfile
+import json
+import logging
+import logging.handlers
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional
+
+slow_request_log = logging.getLogger("qastudytool.slow_requests")
+
+_active_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("request_trace", default=None)
+
+
+def configure_slow_request_log(path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5) -> None:
+    """Write slow-request entries to a size-rotated file as well as the normal log."""
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_request_log.addHandler(handler)
+    slow_request_log.setLevel(logging.INFO)
+
+
+class _NullStage:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *_exc) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, trace: "RequestTrace", name: str) -> None:
+        self._trace = trace
+        self._name = name
+        self._started = 0.0
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, *_exc) -> None:
+        elapsed_ms = (time.perf_counter() - self._started) * 1000
+        stages = self._trace.stages
+        stages[self._name] = stages.get(self._name, 0.0) + elapsed_ms
+
+
+def stage(name: str):
+    """Time a phase of the current request; a no-op outside a traced request."""
+    trace = _active_trace.get()
+    if trace is None:
+        return _NULL_STAGE
+    return _Stage(trace, name)
+
+
+def annotate(**fields) -> None:
+    """Attach metadata (e.g. file size, question count) to the current request's trace."""
+    trace = _active_trace.get()
+    if trace is not None:
+        trace.meta.update(fields)
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self.samples: Counter = Counter()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            frames: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if frames:
+                self.samples[";".join(reversed(frames))] += 1
+
+    def write(self, path: Path) -> None:
+        lines = [f"{stack} {count}" for stack, count in self.samples.most_common()]
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+class RequestTrace:
+    def __init__(self, method: str, path: str) -> None:
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.meta: Dict = {}
+        self.profiler = None
+        self.profile_file: Optional[str] = None
+        self.token: Optional[Token] = None
+        self.finished = False
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        profile_dir: str = "",
+        mode: str = "cprofile",
+        sample_rate: float = 0.0,
+        trigger_header: str = "X-Profile",
+        trigger_token: str = "",
+        max_files: int = 50,
+        sample_interval: float = 0.005,
+        slow_ms: float = 0.0,
+    ) -> None:
+        if mode not in {"cprofile", "sample"}:
+            raise ValueError("PROFILE_MODE must be 'cprofile' or 'sample'.")
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.trigger_header = trigger_header
+        self.trigger_token = trigger_token
+        self.max_files = max(1, max_files)
+        self.sample_interval = sample_interval
+        self.slow_ms = slow_ms
+        self._rotate_lock = threading.Lock()
+        self.profiled = 0
+        self.slow_requests = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.profile_dir is not None or self.slow_ms > 0
+
+    def _wants_profile(self, headers: Mapping[str, str]) -> bool:
+        if self.profile_dir is None:
+            return False
+        value = headers.get(self.trigger_header)
+        if value:
+            # With a token configured, only callers who know it can trigger a profile.
+            return value == self.trigger_token if self.trigger_token else value.strip().lower() in {"1", "true"}
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, method: str, path: str, headers: Mapping[str, str], allow_profile: bool = True) -> Optional[RequestTrace]:
+        if not self.enabled:
+            return None
+        trace = RequestTrace(method, path)
+        if allow_profile and self._wants_profile(headers):
+            if self.mode == "cprofile":
+                trace.profiler = cProfile.Profile()
+                trace.profiler.enable()
+            else:
+                trace.profiler = StackSampler(threading.get_ident(), self.sample_interval)
+                trace.profiler.start()
+        trace.token = _active_trace.set(trace)
+        return trace
+
+    def finish(self, trace: RequestTrace, status: int) -> Optional[str]:
+        """Stop profiling, write the profile and slow-log entry; returns the profile file name."""
+        if trace.finished:
+            return trace.profile_file
+        trace.finished = True
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        if trace.token is not None:
+            try:
+                _active_trace.reset(trace.token)
+            except ValueError:
+                _active_trace.set(None)  # Finished from a different context.
+
+        if trace.profiler is not None:
+            if isinstance(trace.profiler, StackSampler):
+                trace.profiler.stop()
+            else:
+                trace.profiler.disable()
+            trace.profile_file = self._write_profile(trace, duration_ms)
+
+        if self.slow_ms > 0 and duration_ms >= self.slow_ms:
+            self.slow_requests += 1
+            slow_request_log.warning(
+                json.dumps(
+                    {
+                        "method": trace.method,
+                        "path": trace.path,
+                        "status": status,
+                        "duration_ms": round(duration_ms, 1),
+                        "stages_ms": {name: round(ms, 1) for name, ms in trace.stages.items()},
+                        "profile": trace.profile_file,
+                        **trace.meta,
+                    },
+                    ensure_ascii=False,
+                    default=str,
+                )
+            )
+        return trace.profile_file
+
+    def _write_profile(self, trace: RequestTrace, duration_ms: float) -> str:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", trace.path).strip("-") or "root"
+        suffix = "prof" if self.mode == "cprofile" else "collapsed"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000:06d}-{trace.method}-{slug}-{int(duration_ms)}ms.{suffix}"
+        path = self.profile_dir / name
+        if isinstance(trace.profiler, StackSampler):
+            trace.profiler.write(path)
+        else:
+            trace.profiler.dump_stats(str(path))
+        self.profiled += 1
+        self._rotate()
+        return name
+
+    def _rotate(self) -> None:
+        with self._rotate_lock:
+            files = sorted(
+                (p for p in self.profile_dir.iterdir() if p.suffix in {".prof", ".collapsed"}),
+                key=lambda p: p.stat().st_mtime,
+            )
+            for old in files[: max(0, len(files) - self.max_files)]:
+                old.unlink(missing_ok=True)
+
+    def snapshot(self) -> Dict:
+        return {
+            "profile_dir": str(self.profile_dir) if self.profile_dir else None,
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "slow_request_ms": self.slow_ms,
+            "profiled_requests": self.profiled,
+            "slow_requests": self.slow_requests,
+        }
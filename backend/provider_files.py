@@ -0,0 +1,71 @@
+"""Provider-side file handles for PDF sources.
+
+Instead of embedding a whole PDF as a base64 data URL in every generation
+request, a source can be uploaded once through the provider's files API and
+referenced by the returned file ID afterwards. `ProviderFileClient` is the
+interface the app talks to; `OpenAIFileClient` is the real implementation and
+tests substitute a local stand-in.
+
+Uploads run inside a generation request, so the caller passes the timeout
+left in the request's budget; deletes happen later (on replacement or during
+maintenance) and use the client's own timeout.
+"""
+
+import abc
+from typing import Callable, Dict
+
+import requests
+
+
+class ProviderFileClient(abc.ABC):
+    """Uploads and deletes files on a provider. Implementations raise on failure."""
+
+    provider = "unknown"
+
+    @abc.abstractmethod
+    def upload(self, file_name: str, data: bytes, timeout: float) -> str:
+        """Upload `data` within `timeout` seconds and return the provider's file ID."""
+
+    @abc.abstractmethod
+    def delete(self, file_id: str) -> None:
+        """Delete a file; a file that is already gone is not an error."""
+
+    @abc.abstractmethod
+    def input_item(self, file_id: str) -> Dict:
+        """Content item that references an uploaded file in a generation request."""
+
+
+class OpenAIFileClient(ProviderFileClient):
+    provider = "openai"
+
+    def __init__(self, api_key: Callable[[], str], url: str, delete_timeout: float = 30) -> None:
+        # The key is read per call so a key set after startup is still picked up.
+        self._api_key = api_key
+        self._url = url.rstrip("/")
+        self._delete_timeout = delete_timeout
+
+    def _headers(self) -> Dict:
+        api_key = self._api_key()
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set.")
+        return {"Authorization": f"Bearer {api_key}"}
+
+    def upload(self, file_name: str, data: bytes, timeout: float) -> str:
+        response = requests.post(
+            self._url,
+            headers=self._headers(),
+            data={"purpose": "user_data"},
+            files={"file": (file_name, data, "application/pdf")},
+            timeout=timeout,
+        )
+        if response.status_code >= 400:
+            raise RuntimeError(f"OpenAI file upload error ({response.status_code}): {response.text}")
+        return response.json()["id"]
+
+    def delete(self, file_id: str) -> None:
+        response = requests.delete(f"{self._url}/{file_id}", headers=self._headers(), timeout=self._delete_timeout)
+        if response.status_code >= 400 and response.status_code != 404:
+            raise RuntimeError(f"OpenAI file delete error ({response.status_code}): {response.text}")
+
+    def input_item(self, file_id: str) -> Dict:
+        return {"type": "input_file", "file_id": file_id}
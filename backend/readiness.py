@@ -0,0 +1,93 @@
+"""Load-aware readiness.
+
+`/api/health` is the liveness probe: it answers as long as the process can
+serve a request at all. Readiness answers a different question: should this
+instance get new traffic right now? It looks at:
+- generations in flight;
+- the provider admission queue and the database write queue;
+- recent database write latency (p95);
+- the recent provider error rate.
+Past any configured limit the instance reports not-ready, so a load balancer
+sends traffic to other nodes until it recovers.
+
+The latency and error signals only cover the last `window_seconds`. Without
+that, an instance taken out of rotation would never see the fresh samples
+it needs to come back.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+
+class InFlightGauge:
+    """Number of operations currently running."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0
+        self.peak = 0
+
+    def enter(self) -> None:
+        with self._lock:
+            self.value += 1
+            self.peak = max(self.peak, self.value)
+
+    def exit(self) -> None:
+        with self._lock:
+            self.value -= 1
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        self.enter()
+        try:
+            yield
+        finally:
+            self.exit()
+
+
+class TimedWindow:
+    """Samples recorded during the last `window_seconds`."""
+
+    def __init__(self, window_seconds: float, max_samples: int = 10000) -> None:
+        self._window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=max_samples)
+
+    def record(self, value: float) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), value))
+
+    def values(self) -> List[float]:
+        cutoff = time.monotonic() - self._window_seconds
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return [value for _recorded, value in self._samples]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, or None without samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, int(math.ceil(pct * len(ordered)))) - 1]
+
+
+def error_rate(outcomes: List[float], min_calls: int) -> Optional[float]:
+    """Share of failed calls (recorded as 1.0), or None until `min_calls` were seen."""
+    if len(outcomes) < max(1, min_calls):
+        return None
+    return sum(outcomes) / len(outcomes)
+
+
+def failing_checks(signals: Dict[str, Optional[float]], limits: Dict[str, float]) -> List[str]:
+    """Signals above their limit; a limit of 0 (or less) disables that check."""
+    return [
+        name
+        for name, limit in limits.items()
+        if limit > 0 and signals.get(name) is not None and signals[name] > limit
+    ]
@@ -0,0 +1,108 @@
+"""JSON serialization with an optional fast backend.
+
+`orjson` is used when it is installed and falls back to the stdlib `json`
+module otherwise (`JSON_BACKEND=auto|orjson|stdlib`, default `auto`). Both
+backends write compact UTF-8 JSON without escaping non-ASCII text, so stored
+rows and responses keep CJK characters as-is whichever backend produced them.
+Values orjson cannot encode (e.g. integers beyond 64 bits) go through the
+stdlib encoder instead of failing.
+"""
+
+import json
+import os
+from typing import Any, Callable, Optional, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+Default = Optional[Callable[[Any], Any]]
+
+
+def _stdlib_dumps(obj: Any, default: Default, sort_keys: bool) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default, sort_keys=sort_keys)
+
+
+class StdlibSerializer:
+    name = "stdlib"
+
+    def dumps(self, obj: Any, default: Default = None, sort_keys: bool = False) -> str:
+        return _stdlib_dumps(obj, default, sort_keys)
+
+    def dumps_bytes(self, obj: Any, default: Default = None, sort_keys: bool = False) -> bytes:
+        return _stdlib_dumps(obj, default, sort_keys).encode("utf-8")
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(StdlibSerializer):
+    name = "orjson"
+
+    def dumps(self, obj: Any, default: Default = None, sort_keys: bool = False) -> str:
+        return self.dumps_bytes(obj, default=default, sort_keys=sort_keys).decode("utf-8")
+
+    def dumps_bytes(self, obj: Any, default: Default = None, sort_keys: bool = False) -> bytes:
+        # Dates and dataclasses go through `default` so output matches the stdlib path.
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            return _stdlib_dumps(obj, default, sort_keys).encode("utf-8")
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+
+def get_serializer(backend: str = "auto") -> StdlibSerializer:
+    backend = (backend or "auto").strip().lower()
+    if backend not in {"auto", "orjson", "stdlib"}:
+        raise ValueError("JSON_BACKEND must be one of: auto, orjson, stdlib.")
+    if backend == "orjson" and orjson is None:
+        raise ValueError("JSON_BACKEND=orjson requires the 'orjson' package.")
+    if backend != "stdlib" and orjson is not None:
+        return OrjsonSerializer()
+    return StdlibSerializer()
+
+
+serializer = get_serializer(os.environ.get("JSON_BACKEND", "auto"))
+
+
+def dumps(obj: Any) -> str:
+    return serializer.dumps(obj)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    return serializer.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by `serializer`.
+
+    Compact responses are encoded straight to bytes. Pretty-printed (debug)
+    output and calls with extra `json.dumps` arguments use Flask's default path.
+    """
+
+    ensure_ascii = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if set(kwargs) <= {"separators"} and not self.ensure_ascii:
+            return serializer.dumps(obj, default=self.default, sort_keys=self.sort_keys)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return serializer.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if self.compact is False or (self.compact is None and self._app.debug) or self.ensure_ascii:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = serializer.dumps_bytes(obj, default=self.default, sort_keys=self.sort_keys) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,237 @@
+"""Tenant routing for per-tenant SQLite files.
+
+With `DB_SHARD_DIR` set, every tenant gets its own database file
+(`tenant-<id>.db`) and all `get_db_connection`/`run_write` callers are routed
+to the file of the tenant in the current context. The tenant comes from the
+`X-Tenant-ID` request header and is carried in a context variable, so it
+follows the request through helpers without being passed explicitly.
+
+Splitting an existing single database:
+
+    python3 sharding.py split study_data.db shards/ --assign tenants.json
+
+`tenants.json` maps source file names to tenant IDs; rows for unmapped
+sources go to the `--default-tenant` (default `default`).
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Callable, Dict, Generic, Iterator, List, Optional, TypeVar
+
+DEFAULT_TENANT = "default"
+TENANT_HEADER = "X-Tenant-ID"
+TENANT_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+SHARD_FILE_RE = re.compile(r"^tenant-([A-Za-z0-9][A-Za-z0-9_.-]{0,63})\.db$")
+# `data_versions` row holding a random per-database salt for listing ETags.
+DATA_EPOCH_SCOPE = "epoch"
+# Tables copied by `split`, with the column that decides the tenant.
+SPLIT_TABLES = {
+    "uploaded_files": "file_name",
+    "uploaded_file_sources": "file_name",
+    "generated_questions": "source_file",
+    "wrong_answers": "source_file",
+    "answer_events": "source_file",
+    "provider_usage": "source_file",
+    "review_items": "source_file",
+}
+
+T = TypeVar("T")
+
+_current_tenant: ContextVar[str] = ContextVar("tenant", default=DEFAULT_TENANT)
+
+
+def normalize_tenant_id(raw: Optional[str]) -> str:
+    tenant = (raw or "").strip()
+    if not tenant:
+        return DEFAULT_TENANT
+    if not TENANT_ID_RE.match(tenant):
+        raise ValueError("Tenant ID must be 1-64 letters, digits, '.', '_' or '-'.")
+    return tenant
+
+
+def current_tenant() -> str:
+    return _current_tenant.get()
+
+
+def set_current_tenant(tenant: str) -> Token:
+    return _current_tenant.set(tenant)
+
+
+def reset_current_tenant(token: Token) -> None:
+    _current_tenant.reset(token)
+
+
+@contextmanager
+def tenant_context(tenant: str) -> Iterator[None]:
+    token = set_current_tenant(tenant)
+    try:
+        yield
+    finally:
+        reset_current_tenant(token)
+
+
+def tenant_db_path(shard_dir: Path, tenant: str) -> Path:
+    return Path(shard_dir) / f"tenant-{tenant}.db"
+
+
+def list_shard_tenants(shard_dir: Path) -> List[str]:
+    shard_dir = Path(shard_dir)
+    if not shard_dir.is_dir():
+        return []
+    tenants = []
+    for path in sorted(shard_dir.iterdir()):
+        match = SHARD_FILE_RE.match(path.name)
+        if match:
+            tenants.append(match.group(1))
+    return tenants
+
+
+class HandleLRU(Generic[T]):
+    """Keeps at most `capacity` open handles, closing the least recently used."""
+
+    def __init__(self, capacity: int, close: Callable[[T], None]) -> None:
+        self._capacity = max(1, capacity)
+        self._close = close
+        self._lock = threading.Lock()
+        self._handles: "OrderedDict[str, T]" = OrderedDict()
+        self.opened = 0
+        self.evicted = 0
+
+    def get(self, key: str, factory: Callable[[], T]) -> T:
+        evicted: List[T] = []
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                return handle
+            handle = factory()
+            self._handles[key] = handle
+            self.opened += 1
+            while len(self._handles) > self._capacity:
+                evicted.append(self._handles.popitem(last=False)[1])
+                self.evicted += 1
+        for old in evicted:
+            self._close(old)
+        return handle
+
+    def values(self) -> List[T]:
+        with self._lock:
+            return list(self._handles.values())
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "open": len(self._handles),
+                "capacity": self._capacity,
+                "opened": self.opened,
+                "evicted": self.evicted,
+            }
+
+
+def split_database(
+    source: Path,
+    shard_dir: Path,
+    assignments: Dict[str, str],
+    init_shard: Callable[[Path], None],
+    default_tenant: str = DEFAULT_TENANT,
+) -> Dict[str, Dict[str, int]]:
+    """Copy rows from a single database into per-tenant shards; returns row counts per tenant."""
+    for tenant in set(assignments.values()) | {default_tenant}:
+        normalize_tenant_id(tenant)
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    source_conn = sqlite3.connect(source)
+    try:
+        existing = {row[0] for row in source_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        source_conn.close()
+
+    tenants = sorted(set(assignments.values()) | {default_tenant})
+    counts: Dict[str, Dict[str, int]] = {}
+    for tenant in tenants:
+        path = tenant_db_path(shard_dir, tenant)
+        init_shard(path)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS src", (str(source),))
+            conn.execute("CREATE TEMP TABLE tenant_sources (source_file TEXT PRIMARY KEY)")
+            conn.executemany(
+                "INSERT INTO tenant_sources VALUES (?)",
+                [(name,) for name, owner in assignments.items() if owner == tenant],
+            )
+            if tenant == default_tenant:
+                # The default tenant also receives every source nobody claimed.
+                conn.execute("CREATE TEMP TABLE claimed_sources (source_file TEXT PRIMARY KEY)")
+                conn.executemany(
+                    "INSERT INTO claimed_sources VALUES (?)",
+                    [(name,) for name, owner in assignments.items() if owner != tenant],
+                )
+            counts[tenant] = {}
+            for table, column in SPLIT_TABLES.items():
+                if table not in existing:
+                    continue
+                source_columns = [row[1] for row in conn.execute(f"PRAGMA src.table_info({table})")]
+                target_columns = {row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")}
+                columns = ", ".join(c for c in source_columns if c in target_columns)
+                if tenant == default_tenant:
+                    condition = (
+                        f"COALESCE({column}, '') NOT IN (SELECT source_file FROM claimed_sources)"
+                    )
+                else:
+                    condition = f"{column} IN (SELECT source_file FROM tenant_sources)"
+                cur = conn.execute(
+                    f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM src.{table} WHERE {condition}"
+                )
+                counts[tenant][table] = cur.rowcount
+            # A re-split shard may reach version numbers it had before; a new
+            # epoch keeps ETags cached from the old file from matching.
+            conn.execute(
+                "UPDATE main.data_versions SET version = abs(random() % 2147483647) WHERE scope = ?",
+                (DATA_EPOCH_SCOPE,),
+            )
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+        finally:
+            conn.close()
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Split a single study database into per-tenant shards.")
+    parser.add_argument("command", choices=["split"])
+    parser.add_argument("source", help="Existing single database, e.g. study_data.db.")
+    parser.add_argument("shard_dir", help="Directory for tenant-<id>.db files (use as DB_SHARD_DIR).")
+    parser.add_argument("--assign", help="JSON file mapping source file names to tenant IDs.")
+    parser.add_argument("--default-tenant", default=DEFAULT_TENANT)
+    args = parser.parse_args(argv)
+
+    assignments: Dict[str, str] = {}
+    if args.assign:
+        with open(args.assign, encoding="utf-8") as handle:
+            assignments = json.load(handle)
+
+    # Imported here so `--help` works without opening the database.
+    import app as app_module
+
+    counts = split_database(
+        Path(args.source),
+        Path(args.shard_dir),
+        assignments,
+        app_module.init_db,
+        default_tenant=normalize_tenant_id(args.default_tenant),
+    )
+    print(json.dumps(counts, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Coalesce identical in-flight calls so concurrent duplicates share one result.
+
+A shared call runs under its own `SharedDeadline`, not under the deadline of
+the request that happened to start it. Each waiter joins that deadline, so
+the call is stopped only when every waiter has given up or run out of time.
+"""
+
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from deadlines import SharedDeadline, current_deadline, reset_current_deadline, set_current_deadline
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.deadline = SharedDeadline()
+
+
+class SingleFlight:
+    """Thread-based single-flight: the first caller for a key runs `fn`, the rest wait for it."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """Return (result, shared); `shared` is True when another caller's run was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+            call.deadline.join(current_deadline())
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        token = set_current_deadline(call.deadline)
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            reset_current_deadline(token)
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(call.waiters for call in self._calls.values())
+
+
+class _AsyncCall:
+    def __init__(self, task: asyncio.Task, deadline: SharedDeadline) -> None:
+        self.task = task
+        self.deadline = deadline
+        self.callers = 0
+
+
+class AsyncSingleFlight:
+    """Event-loop single-flight for the ASGI path.
+
+    The shared call runs in its own task. A caller that is cancelled (its
+    client went away) stops waiting without affecting the others; the call
+    itself is cancelled only once nobody is waiting for its result.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _AsyncCall] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            deadline = SharedDeadline()
+
+            async def run() -> T:
+                # Runs in a copy of this caller's context (tenant, trace) with the shared deadline.
+                set_current_deadline(deadline)
+                return await fn()
+
+            call = _AsyncCall(asyncio.ensure_future(run()), deadline)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+        waiter_deadline = current_deadline()
+        call.deadline.join(waiter_deadline)
+        call.callers += 1
+        try:
+            # shield() keeps one cancelled caller from cancelling the shared call.
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.deadline.leave(waiter_deadline)
+            call.callers -= 1
+            if call.callers == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _AsyncCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,108 @@
+"""Admission controller tests (no external network required)."""
+
+import threading
+import time
+import unittest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_concurrency_cap_queues_then_rejects_when_full(self) -> None:
+        controller = AdmissionController({'openrouter': {'concurrency': 1}}, max_queue=1, max_wait_seconds=5)
+        first = controller.acquire('OpenRouter', 'm', 10)
+
+        admitted = []
+        waiter = threading.Thread(
+            target=lambda: admitted.append(controller.acquire('OpenRouter', 'm', 10)),
+        )
+        waiter.start()
+        for _ in range(100):
+            if controller.snapshot()['queue_depth'] == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(controller.snapshot()['lanes']['openrouter']['queue_depth'], 1)
+
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire('OpenRouter', 'm', 10)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        controller.release(first)
+        waiter.join(timeout=5)
+        self.assertEqual(len(admitted), 1)
+        lane = controller.snapshot()['lanes']['openrouter']
+        self.assertEqual((lane['in_flight'], lane['admitted'], lane['rejected']), (1, 2, 1))
+        controller.release(admitted[0])
+
+    def test_token_bucket_prices_input_tokens_and_times_out(self) -> None:
+        controller = AdmissionController(
+            {'openai/gpt-5.2': {'tokens_per_minute': 600}},
+            max_queue=4,
+            max_wait_seconds=5,
+        )
+        controller.release(controller.acquire('openai', 'gpt-5.2', 600))
+
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire('openai', 'gpt-5.2', 600, timeout=0.05)
+        # 600 tokens/minute refill at 10/s, so a full-size request needs about a minute.
+        self.assertGreaterEqual(ctx.exception.retry_after, 50)
+
+        # Other models on the same provider are unaffected by the model lane.
+        controller.release(controller.acquire('openai', 'gpt-4.1', 600, timeout=0.05))
+
+    def test_queued_large_call_is_served_before_later_small_calls(self) -> None:
+        controller = AdmissionController({'openai': {'tokens_per_minute': 6000}}, max_queue=4, max_wait_seconds=5)
+        controller.release(controller.acquire('openai', 'm', 6000))
+
+        order = []
+
+        def call(name, tokens):
+            controller.release(controller.acquire('openai', 'm', tokens))
+            order.append(name)
+
+        # Refill is 100 tokens/s: the small call would fit after 0.1s, the large one after 1.5s.
+        large = threading.Thread(target=call, args=('large', 150))
+        large.start()
+        for _ in range(100):
+            if controller.snapshot()['queue_depth'] == 1:
+                break
+            time.sleep(0.01)
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire('openai', 'm', 10, timeout=0.5)
+        small = threading.Thread(target=call, args=('small', 10))
+        small.start()
+        large.join(timeout=10)
+        small.join(timeout=10)
+        self.assertEqual(order, ['large', 'small'])
+
+    def test_queue_bound_is_per_provider(self) -> None:
+        controller = AdmissionController(
+            {'openrouter': {'concurrency': 1}, 'openai': {'concurrency': 1}},
+            max_queue=1,
+            max_wait_seconds=5,
+        )
+        held = [controller.acquire('openrouter', 'm', 10), controller.acquire('openai', 'm', 10)]
+        waiters = [
+            threading.Thread(target=lambda p=provider: controller.release(controller.acquire(p, 'm', 10)))
+            for provider in ('openrouter', 'openai')
+        ]
+        for waiter in waiters:
+            waiter.start()
+        for _ in range(100):
+            if controller.snapshot()['queue_depth'] == 2:
+                break
+            time.sleep(0.01)
+        snapshot = controller.snapshot()
+        self.assertEqual((snapshot['queue_depth'], snapshot['max_provider_queue_depth']), (2, 1))
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire('openrouter', 'm', 10)
+
+        for ticket in held:
+            controller.release(ticket)
+        for waiter in waiters:
+            waiter.join(timeout=5)
+        self.assertEqual(controller.snapshot()['queue_depth'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
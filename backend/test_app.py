@@ -2,12 +2,26 @@
 
 import io
 import os
+import sqlite3
 import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from collections import OrderedDict
+from unittest.mock import Mock, patch
+
+from PyPDF2 import PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
 
 import app as app_module
 from app import app
+from deadlines import RequestCancelled, deadline_scope
+from pregenerate import Checkpoint, Pregenerator
+from profiling import RequestProfiler, stage
+from provider_files import ProviderFileClient
+from readiness import TimedWindow
+from serialization import OrjsonSerializer, StdlibSerializer, orjson
+from sharding import HandleLRU, split_database, tenant_context
 
 
 class BackendApiTest(unittest.TestCase):
@@ -222,6 +236,1053 @@ class BackendApiTest(unittest.TestCase):
         self.assertEqual(list_after_delete.status_code, 200)
         self.assertEqual(list_after_delete.get_json().get('items', []), [])
 
+    def test_answer_batch_is_idempotent_and_feeds_error_collection(self) -> None:
+        answers = [
+            {
+                'question': f'Q{i}',
+                'options': ['A', 'B', 'C', 'D'],
+                'correct_index': 0,
+                'selected_index': 0 if i % 2 == 0 else 2,
+                'source_file': 'batch.txt',
+                'model': 'gpt-5.2',
+            }
+            for i in range(6)
+        ]
+        answers[0]['idempotency_key'] = 'client-key-0'
+
+        first = self.client.post('/api/answers/batch', json={'session_id': 's1', 'answers': answers})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_json()['inserted'], 6)
+        self.assertEqual(first.get_json()['stored_wrong'], 3)
+
+        retry = self.client.post('/api/answers/batch', json={'session_id': 's1', 'answers': answers})
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.get_json()['inserted'], 0)
+        self.assertEqual(retry.get_json()['duplicates'], 6)
+
+        items = self.client.get('/api/wrong-answers?source_file=batch.txt').get_json()['items']
+        self.assertEqual(len(items), 3)
+
+        bad = dict(answers[1], selected_index=7)
+        invalid = self.client.post('/api/answers/batch', json={'session_id': 's2', 'answers': [answers[0], bad]})
+        self.assertEqual(invalid.status_code, 400)
+        self.assertIn('answers[1]', invalid.get_json()['error'])
+        self.assertEqual(len(self.client.get('/api/wrong-answers?source_file=batch.txt').get_json()['items']), 3)
+
+    def test_review_queue_schedules_wrong_answers_and_defers_relearned_ones(self) -> None:
+        wrong = {
+            'question': 'Capital of France?',
+            'options': ['Paris', 'Rome', 'Berlin', 'Madrid'],
+            'correct_index': 0,
+            'selected_index': 2,
+            'source_file': 'geo.txt',
+        }
+        self.assertEqual(self.client.post('/api/wrong-answer', json=wrong).status_code, 200)
+        self.client.post('/api/wrong-answer', json=dict(wrong, question='Capital of Italy?', correct_index=1))
+
+        due = self.client.get('/api/review/next?limit=10').get_json()['items']
+        self.assertEqual({item['question'] for item in due}, {'Capital of France?', 'Capital of Italy?'})
+        self.assertEqual(due[0]['repetitions'], 0)
+
+        relearned = dict(wrong, selected_index=0)
+        batch = self.client.post('/api/answers/batch', json={'session_id': 'review-1', 'answers': [relearned]})
+        self.assertEqual(batch.status_code, 200)
+
+        due_after = self.client.get('/api/review/next?source_file=geo.txt').get_json()['items']
+        self.assertEqual([item['question'] for item in due_after], ['Capital of Italy?'])
+
+        conn = app_module.get_db_connection()
+        try:
+            plan = ' '.join(
+                row['detail']
+                for row in conn.execute(
+                    'EXPLAIN QUERY PLAN SELECT id FROM review_items WHERE due_at <= ? ORDER BY due_at LIMIT 5',
+                    ('2100-01-01 00:00:00',),
+                )
+            )
+        finally:
+            conn.close()
+        self.assertIn('idx_review_items_due', plan)
+
+    def test_correct_single_answer_moves_a_missed_question_out_of_the_due_list(self) -> None:
+        wrong = {
+            'question': 'Largest planet?',
+            'options': ['Mars', 'Jupiter', 'Venus', 'Earth'],
+            'correct_index': 1,
+            'selected_index': 0,
+            'source_file': 'space.txt',
+        }
+        self.client.post('/api/wrong-answer', json=wrong)
+        due = self.client.get('/api/review/next?source_file=space.txt').get_json()['items']
+        self.assertEqual([item['question'] for item in due], ['Largest planet?'])
+
+        right = self.client.post('/api/wrong-answer', json=dict(wrong, selected_index=1))
+        self.assertEqual(right.get_json(), {'ok': True, 'stored': False})
+        self.assertEqual(self.client.get('/api/review/next?source_file=space.txt').get_json()['items'], [])
+        self.assertEqual(len(app_module.list_wrong_answers_by_source('space.txt')), 1)
+
+    def test_sm2_schedule_grows_intervals_and_resets_on_lapse(self) -> None:
+        ease, interval, reps = app_module.sm2_schedule(2.5, 0.0, 0, 4)
+        self.assertEqual((interval, reps), (1.0, 1))
+        ease, interval, reps = app_module.sm2_schedule(ease, interval, reps, 4)
+        self.assertEqual((interval, reps), (6.0, 2))
+        ease, interval, reps = app_module.sm2_schedule(ease, interval, reps, 4)
+        self.assertGreater(interval, 6.0)
+        lapsed_ease, interval, reps = app_module.sm2_schedule(ease, interval, reps, 1)
+        self.assertEqual((interval, reps), (0.0, 0))
+        self.assertLess(lapsed_ease, ease)
+
+    @patch('app.generate_questions')
+    def test_listings_return_304_until_their_source_changes(self, mock_generate_questions) -> None:
+        mock_generate_questions.return_value = [
+            {'question': 'Q1', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': 'E'}
+        ]
+        for name in ('etag_a.txt', 'etag_b.txt'):
+            upload = self.client.post(
+                '/api/questions/upload',
+                data={'file': (io.BytesIO(b'hello'), name), 'question_count': '1'},
+                content_type='multipart/form-data',
+            )
+            self.assertEqual(upload.status_code, 200)
+
+        first = self.client.get('/api/favorite-collections')
+        etag = first.headers['ETag']
+        self.assertIsNotNone(first.headers.get('Last-Modified'))
+        with patch('app.list_generated_collections') as mock_listing:
+            cached = self.client.get('/api/favorite-collections', headers={'If-None-Match': etag})
+            mock_listing.assert_not_called()
+        self.assertEqual(cached.status_code, 304)
+
+        source_a = self.client.get('/api/generated-questions?source_file=etag_a.txt')
+        source_a_etag = source_a.headers['ETag']
+
+        self.client.post('/api/wrong-answer', json={
+            'question': 'Q1',
+            'options': ['A', 'B', 'C', 'D'],
+            'correct_index': 0,
+            'selected_index': 1,
+            'source_file': 'etag_b.txt',
+        })
+
+        unchanged = self.client.get(
+            '/api/generated-questions?source_file=etag_a.txt',
+            headers={'If-None-Match': source_a_etag},
+        )
+        self.assertEqual(unchanged.status_code, 304)
+        changed = self.client.get('/api/favorite-collections', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+        # Last-Modified has one-second resolution, so it never produces a 304.
+        same_second = self.client.get('/api/favorite-collections', headers={
+            'If-Modified-Since': changed.headers['Last-Modified']})
+        self.assertEqual(same_second.status_code, 200)
+
+    @patch('app.generate_questions')
+    def test_upload_returns_429_with_retry_after_when_provider_queue_is_full(self, mock_generate_questions) -> None:
+        mock_generate_questions.side_effect = app_module.AdmissionRejected('Provider queue is full, retry later.', 7)
+        response = self.client.post(
+            '/api/questions/upload',
+            data={'file': (io.BytesIO(b'hello'), 'busy.txt'), 'question_count': '1', 'model_tier': 'free'},
+            content_type='multipart/form-data',
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '7')
+        self.assertEqual(response.get_json()['code'], 'rate_limited')
+        self.assertFalse(app_module.has_uploaded_file('busy.txt'))
+
+        metrics = self.client.get('/api/metrics').get_json()
+        self.assertIn('queue_depth', metrics['admission'])
+
+    def seed_source(self, file_name: str, question_total: int) -> None:
+        app_module.upsert_uploaded_file(file_name)
+        app_module.upsert_uploaded_file_source(file_name, b'hello world')
+        app_module.store_generated_questions(
+            [file_name],
+            'gpt-5.2',
+            [
+                {'question': f'Seed {i}', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+                for i in range(question_total)
+            ],
+        )
+
+    def test_bootstrap_matches_the_listings_and_reads_one_snapshot(self) -> None:
+        self.seed_source('boot.txt', 3)
+        self.seed_source('other.txt', 1)
+        app_module.store_wrong_answer(
+            source_file='boot.txt', question='Seed 0', options=['A', 'B', 'C', 'D'],
+            correct_index=0, selected_index=2, model='gpt-5.2',
+        )
+
+        with patch('app.get_db_connection', wraps=app_module.get_db_connection) as connections:
+            payload = app_module.load_bootstrap(source_file='boot.txt', limit=2)
+        self.assertEqual(connections.call_count, 1)
+
+        response = self.client.get('/api/bootstrap?source_file=boot.txt&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), payload)
+        self.assertEqual(payload['error_collections'], self.client.get('/api/error-collections').get_json()['items'])
+        self.assertEqual(payload['favorite_collections'],
+                         self.client.get('/api/favorite-collections').get_json()['items'])
+        self.assertEqual(payload['wrong_answers'], self.client.get('/api/wrong-answers').get_json()['items'])
+        source = payload['source']
+        self.assertEqual(len(source['generated_questions']), 2)
+        self.assertEqual(source['total_questions_for_source'], 3)
+        self.assertEqual([item['question'] for item in source['wrong_answers']], ['Seed 0'])
+        self.assertNotIn('source', self.client.get('/api/bootstrap').get_json())
+
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/api/bootstrap?source_file=boot.txt&limit=2',
+                                         headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get('/api/bootstrap?limit=0').status_code, 400)
+
+    def test_readiness_sheds_load_past_its_limits_while_liveness_stays_up(self) -> None:
+        with patch.object(app_module, 'provider_outcomes', TimedWindow(60)), \
+                patch.object(app_module, 'db_write_latency_ms', TimedWindow(60)), \
+                patch.object(app_module, 'READY_MIN_PROVIDER_CALLS', 4):
+            ready = self.client.get('/api/ready')
+            self.assertEqual(ready.status_code, 200)
+            self.assertTrue(ready.get_json()['ready'])
+            self.assertIsNone(ready.get_json()['signals']['provider_error_rate'])
+
+            for failed in (0.0, 1.0, 1.0, 1.0):
+                app_module.provider_outcomes.record(failed)
+            shedding = self.client.get('/api/ready')
+            self.assertEqual(shedding.status_code, 503)
+            self.assertEqual(shedding.get_json()['failing'], ['provider_error_rate'])
+            self.assertEqual(shedding.get_json()['signals']['provider_error_rate'], 0.75)
+            self.assertEqual(self.client.get('/api/health').status_code, 200)
+
+            with patch.object(app_module, 'READY_MAX_PROVIDER_ERROR_RATE', 0), \
+                    patch.object(app_module, 'READY_MAX_IN_FLIGHT', 1):
+                app_module.generations_in_flight.enter()
+                app_module.generations_in_flight.enter()
+                try:
+                    busy = self.client.get('/api/ready')
+                finally:
+                    app_module.generations_in_flight.exit()
+                    app_module.generations_in_flight.exit()
+                self.assertEqual(busy.get_json()['failing'], ['in_flight_generations'])
+                self.assertEqual(self.client.get('/api/ready').status_code, 200)
+
+        # Old samples age out, so an instance taken out of rotation can recover.
+        window = TimedWindow(0.05)
+        window.record(1.0)
+        time.sleep(0.1)
+        self.assertEqual(window.values(), [])
+
+    @patch('app.generate_questions')
+    def test_identical_concurrent_more_requests_share_one_generation(self, mock_generate_questions) -> None:
+        self.seed_source('flight.txt', 10)
+        release = threading.Event()
+
+        def slow_generate(_text_inputs, _pdf_inputs, question_count, _model, model_tier='pro'):
+            release.wait(5)
+            return [
+                {'question': f'N{i}', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+                for i in range(question_count)
+            ]
+
+        mock_generate_questions.side_effect = slow_generate
+        responses = []
+
+        def click() -> None:
+            responses.append(app.test_client().post('/api/questions/more', json={'source_file': 'flight.txt'}))
+
+        threads = [threading.Thread(target=click) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            if app_module.generation_flights.waiting() == 2:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(mock_generate_questions.call_count, 1)
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200])
+        self.assertEqual(sorted(r.get_json()['coalesced'] for r in responses), [False, True, True])
+        self.assertEqual(app_module.count_generated_questions_by_source('flight.txt'), 20)
+
+    @patch('app.generate_questions')
+    def test_generation_reservations_enforce_cap_and_release_on_failure(self, mock_generate_questions) -> None:
+        self.seed_source('cap.txt', 45)
+        first_id, first_count = app_module.reserve_generation_slots('cap.txt', 10)
+        self.assertEqual(first_count, 5)
+        with self.assertRaises(app_module.SourceCapReached):
+            app_module.reserve_generation_slots('cap.txt', 10)
+
+        mock_generate_questions.side_effect = RuntimeError('provider down')
+        app_module.release_generation_reservation(first_id)
+        failed = self.client.post('/api/questions/more', json={'source_file': 'cap.txt'})
+        self.assertEqual(failed.status_code, 400)
+        self.assertIn('provider down', failed.get_json()['error'])
+
+        _reservation_id, count_after_failure = app_module.reserve_generation_slots('cap.txt', 10)
+        self.assertEqual(count_after_failure, 5)
+
+    @patch('app.generate_questions')
+    def test_generation_past_its_budget_returns_504_and_stores_nothing(self, mock_generate_questions) -> None:
+        def slow_generate(_text_inputs, _pdf_inputs, count, _model, model_tier='pro', source_names=None):
+            time.sleep(0.2)
+            return [
+                {'question': f'Q{i}', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+                for i in range(count)
+            ]
+
+        mock_generate_questions.side_effect = slow_generate
+        with patch.object(app_module, 'GENERATION_BUDGET_SECONDS', 0.1):
+            response = self.client.post(
+                '/api/questions/upload',
+                data={'file': (io.BytesIO(b'notes'), 'late.txt'), 'question_count': '5'},
+                content_type='multipart/form-data',
+            )
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.get_json()['code'], 'deadline_exceeded')
+        self.assertFalse(app_module.has_uploaded_file('late.txt'))
+        self.assertEqual(app_module.count_generated_questions_by_source('late.txt'), 0)
+        _reservation_id, count = app_module.reserve_generation_slots('late.txt', 50)
+        self.assertEqual(count, 50)
+        self.assertGreaterEqual(app_module.metric_snapshot().get('deadline_exceeded_store', 0), 1)
+
+    def test_provider_calls_use_the_remaining_budget_and_stop_once_cancelled(self) -> None:
+        notes = [{'type': 'input_text', 'text': 'notes'}]
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}), \
+                patch('app.requests.post', side_effect=app_module.requests.Timeout('slow')) as mock_post:
+            with deadline_scope(2) as deadline:
+                with self.assertRaises(app_module.requests.Timeout):
+                    app_module.request_questions(notes, [], 1, 'gpt-5.2')
+                self.assertLessEqual(mock_post.call_args.kwargs['timeout'], 2)
+
+                deadline.cancel()
+                with self.assertRaises(RequestCancelled):
+                    app_module.request_questions(notes, [], 1, 'gpt-5.2')
+        self.assertEqual(mock_post.call_count, 1)
+        app_module.usage_recorder.flush()  # Keep the failed call's usage row out of later tests.
+
+    def test_a_spent_deadline_is_recorded_as_timeout_not_as_a_provider_error(self) -> None:
+        def slow_post(*_args, **_kwargs):
+            time.sleep(0.06)
+            raise app_module.requests.Timeout('slow')
+
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}), \
+                patch('app.requests.post', side_effect=slow_post), \
+                patch.object(app_module, 'provider_outcomes', TimedWindow(60)):
+            request = app_module.build_generation_request([{'type': 'input_text', 'text': 'notes'}], [], 1, 'gpt-5.2')
+            with deadline_scope(0.05) as deadline:
+                request['deadline'] = deadline
+                with self.assertRaises(app_module.DeadlineExceeded):
+                    app_module.call_provider(request)
+            self.assertEqual(app_module.provider_outcomes.values(), [])
+        app_module.usage_recorder.flush()
+        conn = app_module.get_db_connection()
+        try:
+            statuses = [row['status'] for row in conn.execute("SELECT status FROM provider_usage")]
+        finally:
+            conn.close()
+        self.assertEqual(statuses, ['timeout'])
+
+    def test_shared_flight_outlives_a_cancelled_leader_but_not_all_waiters(self) -> None:
+        from deadlines import check_deadline
+        from singleflight import SingleFlight
+
+        flights = SingleFlight()
+        release = threading.Event()
+        deadlines = {}
+        results = {}
+
+        def work():
+            release.wait(5)
+            check_deadline('store')
+            return 'stored'
+
+        def caller(name):
+            with deadline_scope(30) as deadline:
+                deadlines[name] = deadline
+                results[name] = flights.do('key', work)
+
+        def wait_for(condition):
+            for _ in range(500):
+                if condition():
+                    return
+                time.sleep(0.01)
+
+        leader = threading.Thread(target=caller, args=('leader',))
+        leader.start()
+        wait_for(lambda: flights.in_flight() == 1)
+        follower = threading.Thread(target=caller, args=('follower',))
+        follower.start()
+        wait_for(lambda: flights.waiting() == 1)
+        deadlines['leader'].cancel()  # The leader's client goes away; the follower still waits.
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(results['follower'], ('stored', True))
+
+        with deadline_scope(30) as deadline:
+            deadline.cancel()
+            with self.assertRaises(RequestCancelled):
+                flights.do('alone', work)
+
+    def test_generate_questions_hedges_to_configured_backup_model(self) -> None:
+        def fake_call_provider(generation_request):
+            if generation_request['model'] == 'slow-model':
+                time.sleep(0.5)
+            return [{'question': generation_request['model'], 'options': ['A', 'B', 'C', 'D'],
+                     'correct_index': 0, 'explanation': ''}]
+
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}), \
+                patch.object(app_module, 'HEDGE_ENABLED', True), \
+                patch.object(app_module, 'HEDGE_BACKUPS', {'slow-model': {'model': 'backup-model'}}), \
+                patch.object(app_module, 'HEDGE_DEFAULT_DELAY_SECONDS', 0.05), \
+                patch('app.call_provider', side_effect=fake_call_provider):
+            result = app_module.generate_questions(
+                [{'type': 'input_text', 'text': 'notes'}], [], 1, 'slow-model', model_tier='pro'
+            )
+        self.assertEqual(result[0]['question'], 'backup-model')
+        self.assertGreaterEqual(app_module.metric_snapshot().get('hedge_backup_wins', 0), 1)
+
+    def test_parse_model_json_salvages_complete_questions(self) -> None:
+        good = '{"question": "Q%d", "options": ["A", "B", "C", "D"], "correct_index": 0, "explanation": ""}'
+        raw = (
+            '<think>Let me draft {"questions": []} first.</think>\n'
+            'Sure! Here are your questions:\n```json\n'
+            '{"questions": [' + good % 1 + ', {"question": "broken" "options": []}, ' + good % 2 + ', '
+            '{"question": "Q3", "options": ["A", "B"'
+        )
+        before = app_module.metric_snapshot()
+        validated = app_module.validate_questions(app_module.parse_model_json(raw))
+        self.assertEqual([q['question'] for q in validated], ['Q1', 'Q2'])
+        after = app_module.metric_snapshot()
+        self.assertEqual(after.get('model_json_salvaged', 0) - before.get('model_json_salvaged', 0), 1)
+
+        trailing_prose = '{"questions": [' + good % 1 + ']}\nHope this helps! {"note": "ignore me"}'
+        self.assertEqual(len(app_module.parse_model_json(trailing_prose)['questions']), 1)
+        self.assertEqual(app_module.parse_model_json('```json\n{"questions": []}\n```'), {'questions': []})
+        with self.assertRaises(ValueError):
+            app_module.parse_model_json('I cannot help with that.')
+
+    def build_pdf(self, content: bytes, pages: int = 1, font_encoding: str = '', image: bool = False) -> bytes:
+        writer = PdfWriter()
+        for _ in range(pages):
+            writer.add_blank_page(width=200, height=200)
+            page = writer.pages[-1]
+            resources = DictionaryObject()
+            if font_encoding:
+                font = DictionaryObject({
+                    NameObject('/Type'): NameObject('/Font'),
+                    NameObject('/Subtype'): NameObject('/Type0' if font_encoding.startswith('/Uni') else '/Type1'),
+                    NameObject('/BaseFont'): NameObject('/Helvetica'),
+                    NameObject('/Encoding'): NameObject(font_encoding),
+                })
+                resources[NameObject('/Font')] = DictionaryObject({NameObject('/F1'): writer._add_object(font)})
+            if image:
+                pixel = DecodedStreamObject()
+                pixel.set_data(b'\x00')
+                pixel.update({
+                    NameObject('/Type'): NameObject('/XObject'),
+                    NameObject('/Subtype'): NameObject('/Image'),
+                    NameObject('/Width'): NumberObject(1),
+                    NameObject('/Height'): NumberObject(1),
+                })
+                resources[NameObject('/XObject')] = DictionaryObject({NameObject('/Im1'): writer._add_object(pixel)})
+            page[NameObject('/Resources')] = resources
+            stream = DecodedStreamObject()
+            stream.set_data(content)
+            page[NameObject('/Contents')] = writer._add_object(stream)
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def test_classify_pdf_routes_text_cjk_and_scanned_documents(self) -> None:
+        text_pdf = self.build_pdf(b'BT /F1 12 Tf 10 100 Td (Cell biology) Tj ET', pages=12, font_encoding='/WinAnsiEncoding')
+        text = app_module.classify_pdf(text_pdf)
+        self.assertEqual((text['kind'], text['pages'], text['sampled_pages']), ('text', 12, 5))
+
+        cjk_pdf = self.build_pdf(b'BT /F1 12 Tf <0001> Tj ET', font_encoding='/UniGB-UCS2-H')
+        self.assertEqual(app_module.classify_pdf(cjk_pdf)['kind'], 'cjk')
+        self.assertEqual(app_module.classify_pdf(b'not a pdf')['kind'], 'unknown')
+
+        scanned_pdf = self.build_pdf(b'q 200 0 0 200 0 0 cm /Im1 Do Q', pages=3, image=True)
+        scanned = app_module.classify_pdf(scanned_pdf)
+        self.assertEqual((scanned['kind'], scanned['image_coverage']), ('image_only', 1.0))
+
+        with patch('app.pdfminer_extract_text') as mock_pdfminer, patch('app.generate_questions') as mock_generate:
+            rejected = self.client.post(
+                '/api/questions/upload',
+                data={'file': (io.BytesIO(scanned_pdf), 'scan.pdf'), 'question_count': '1', 'model_tier': 'free'},
+                content_type='multipart/form-data',
+            )
+            self.assertEqual(rejected.status_code, 400)
+            self.assertIn('scanned', rejected.get_json()['error'])
+            mock_pdfminer.assert_not_called()
+
+            mock_generate.return_value = [
+                {'question': 'Q1', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+            ]
+            accepted = self.client.post(
+                '/api/questions/upload',
+                data={'file': (io.BytesIO(scanned_pdf), 'scan.pdf'), 'question_count': '1', 'model_tier': 'pro'},
+                content_type='multipart/form-data',
+            )
+        self.assertEqual(accepted.status_code, 200)
+        self.assertEqual(accepted.get_json()['pdf_classification']['kind'], 'image_only')
+        # Sent as a file input, so there was no extracted text to normalize.
+        self.assertIsNone(accepted.get_json()['normalization'])
+        conn = app_module.get_db_connection()
+        try:
+            row = conn.execute("SELECT pdf_kind FROM uploaded_file_sources WHERE file_name = 'scan.pdf'").fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(row['pdf_kind'], 'image_only')
+
+    def test_pro_pdf_is_uploaded_once_and_referenced_by_file_id(self) -> None:
+        class LocalFileClient(ProviderFileClient):
+            provider = 'local'
+
+            def __init__(self) -> None:
+                self.uploads = []
+                self.timeouts = []
+                self.deleted = []
+
+            def upload(self, file_name, data, timeout):
+                self.uploads.append(file_name)
+                self.timeouts.append(timeout)
+                return f'file-{len(self.uploads)}'
+
+            def delete(self, file_id):
+                self.deleted.append(file_id)
+
+            def input_item(self, file_id):
+                return {'type': 'input_file', 'file_id': file_id}
+
+        client = LocalFileClient()
+        pdf_bytes = b'%PDF-1.4 lecture slides'
+        with patch('app.PROVIDER_FILE_UPLOADS', True), patch('app.provider_file_client', client):
+            with deadline_scope(5):
+                first = app_module.load_uploaded_file_content('slides.pdf', pdf_bytes)[1]
+            second = app_module.load_uploaded_file_content('slides.pdf', pdf_bytes)[1]
+            self.assertEqual(first, [{'type': 'input_file', 'file_id': 'file-1'}])
+            self.assertEqual(second, first)
+            self.assertEqual(client.uploads, ['slides.pdf'])
+            # The upload is admitted like a provider call and bounded by the request's budget.
+            self.assertLessEqual(client.timeouts[0], 5)
+            self.assertEqual(app_module.admission.snapshot()['lanes']['local/files']['in_flight'], 0)
+            self.assertGreaterEqual(app_module.admission.snapshot()['lanes']['local/files']['admitted'], 1)
+
+            with patch('app.PROVIDER_FILE_TTL_SECONDS', -1):
+                app_module.load_uploaded_file_content('other.pdf', b'%PDF-1.4 other')
+            refreshed = app_module.load_uploaded_file_content('other.pdf', b'%PDF-1.4 other')[1]
+            self.assertEqual(refreshed, [{'type': 'input_file', 'file_id': 'file-3'}])
+            self.assertEqual(client.deleted, ['file-2'])
+
+            # Maintenance deletes an expired handle's file before dropping the row.
+            with patch('app.PROVIDER_FILE_TTL_SECONDS', -1):
+                app_module.load_uploaded_file_content('stale.pdf', b'%PDF-1.4 stale')
+            self.assertEqual(app_module.purge_expired_rows(), 1)
+            self.assertEqual(client.deleted, ['file-2', 'file-4'])
+            self.assertEqual(app_module.get_provider_file_handle('local', app_module.hashlib.sha256(
+                b'%PDF-1.4 stale').hexdigest()), (None, False))
+
+            def failing_upload(file_name, data, timeout):
+                raise RuntimeError('files API down')
+
+            client.upload = failing_upload
+            fallback = app_module.load_uploaded_file_content('new.pdf', b'%PDF-1.4 new')[1]
+        self.assertTrue(fallback[0]['file_data'].startswith('data:application/pdf;base64,'))
+
+        inline = app_module.load_uploaded_file_content('slides.pdf', pdf_bytes)[1]
+        self.assertIn('file_data', inline[0])
+
+    def test_bank_export_import_round_trip_dedupes_and_filters(self) -> None:
+        self.seed_source('bio.txt', 3)
+        self.seed_source('chem.txt', 2)
+        self.client.post('/api/wrong-answer', json={
+            'question': 'Seed 0',
+            'options': ['A', 'B', 'C', 'D'],
+            'correct_index': 0,
+            'selected_index': 2,
+            'source_file': 'bio.txt',
+        })
+
+        exported = self.client.get('/api/export?compression=gzip')
+        self.assertEqual(exported.status_code, 200)
+        self.assertEqual(exported.data[:2], b'\x1f\x8b')
+        filtered = self.client.get('/api/export?source_file=chem.txt&include_sources=false').data.decode('utf-8')
+        self.assertEqual(len(filtered.strip().splitlines()), 4)
+        self.assertNotIn('file_data', filtered)
+
+        # Import into a fresh database.
+        app_module.DB_PATH = os.path.join(self.temp_dir.name, 'restored.db')
+        app_module.init_db()
+        restored = self.client.post('/api/import?source_file=bio.txt', data=exported.data)
+        self.assertEqual(restored.status_code, 200)
+        counts = restored.get_json()
+        self.assertEqual(
+            (counts['uploaded_files'], counts['generated_questions'], counts['wrong_answers'], counts['filtered']),
+            (1, 3, 1, 3),
+        )
+        self.assertEqual(app_module.get_uploaded_file_source('bio.txt'), b'hello world')
+        self.assertEqual(app_module.count_generated_questions_by_source('bio.txt'), 3)
+
+        again = self.client.post('/api/import', data=exported.data).get_json()
+        self.assertEqual((again['generated_questions'], again['duplicates']), (2, 5))
+
+        bad = self.client.post('/api/import', data=b'{"type": "generated_question"}\n')
+        self.assertEqual(bad.status_code, 400)
+
+    def test_maintenance_collects_orphaned_sources_and_shrinks_the_file(self) -> None:
+        self.seed_source('kept.txt', 1)
+        app_module.upsert_uploaded_file('orphan.pdf')
+        app_module.upsert_uploaded_file_source('orphan.pdf', os.urandom(2 * 1024 * 1024))
+        app_module.store_generated_questions(
+            ['orphan.pdf'],
+            'gpt-5.2',
+            [{'question': 'Q', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}],
+        )
+        self.assertEqual(self.client.delete('/api/favorite-collections', json={'source_file': 'orphan.pdf'}).status_code, 200)
+
+        # Within the grace period nothing is collected.
+        self.assertEqual(self.client.post('/api/maintenance/run').get_json()['orphaned_sources_removed'], 0)
+
+        with patch('app.MAINTENANCE_ORPHAN_GRACE_SECONDS', -60):
+            result = self.client.post('/api/maintenance/run').get_json()
+        self.assertEqual(result['orphaned_sources_removed'], 1)
+        self.assertGreater(result['pages_reclaimed'], 400)
+        self.assertEqual(result['database']['auto_vacuum'], 'incremental')
+        self.assertFalse(app_module.has_uploaded_file('orphan.pdf'))
+        self.assertTrue(app_module.has_uploaded_file('kept.txt'))
+        with self.assertRaises(ValueError):
+            app_module.get_uploaded_file_source('orphan.pdf')
+
+        stats = self.client.get('/api/maintenance').get_json()
+        self.assertEqual(stats['orphaned_sources_removed'], 1)
+        self.assertEqual(stats['database']['freelist_count'], 0)
+
+    @patch('app.generate_questions')
+    def test_tenants_are_routed_to_their_own_shard_files(self, mock_generate_questions) -> None:
+        mock_generate_questions.return_value = [
+            {'question': 'Q1', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+        ]
+        shard_dir = os.path.join(self.temp_dir.name, 'shards')
+        writers = HandleLRU(1, lambda writer: writer.close())
+        with patch('app.DB_SHARD_DIR', shard_dir), patch('app.db_writers', writers):
+            for tenant in ('alice', 'bob'):
+                response = self.client.post(
+                    '/api/questions/upload',
+                    data={'file': (io.BytesIO(b'hello'), 'notes.txt'), 'question_count': '1', 'model_tier': 'pro'},
+                    content_type='multipart/form-data',
+                    headers={'X-Tenant-ID': tenant},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.get_json()['coalesced'])
+            self.client.delete('/api/favorite-collections', json={'source_file': 'notes.txt'}, headers={'X-Tenant-ID': 'bob'})
+
+            alice = self.client.get('/api/favorite-collections', headers={'X-Tenant-ID': 'alice'}).get_json()
+            bob = self.client.get('/api/favorite-collections', headers={'X-Tenant-ID': 'bob'}).get_json()
+            self.assertEqual([item['source_file'] for item in alice['items']], ['notes.txt'])
+            self.assertEqual(bob['items'], [])
+            self.assertEqual(self.client.get('/api/health', headers={'X-Tenant-ID': '../etc'}).status_code, 400)
+            self.assertEqual(sorted(os.listdir(shard_dir))[:2], ['tenant-alice.db', 'tenant-bob.db'])
+            # Capacity 1: switching tenants closed the previous tenant's writer.
+            self.assertEqual(writers.snapshot()['open'], 1)
+            self.assertGreaterEqual(writers.snapshot()['evicted'], 1)
+            with tenant_context('alice'):
+                self.assertEqual(app_module.count_generated_questions_by_source('notes.txt'), 1)
+
+    def test_split_database_moves_sources_to_assigned_tenants(self) -> None:
+        self.seed_source('alice.txt', 2)
+        self.seed_source('shared.txt', 1)
+        shard_dir = os.path.join(self.temp_dir.name, 'split')
+        counts = split_database(
+            self.temp_db_path,
+            shard_dir,
+            {'alice.txt': 'alice'},
+            app_module.init_db,
+        )
+        self.assertEqual(counts['alice']['generated_questions'], 2)
+        self.assertEqual(counts['default']['generated_questions'], 1)
+        self.assertEqual(counts['default']['uploaded_file_sources'], 1)
+        with patch('app.DB_SHARD_DIR', shard_dir):
+            with tenant_context('alice'):
+                self.assertEqual(app_module.get_uploaded_file_source('alice.txt'), b'hello world')
+                self.assertFalse(app_module.has_uploaded_file('shared.txt'))
+            self.assertEqual(app_module.count_generated_questions_by_source('shared.txt'), 1)
+
+    def test_document_stats_are_kept_per_tenant(self) -> None:
+        with patch.object(app_module, 'document_stats', OrderedDict()):
+            with tenant_context('alice'):
+                app_module.normalize_document_text('notes.txt', ['Page 1\nalpha  beta'])
+                alice_stats = app_module.get_document_stats('notes.txt')
+            with tenant_context('bob'):
+                self.assertIsNone(app_module.get_document_stats('notes.txt'))
+                app_module.normalize_document_text('notes.txt', ['gamma'])
+                self.assertNotEqual(app_module.get_document_stats('notes.txt'), alice_stats)
+            with tenant_context('alice'):
+                self.assertEqual(app_module.get_document_stats('notes.txt'), alice_stats)
+
+    def test_listing_etags_differ_per_tenant_and_after_a_resplit(self) -> None:
+        self.seed_source('notes.txt', 1)
+        shard_dir = os.path.join(self.temp_dir.name, 'split')
+        split_database(self.temp_db_path, shard_dir, {}, app_module.init_db, default_tenant='alice')
+        split_database(self.temp_db_path, shard_dir, {}, app_module.init_db, default_tenant='bob')
+        with patch('app.DB_SHARD_DIR', shard_dir):
+            alice = self.client.get('/api/favorite-collections', headers={'X-Tenant-ID': 'alice'})
+            bob = self.client.get('/api/favorite-collections', headers={'X-Tenant-ID': 'bob'})
+            self.assertEqual(alice.get_json(), bob.get_json())
+            self.assertNotEqual(alice.headers['ETag'], bob.headers['ETag'])
+            self.assertIn('X-Tenant-ID', alice.headers['Vary'])
+            self.assertEqual(self.client.get('/api/favorite-collections', headers={
+                'X-Tenant-ID': 'bob', 'If-None-Match': alice.headers['ETag']}).status_code, 200)
+
+            split_database(self.temp_db_path, shard_dir, {}, app_module.init_db, default_tenant='alice')
+            resplit = self.client.get('/api/favorite-collections', headers={
+                'X-Tenant-ID': 'alice', 'If-None-Match': alice.headers['ETag']})
+            self.assertEqual(resplit.status_code, 200)
+
+    def test_serializers_agree_and_keep_cjk_unescaped(self) -> None:
+        value = {'question': '线粒体的功能？', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'n': 2 ** 70}
+        backends = [StdlibSerializer()] + ([OrjsonSerializer()] if orjson is not None else [])
+        encoded = [backend.dumps(value) for backend in backends]
+        for text in encoded:
+            self.assertIn('线粒体', text)
+            self.assertEqual(StdlibSerializer().loads(text), value)
+        self.assertEqual(len(set(encoded)), 1)
+
+        app_module.store_generated_questions(
+            ['中文.txt'],
+            'gpt-5.2',
+            [{'question': '线粒体的功能？', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}],
+        )
+        response = self.client.get('/api/generated-questions?source_file=中文.txt')
+        self.assertIn('线粒体'.encode('utf-8'), response.data)
+        self.assertEqual(response.get_json()['items'][0]['question'], '线粒体的功能？')
+
+    @patch('app.generate_questions')
+    def test_profiler_writes_rotating_profiles_and_logs_slow_requests(self, mock_generate_questions) -> None:
+        mock_generate_questions.return_value = [
+            {'question': 'Q1', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+        ]
+        profile_dir = os.path.join(self.temp_dir.name, 'profiles')
+        profiler = RequestProfiler(profile_dir=profile_dir, max_files=2, slow_ms=0.001)
+        with patch('app.request_profiler', profiler), self.assertLogs('qastudytool.slow_requests') as logs:
+            for name in ('a.txt', 'b.txt', 'c.txt'):
+                response = self.client.post(
+                    '/api/questions/upload',
+                    data={'file': (io.BytesIO(b'hello'), name), 'question_count': '1', 'model_tier': 'pro'},
+                    content_type='multipart/form-data',
+                    headers={'X-Profile': '1'},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.headers['X-Profile-Id'].endswith('.prof'))
+            listing = self.client.get('/api/generated-questions?source_file=a.txt')
+            self.assertNotIn('X-Profile-Id', listing.headers)
+            self.client.get('/api/health')
+
+        self.assertEqual(len(os.listdir(profile_dir)), 2)
+        self.assertEqual(profiler.snapshot()['profiled_requests'], 3)
+        self.assertEqual(len(logs.records), 4)
+        entry = app_module.json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], '/api/questions/upload')
+        self.assertEqual(entry['file_name'], 'a.txt')
+        self.assertTrue({'extract', 'reserve', 'generate', 'store'} <= set(entry['stages_ms']))
+        self.assertIn('query', app_module.json.loads(logs.records[3].getMessage())['stages_ms'])
+
+        # Disabled: no trace is started and stages are shared no-ops.
+        self.assertIsNone(RequestProfiler().start('GET', '/', {}))
+        self.assertIs(stage('a'), stage('b'))
+
+    def test_provider_usage_is_recorded_in_batches_and_aggregated(self) -> None:
+        question = '{"question": "Q1", "options": ["A", "B", "C", "D"], "correct_index": 0, "explanation": ""}'
+        ok = Mock(status_code=200, text='')
+        ok.json.return_value = {
+            'output_text': '{"questions": [' + question + ']}',
+            'usage': {'input_tokens': 1000, 'output_tokens': 200, 'input_tokens_details': {'cached_tokens': 400}},
+        }
+        failed = Mock(status_code=500, text='boom')
+        pricing = {'gpt-5.2': {'input': 1.0, 'cached_input': 0.5, 'output': 10.0}}
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}), \
+                patch('app.MODEL_PRICING', pricing), \
+                patch('app.requests.post', side_effect=[ok, failed]):
+            response = self.client.post(
+                '/api/questions/upload',
+                data={'file': (io.BytesIO(b'hello'), 'usage.txt'), 'question_count': '2', 'model_tier': 'pro'},
+                content_type='multipart/form-data',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(app_module.usage_recorder.stats()['pending'], 2)
+
+        report = self.client.get('/api/usage?bucket=none&group_by=source_file,status').get_json()
+        items = {item['status']: item for item in report['items']}
+        self.assertEqual(app_module.usage_recorder.stats()['pending'], 0)
+        self.assertEqual(items['ok']['source_file'], 'usage.txt')
+        self.assertEqual(items['ok']['input_tokens'], 1000)
+        self.assertEqual(items['ok']['cache_hits'], 1)
+        self.assertEqual(items['ok']['validated_questions'], 1)
+        # 600 uncached + 400 cached + 200 output tokens at the configured prices.
+        self.assertAlmostEqual(items['ok']['cost_usd'], 0.0028)
+        self.assertEqual(items['error']['retries'], 1)
+        self.assertEqual(items['error']['validated_questions'], 0)
+
+        daily = self.client.get('/api/usage?group_by=model').get_json()
+        self.assertEqual(daily['items'][0]['calls'], 2)
+        self.assertIn('bucket', daily['items'][0])
+        self.assertEqual(self.client.get('/api/usage?group_by=tenant').status_code, 400)
+
+    @patch('app.generate_questions')
+    def test_pregeneration_fills_a_notes_tree_and_resumes_from_checkpoint(self, mock_generate_questions) -> None:
+        root = os.path.join(self.temp_dir.name, 'tree')
+        os.makedirs(os.path.join(root, 'week1'))
+        for relative, text in (('intro.txt', 'intro'), ('week1/cells.txt', 'cells'), ('week1/broken.txt', 'broken')):
+            with open(os.path.join(root, relative), 'w', encoding='utf-8') as handle:
+                handle.write(text)
+        generated = iter(range(10000))
+
+        def fake_generate(text_inputs, _pdf_inputs, count, _model, model_tier='pro'):
+            if 'broken' in text_inputs[0]['text'] and mock_generate_questions.fail_broken:
+                raise RuntimeError('provider down')
+            return [
+                {'question': f'Q{next(generated)}', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+                for _ in range(count)
+            ]
+
+        mock_generate_questions.side_effect = fake_generate
+        mock_generate_questions.fail_broken = True
+        checkpoint = Checkpoint(os.path.join(self.temp_dir.name, 'checkpoint.db'))
+        lines = []
+        first = Pregenerator(app_module, checkpoint, 'gpt-5.2', batch_size=20, target=30, report=lines.append)
+        summary = first.run(root, workers=2)
+        self.assertEqual((summary['done'], summary['failed']), (2, 1))
+        self.assertEqual(summary['questions_generated'], 60)
+        self.assertEqual(summary['provider_batches'], 4)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(app_module.count_generated_questions_by_source('cells.txt'), 30)
+        self.assertTrue(app_module.has_uploaded_file('cells.txt'))
+        self.assertEqual(checkpoint.get('broken.txt')['last_error'], 'provider down')
+
+        mock_generate_questions.fail_broken = False
+        second = Pregenerator(app_module, checkpoint, 'gpt-5.2', batch_size=20, target=30, report=lines.append)
+        summary = second.run(root, workers=2)
+        self.assertEqual((summary['done'], summary['skipped'], summary['failed']), (1, 2, 0))
+        self.assertEqual(app_module.count_generated_questions_by_source('broken.txt'), 30)
+        self.assertEqual(checkpoint.get('broken.txt')['attempts'], 2)
+        self.assertEqual(checkpoint.summary(), {'done': 3})
+        checkpoint.close()
+
+    @patch('app.generate_questions')
+    def test_per_file_notes_generation_splits_counts_and_attributes_sources(self, mock_generate_questions) -> None:
+        notes_dir = os.path.join(self.temp_dir.name, 'notes')
+        os.makedirs(notes_dir)
+        for name, text in (('big.txt', 'Cells divide. ' * 1000), ('small1.txt', 'a' * 3200), ('small2.txt', 'b' * 1600)):
+            with open(os.path.join(notes_dir, name), 'w', encoding='utf-8') as handle:
+                handle.write(text)
+
+        def question(text, **extra):
+            return {'question': text, 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': '', **extra}
+
+        def fake_generate(_text_inputs, _pdf_inputs, count, _model, model_tier='pro', source_names=None):
+            if source_names:
+                self.assertEqual(source_names, ['small1.txt', 'small2.txt'])
+                return [question('S1', source='small2.txt'), question('S2'), question('S3', source='small1.txt')][:count]
+            return [question(f'B{i}') for i in range(count)]
+
+        mock_generate_questions.side_effect = fake_generate
+        response = self.client.post('/api/questions', json={
+            'question_count': 10,
+            'notes_dir': notes_dir,
+            'mode': 'per_file',
+        })
+        self.assertEqual(response.status_code, 200)
+        payload = response.get_json()
+        self.assertEqual(mock_generate_questions.call_count, 2)
+        self.assertEqual(
+            [(group['source_files'], group['question_count']) for group in payload['groups']],
+            [(['big.txt'], 7), (['small1.txt', 'small2.txt'], 3)],
+        )
+        self.assertEqual(app_module.count_generated_questions_by_source('big.txt'), 7)
+        self.assertEqual(app_module.count_generated_questions_by_source('small1.txt'), 2)
+        self.assertEqual(app_module.count_generated_questions_by_source('small2.txt'), 1)
+        stored = app_module.list_generated_questions_by_source('small2.txt')
+        self.assertEqual(stored[0]['question'], 'S1')
+        self.assertNotIn('source', stored[0])
+        self.assertEqual(
+            {q['question']: q['source_file'] for q in payload['questions'] if q['question'].startswith('S')},
+            {'S1': 'small2.txt', 'S2': 'small1.txt', 'S3': 'small1.txt'},
+        )
+
+        self.assertEqual(app_module.allocate_proportionally(5, [1, 1, 1]), [2, 2, 1])
+        tagged = app_module.validate_questions(
+            {'questions': [question('Q', source='other.txt'), question('R', source='small1.txt')]},
+            ['small1.txt', 'small2.txt'],
+        )
+        self.assertEqual([q.get('source') for q in tagged], [None, 'small1.txt'])
+        # Source tagging keeps the prompt's line-break style.
+        prompt = app_module.build_prompt(3, source_names=['small1.txt', 'small2.txt'])
+        self.assertTrue(prompt.endswith('small1.txt, small2.txt.\\n'))
+        self.assertNotIn('\n', prompt)
+
+    @patch('app.generate_questions')
+    def test_batch_upload_generates_files_concurrently(self, mock_generate_questions) -> None:
+        # Both files must be generating at the same time to pass the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fake_generate(text_inputs, _pdf_inputs, count, _model, model_tier='pro', source_names=None):
+            barrier.wait()
+            return [
+                {'question': text_inputs[0]['text'], 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+            ]
+
+        mock_generate_questions.side_effect = fake_generate
+        app_module.upsert_uploaded_file('old.txt')
+        files = [
+            (io.BytesIO(b'alpha'), 'a.txt'),
+            (io.BytesIO(b'beta'), 'b.txt'),
+            (io.BytesIO(b'old'), 'old.txt'),
+            (io.BytesIO(b''), 'empty.txt'),
+        ]
+        response = self.client.post(
+            '/api/questions/upload/batch',
+            data={'files': files, 'question_count': '1'},
+            content_type='multipart/form-data',
+        )
+        self.assertEqual(response.status_code, 200)
+        payload = response.get_json()
+        self.assertEqual([(f['file_name'], f['status']) for f in payload['files']],
+                         [('a.txt', 200), ('b.txt', 200), ('old.txt', 409), ('empty.txt', 400)])
+        self.assertEqual(payload['files'][2]['code'], 'file_exists')
+        self.assertEqual((payload['summary']['succeeded'], payload['summary']['failed']), (2, 2))
+        self.assertEqual(app_module.count_generated_questions_by_source('b.txt'), 1)
+
+        barrier.reset()
+        idle = app_module.generations_in_flight.value
+        streamed = self.client.post(
+            '/api/questions/upload/batch?stream=true',
+            data={'files': [(io.BytesIO(b'gamma'), 'c.txt'), (io.BytesIO(b'delta'), 'd.txt')], 'question_count': '1'},
+            content_type='multipart/form-data',
+            buffered=False,
+        )
+        self.assertEqual(streamed.mimetype, 'application/x-ndjson')
+        # Still generating: the request counts as in flight until the stream ends.
+        self.assertEqual(app_module.generations_in_flight.value, idle + 1)
+        lines = [app_module.json.loads(line) for line in streamed.get_data().decode('utf-8').splitlines()]
+        streamed.close()
+        self.assertEqual(app_module.generations_in_flight.value, idle)
+        self.assertEqual([line['type'] for line in lines], ['file', 'file', 'summary'])
+        self.assertEqual({line['file_name'] for line in lines[:2]}, {'c.txt', 'd.txt'})
+        self.assertEqual(lines[2]['succeeded'], 2)
+
+    def test_normalize_notes_pages_strips_boilerplate_deterministically(self) -> None:
+        pages = [
+            'CS 101 Lecture Notes\nPhotosynthesis   converts light.\nThe mito-\nchondria\n\n\n\nmakes ATP.\n1',
+            'CS 101 Lecture Notes\nEnzymes lower activation energy.\nPage 2 of 3',
+            'CS 101 Lecture Notes\n\n3',
+        ]
+        text, stats = app_module.normalize_notes_pages(pages)
+        self.assertEqual(
+            text,
+            'Photosynthesis converts light.\nThe mitochondria\n\nmakes ATP.\n\nEnzymes lower activation energy.',
+        )
+        self.assertEqual(app_module.normalize_notes_pages(pages), (text, stats))
+        self.assertEqual(stats['empty_pages_dropped'], 1)
+        self.assertEqual(stats['boilerplate_lines_removed'], 6)
+        self.assertGreater(stats['estimated_tokens_saved'], 0)
+
+        # A single page has nothing to compare against, so only page numbers go.
+        single, _ = app_module.normalize_notes_pages(['Chapter 1 Intro\nBody text\n7'])
+        self.assertEqual(single, 'Chapter 1 Intro\nBody text')
+
+    @patch('app.generate_questions')
+    def test_txt_notes_are_kept_verbatim_and_report_no_normalization(self, mock_generate_questions) -> None:
+        mock_generate_questions.return_value = [
+            {'question': 'Q1', 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+        ]
+        notes = '2024\nRevenue grew to\n42\nlong-\nterm plans'
+        text_inputs = app_module.load_uploaded_file_content('report.txt', notes.encode('utf-8'))[0]
+        self.assertEqual(text_inputs[0]['text'], f'# Source: report.txt\n{notes}')
+
+        # Stats left over from an earlier request for the same name are not reported.
+        app_module.record_document_stats('report.txt', app_module.normalize_notes_pages(['old'])[1])
+        response = self.client.post(
+            '/api/questions/upload',
+            data={'file': (io.BytesIO(notes.encode('utf-8')), 'report.txt'), 'question_count': '1'},
+            content_type='multipart/form-data',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.get_json()['normalization'])
+
+    def test_generate_questions_tops_up_a_shortfall_without_repeats(self) -> None:
+        def question(text):
+            return {'question': text, 'options': ['A', 'B', 'C', 'D'], 'correct_index': 0, 'explanation': ''}
+
+        calls = []
+
+        def fake_request_questions(
+            _text_inputs, _pdf_inputs, count, _model, model_tier='pro', avoid_questions=None, retry_count=0,
+            source_names=None,
+        ):
+            calls.append((count, avoid_questions))
+            if avoid_questions is None:
+                return [question(f'Q{i}') for i in range(7)]
+            return [question('Q0'), question('New 1'), question('New 2'), question('New 3'), question('New 4')]
+
+        with patch('app.request_questions', side_effect=fake_request_questions):
+            result = app_module.generate_questions([], [], 10, 'gpt-5.2')
+
+        self.assertEqual(len(result), 10)
+        self.assertEqual(calls[1][0], 3)
+        self.assertEqual(calls[1][1], [f'Q{i}' for i in range(7)])
+        self.assertEqual([q['question'] for q in result[7:]], ['New 1', 'New 2', 'New 3'])
+
+        with patch('app.request_questions', side_effect=[[question('Only')], RuntimeError('provider down')]):
+            self.assertEqual(len(app_module.generate_questions([], [], 5, 'gpt-5.2')), 1)
+
+    def test_concurrent_writes_are_group_committed_in_wal_mode(self) -> None:
+        conn = app_module.get_db_connection()
+        try:
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(journal_mode, 'wal')
+
+        before = app_module.db_writer_stats()
+        errors = []
+
+        def worker(index: int) -> None:
+            try:
+                for j in range(10):
+                    app_module.store_wrong_answer(
+                        source_file='concurrent.txt',
+                        question=f'Q{index}-{j}',
+                        options=['A', 'B', 'C', 'D'],
+                        correct_index=0,
+                        selected_index=1,
+                        model='gpt-5.2',
+                    )
+            except Exception as exc:  # pragma: no cover - surfaced via assertion below
+                errors.append(exc)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(app_module.list_wrong_answers_by_source('concurrent.txt', limit=500)), 160)
+        after = app_module.db_writer_stats()
+        self.assertEqual(after['writes'] - before['writes'], 160)
+        self.assertLessEqual(after['batches'] - before['batches'], 160)
+
+    def test_failed_write_job_does_not_break_the_writer(self) -> None:
+        def bad_write(conn: sqlite3.Connection) -> None:
+            conn.execute('INSERT INTO missing_table VALUES (1)')
+
+        with self.assertRaises(sqlite3.OperationalError):
+            app_module.run_write(bad_write)
+        app_module.upsert_uploaded_file('after_failure.txt')
+        self.assertTrue(app_module.has_uploaded_file('after_failure.txt'))
+
 
 if __name__ == '__main__':
     unittest.main()
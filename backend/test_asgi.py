@@ -0,0 +1,339 @@
+"""ASGI serving mode tests (no external network required)."""
+
+import asyncio
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+
+ASYNC_DEPS_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None
+    for name in ('httpx', 'starlette', 'asgiref', 'multipart')
+)
+
+
+def fake_questions(count):
+    return [
+        {
+            'question': f'Q{i+1}',
+            'options': ['A', 'B', 'C', 'D'],
+            'correct_index': 0,
+            'explanation': 'E',
+        }
+        for i in range(count)
+    ]
+
+
+@unittest.skipUnless(ASYNC_DEPS_AVAILABLE, 'requirements-async.txt is not installed')
+class AsgiApiTest(unittest.TestCase):
+    def setUp(self) -> None:
+        import httpx
+        import asgi as asgi_module
+
+        self.httpx = httpx
+        self.asgi = asgi_module
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_db_path = os.path.join(self.temp_dir.name, 'test_study_data.db')
+        self.original_db_path = app_module.DB_PATH
+        app_module.DB_PATH = self.temp_db_path
+        app_module.init_db()
+
+    def tearDown(self) -> None:
+        app_module.DB_PATH = self.original_db_path
+        self.temp_dir.cleanup()
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def make_client(self):
+        transport = self.httpx.ASGITransport(app=self.asgi.application)
+        return self.httpx.AsyncClient(transport=transport, base_url='http://testserver')
+
+    def test_flask_routes_are_delegated(self) -> None:
+        async def scenario():
+            async with self.make_client() as client:
+                return await client.get('/api/health')
+
+        response = self.run_async(scenario())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ok': True})
+
+    def test_upload_then_more_share_the_flask_store(self) -> None:
+        async def fake_agenerate(_text_inputs, _pdf_inputs, question_count, _model, model_tier='pro'):
+            return fake_questions(question_count)
+
+        async def scenario():
+            async with self.make_client() as client:
+                upload = await client.post(
+                    '/api/questions/upload',
+                    data={'question_count': '10', 'model_tier': 'pro', 'model': 'gpt-5.2'},
+                    files={'file': ('async_notes.txt', b'hello world', 'text/plain')},
+                )
+                duplicate = await client.post(
+                    '/api/questions/upload',
+                    data={'question_count': '10'},
+                    files={'file': ('async_notes.txt', b'hello again', 'text/plain')},
+                )
+                more = await client.post('/api/questions/more', json={'source_file': 'async_notes.txt'})
+                listing = await client.get('/api/favorite-collections')
+                return upload, duplicate, more, listing
+
+        with patch.object(self.asgi, 'agenerate_questions', side_effect=fake_agenerate):
+            upload, duplicate, more, listing = self.run_async(scenario())
+
+        self.assertEqual(upload.status_code, 200)
+        self.assertEqual(upload.json()['total_questions_for_source'], 10)
+        self.assertEqual(duplicate.status_code, 409)
+        self.assertEqual(duplicate.json()['code'], 'file_exists')
+        self.assertEqual(more.status_code, 200)
+        self.assertEqual(more.json()['total_questions_for_source'], 20)
+        self.assertEqual(listing.json()['items'][0]['question_count'], 20)
+
+    def test_pending_generations_do_not_block_each_other(self) -> None:
+        pending = 200
+
+        async def scenario():
+            release = asyncio.Event()
+            started = 0
+
+            async def fake_agenerate(_text_inputs, _pdf_inputs, question_count, _model, model_tier='pro'):
+                nonlocal started
+                started += 1
+                if started == pending:
+                    release.set()
+                await release.wait()
+                return fake_questions(question_count)
+
+            with patch.object(self.asgi, 'agenerate_questions', side_effect=fake_agenerate):
+                async with self.make_client() as client:
+                    responses = await asyncio.wait_for(
+                        asyncio.gather(
+                            *[
+                                client.post(
+                                    '/api/questions/upload',
+                                    data={'question_count': '1'},
+                                    files={'file': (f'n{i}.txt', b'hello', 'text/plain')},
+                                )
+                                for i in range(pending)
+                            ]
+                        ),
+                        timeout=30,
+                    )
+            return started, responses
+
+        started, responses = self.run_async(scenario())
+        self.assertEqual(started, pending)
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+
+
+    def test_batch_upload_streams_each_file_as_it_completes(self) -> None:
+        async def scenario():
+            release_slow = asyncio.Event()
+
+            async def fake_agenerate(text_inputs, _pdf_inputs, question_count, _model, model_tier='pro'):
+                if 'slow' in text_inputs[0]['text']:
+                    await release_slow.wait()
+                else:
+                    # Give the fast file time to be stored and streamed first.
+                    asyncio.get_running_loop().call_later(0.2, release_slow.set)
+                return fake_questions(question_count)
+
+            with patch.object(self.asgi, 'agenerate_questions', side_effect=fake_agenerate):
+                async with self.make_client() as client:
+                    response = await client.post(
+                        '/api/questions/upload/batch?stream=true',
+                        data={'question_count': '2'},
+                        files=[
+                            ('files', ('slow.txt', b'slow notes', 'text/plain')),
+                            ('files', ('fast.txt', b'fast notes', 'text/plain')),
+                        ],
+                    )
+            return response
+
+        response = asyncio.run(asyncio.wait_for(scenario(), timeout=10))
+        lines = [line for line in response.text.splitlines() if line]
+        self.assertEqual(len(lines), 3)
+        first, second, summary = (app_module.json.loads(line) for line in lines)
+        self.assertEqual((first['file_name'], second['file_name']), ('fast.txt', 'slow.txt'))
+        self.assertEqual(summary['succeeded'], 2)
+        self.assertEqual(app_module.count_generated_questions_by_source('slow.txt'), 2)
+
+    def test_streamed_batch_counts_as_in_flight_until_the_stream_ends(self) -> None:
+        idle = app_module.generations_in_flight.value
+        while_streaming = []
+
+        async def fake_agenerate(text_inputs, _pdf_inputs, question_count, _model, model_tier='pro'):
+            if 'slow' in text_inputs[0]['text']:
+                # By now the handler has returned and fast.txt has been streamed.
+                await asyncio.sleep(0.2)
+                while_streaming.append(app_module.generations_in_flight.value)
+            return fake_questions(question_count)
+
+        async def scenario():
+            with patch.object(self.asgi, 'agenerate_questions', side_effect=fake_agenerate):
+                async with self.make_client() as client:
+                    return await client.post(
+                        '/api/questions/upload/batch?stream=true',
+                        data={'question_count': '1'},
+                        files=[
+                            ('files', ('slow.txt', b'slow notes', 'text/plain')),
+                            ('files', ('fast.txt', b'fast notes', 'text/plain')),
+                        ],
+                    )
+
+        response = asyncio.run(asyncio.wait_for(scenario(), timeout=10))
+        self.assertEqual(len([line for line in response.text.splitlines() if line]), 3)
+        self.assertEqual(while_streaming, [idle + 1])
+        self.assertEqual(app_module.generations_in_flight.value, idle)
+
+    def test_client_disconnect_cancels_only_unshared_generations(self) -> None:
+        from deadlines import RequestCancelled, deadline_scope
+        from singleflight import AsyncSingleFlight
+
+        class DisconnectedRequest:
+            async def is_disconnected(self):
+                return True
+
+        async def scenario():
+            flights = AsyncSingleFlight()
+            cancelled = asyncio.Event()
+
+            async def abandoned():
+                try:
+                    await asyncio.sleep(30)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+
+            with deadline_scope(30) as deadline:
+                with self.assertRaises(RequestCancelled):
+                    await self.asgi.until_done_or_abandoned(DisconnectedRequest(), flights.do('gone', abandoned))
+            await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+            release = asyncio.Event()
+
+            async def shared():
+                await release.wait()
+                return 'done'
+
+            first = asyncio.ensure_future(flights.do('shared', shared))
+            second = asyncio.ensure_future(flights.do('shared', shared))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            release.set()
+            return deadline.cancelled, await second, flights.in_flight()
+
+        with patch.object(self.asgi, 'DISCONNECT_POLL_SECONDS', 0.01):
+            deadline_cancelled, second_result, in_flight = self.run_async(scenario())
+        self.assertTrue(deadline_cancelled)
+        self.assertEqual(second_result, ('done', True))
+        self.assertEqual(in_flight, 0)
+
+    def test_leader_disconnect_does_not_fail_a_coalesced_follower(self) -> None:
+        class DisconnectedRequest:
+            async def is_disconnected(self):
+                return True
+
+        async def scenario():
+            release = asyncio.Event()
+            started = 0
+
+            async def fake_agenerate(_text_inputs, _pdf_inputs, question_count, _model, model_tier='pro'):
+                nonlocal started
+                started += 1
+                await release.wait()
+                return fake_questions(question_count)
+
+            async def leader_generation(coroutine):
+                # Start the flight, let the follower join it, then report the leader's client as gone.
+                flight = asyncio.ensure_future(coroutine)
+                await asyncio.sleep(0.05)
+                return await original_until_done(DisconnectedRequest(), flight)
+
+            calls = 0
+
+            async def until_done(request, coroutine):
+                nonlocal calls
+                calls += 1
+                if calls == 1:
+                    return await leader_generation(coroutine)
+                return await original_until_done(request, coroutine)
+
+            original_until_done = self.asgi.until_done_or_abandoned
+            with patch.object(self.asgi, 'agenerate_questions', side_effect=fake_agenerate), \
+                    patch.object(self.asgi, 'until_done_or_abandoned', side_effect=until_done), \
+                    patch.object(self.asgi, 'DISCONNECT_POLL_SECONDS', 0.01):
+                async with self.make_client() as client:
+                    def upload():
+                        return client.post(
+                            '/api/questions/upload',
+                            data={'question_count': '3'},
+                            files={'file': ('shared.txt', b'shared notes', 'text/plain')},
+                        )
+
+                    leader = asyncio.ensure_future(upload())
+                    await asyncio.sleep(0.01)
+                    follower = asyncio.ensure_future(upload())
+                    await asyncio.sleep(0.2)
+                    release.set()
+                    return started, await leader, await follower
+
+        started, leader, follower = self.run_async(scenario())
+        self.assertEqual(started, 1)
+        self.assertEqual(leader.status_code, 499)
+        self.assertEqual(leader.json()['code'], 'cancelled')
+        self.assertEqual(follower.status_code, 200)
+        self.assertTrue(follower.json()['coalesced'])
+        self.assertEqual(app_module.count_generated_questions_by_source('shared.txt'), 3)
+
+    def test_a_spent_deadline_is_recorded_as_timeout_like_in_flask_mode(self) -> None:
+        from deadlines import Deadline
+        from readiness import TimedWindow
+
+        timeout_error = self.httpx.ReadTimeout('slow')
+
+        class SlowClient:
+            async def post(self, *_args, **_kwargs):
+                await asyncio.sleep(0.06)
+                raise timeout_error
+
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}), \
+                patch.object(self.asgi, 'get_http_client', return_value=SlowClient()), \
+                patch.object(app_module, 'provider_outcomes', TimedWindow(60)):
+            request = app_module.build_generation_request([{'type': 'input_text', 'text': 'notes'}], [], 1, 'gpt-5.2')
+            request['deadline'] = Deadline(0.05)
+            with self.assertRaises(app_module.DeadlineExceeded):
+                self.run_async(self.asgi.acall_provider(request))
+            self.assertEqual(app_module.provider_outcomes.values(), [])
+        app_module.usage_recorder.flush()
+        conn = app_module.get_db_connection()
+        try:
+            statuses = [row['status'] for row in conn.execute("SELECT status FROM provider_usage")]
+        finally:
+            conn.close()
+        self.assertEqual(statuses, ['timeout'])
+
+
+    def test_no_topup_call_is_started_once_the_deadline_is_spent(self) -> None:
+        from deadlines import RequestCancelled, deadline_scope
+
+        async def scenario(mock_request):
+            with deadline_scope(30) as deadline:
+                async def first_call(*_args, **_kwargs):
+                    deadline.cancel()
+                    return fake_questions(1)
+
+                mock_request.side_effect = first_call
+                await self.asgi.agenerate_questions([], [], 2, 'gpt-5.2')
+
+        with patch.object(self.asgi, 'arequest_questions') as mock_request:
+            with self.assertRaises(RequestCancelled):
+                self.run_async(scenario(mock_request))
+        self.assertEqual(mock_request.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""Hedged call and latency tracker tests (no external network required)."""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from hedging import HedgeExecutor, LatencyTracker, run_hedged, run_hedged_async
+
+
+class LatencyTrackerTest(unittest.TestCase):
+    def test_percentile_needs_min_samples_and_uses_rolling_window(self) -> None:
+        tracker = LatencyTracker(window=10, min_samples=5)
+        for value in (1, 2, 3, 4):
+            tracker.record('openai/gpt-5.2', value)
+        self.assertIsNone(tracker.percentile('openai/gpt-5.2', 0.95))
+
+        for value in range(5, 21):
+            tracker.record('openai/gpt-5.2', value)
+        # Only the last 10 samples (11..20) remain.
+        self.assertEqual(tracker.percentile('openai/gpt-5.2', 0.5), 15)
+        self.assertEqual(tracker.percentile('openai/gpt-5.2', 0.95), 20)
+        self.assertEqual(tracker.snapshot()['openai/gpt-5.2']['samples'], 10)
+
+
+class RunHedgedTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.executor = HedgeExecutor(max_workers=4)
+
+    def tearDown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def test_fast_primary_never_starts_backup(self) -> None:
+        backup_calls = []
+        result, winner = run_hedged(
+            lambda: 'primary-result',
+            lambda: backup_calls.append(1) or 'backup-result',
+            hedge_after=1.0,
+            executor=self.executor,
+        )
+        self.assertEqual((result, winner), ('primary-result', 'primary'))
+        self.assertEqual(backup_calls, [])
+
+    def test_slow_primary_is_hedged_and_backup_wins(self) -> None:
+        release = threading.Event()
+        reasons = []
+
+        def slow_primary():
+            release.wait(5)
+            return 'primary-result'
+
+        result, winner = run_hedged(
+            slow_primary,
+            lambda: 'backup-result',
+            hedge_after=0.05,
+            executor=self.executor,
+            on_hedge=reasons.append,
+        )
+        release.set()
+        self.assertEqual((result, winner), ('backup-result', 'backup'))
+        self.assertEqual(reasons, ['slow'])
+
+    def test_failed_primary_fails_over_and_invalid_backup_raises_first_error(self) -> None:
+        def broken_primary():
+            raise ValueError('No valid questions were produced by the model.')
+
+        result, winner = run_hedged(broken_primary, lambda: 'backup-result', 10, self.executor)
+        self.assertEqual((result, winner), ('backup-result', 'backup'))
+
+        def broken_backup():
+            raise RuntimeError('backup down')
+
+        with self.assertRaises(ValueError):
+            run_hedged(broken_primary, broken_backup, 10, self.executor)
+
+    def test_saturated_pool_runs_the_primary_here_and_skips_slow_hedges(self) -> None:
+        executor = HedgeExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        skipped = []
+        backup_calls = []
+
+        def backup():
+            backup_calls.append(1)
+            return 'backup-result'
+
+        # Every worker busy: no queueing, the primary runs unhedged on this thread.
+        executor.try_submit(lambda: release.wait(5))
+        caller = threading.current_thread()
+        result = run_hedged(
+            lambda: threading.current_thread() is caller, backup, 0.01, executor, on_skip=skipped.append,
+        )
+        self.assertEqual(result, (True, 'primary'))
+        release.set()
+        for _ in range(100):
+            if executor.busy == 0:
+                break
+            time.sleep(0.01)
+
+        # The primary holds the only worker, so the slow-primary backup is skipped.
+        def slow_primary():
+            time.sleep(0.1)
+            return 'primary-result'
+
+        result = run_hedged(slow_primary, backup, 0.01, executor, on_skip=skipped.append)
+        self.assertEqual(result, ('primary-result', 'primary'))
+        self.assertEqual(skipped, ['primary', 'slow'])
+        self.assertEqual(backup_calls, [])
+
+        # A failed primary still fails over, on this thread if need be.
+        def broken_primary():
+            raise ValueError('No valid questions were produced by the model.')
+
+        release.clear()
+        executor.try_submit(lambda: release.wait(5))
+        result = run_hedged(broken_primary, backup, 10, executor)
+        release.set()
+        self.assertEqual(result, ('backup-result', 'backup'))
+
+
+class RunHedgedAsyncTest(unittest.TestCase):
+    def test_losing_attempt_is_cancelled(self) -> None:
+        cancelled = []
+
+        async def slow_primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append('primary')
+                raise
+            return 'primary-result'
+
+        async def backup():
+            return 'backup-result'
+
+        async def scenario():
+            started = time.monotonic()
+            outcome = await run_hedged_async(slow_primary, backup, hedge_after=0.05)
+            await asyncio.sleep(0)
+            return outcome, time.monotonic() - started
+
+        (result, winner), elapsed = asyncio.run(scenario())
+        self.assertEqual((result, winner), ('backup-result', 'backup'))
+        self.assertEqual(cancelled, ['primary'])
+        self.assertLess(elapsed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
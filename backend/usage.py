@@ -0,0 +1,151 @@
+"""Per-call provider usage accounting.
+
+Every provider round trip produces one usage row: model, tier, input/output
+tokens from the response's `usage` block, latency, top-up retry number,
+validated question count and whether the provider served input from its
+prompt cache. Rows are buffered in memory and written in batches by a
+background thread, so accounting never adds a database write to a request.
+A failing flush drops its batch (counted in `stats`) instead of failing
+generation.
+
+The source file a call is made for is carried in a context variable, set by
+the route around `generate_questions`, so the provider layer does not need a
+new parameter at every level.
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional
+
+_current_source: ContextVar[Optional[str]] = ContextVar("usage_source", default=None)
+
+
+def current_usage_source() -> Optional[str]:
+    return _current_source.get()
+
+
+@contextmanager
+def usage_source(source_file: Optional[str]) -> Iterator[None]:
+    token = _current_source.set(source_file)
+    try:
+        yield
+    finally:
+        _current_source.reset(token)
+
+
+def parse_provider_usage(body: Dict) -> Dict[str, int]:
+    """Token counts from a Responses API or Chat Completions `usage` block."""
+    usage = body.get("usage") if isinstance(body, dict) else None
+    if not isinstance(usage, dict):
+        return {"input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0}
+    if "input_tokens" in usage:
+        details = usage.get("input_tokens_details") or {}
+        input_tokens, output_tokens = usage.get("input_tokens"), usage.get("output_tokens")
+    else:
+        details = usage.get("prompt_tokens_details") or {}
+        input_tokens, output_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return {
+        "input_tokens": int(input_tokens or 0),
+        "cached_input_tokens": int(details.get("cached_tokens") or 0) if isinstance(details, dict) else 0,
+        "output_tokens": int(output_tokens or 0),
+    }
+
+
+def estimate_cost(pricing: Dict, model: str, tokens: Dict[str, int]) -> Optional[float]:
+    """USD cost from per-million-token prices; None when the model has no price."""
+    price = pricing.get(model)
+    if not isinstance(price, dict):
+        return None
+    input_price = float(price.get("input", 0))
+    cached_price = float(price.get("cached_input", input_price))
+    uncached = max(0, tokens["input_tokens"] - tokens["cached_input_tokens"])
+    cost = (
+        uncached * input_price
+        + tokens["cached_input_tokens"] * cached_price
+        + tokens["output_tokens"] * float(price.get("output", 0))
+    )
+    return round(cost / 1_000_000, 8)
+
+
+class UsageRecorder:
+    """Buffers usage rows and hands them to `write_rows` in batches."""
+
+    def __init__(
+        self,
+        write_rows: Callable[[List[Dict]], None],
+        batch_size: int = 100,
+        flush_interval: float = 5.0,
+        max_pending: int = 10000,
+    ) -> None:
+        self._write_rows = write_rows
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._max_pending = max(self._batch_size, max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[Dict] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def record(self, row: Dict) -> None:
+        with self._lock:
+            if len(self._pending) >= self._max_pending:
+                # The writer is falling behind; keep the newest rows.
+                self._pending.pop(0)
+                self.dropped += 1
+            self._pending.append(row)
+            self.recorded += 1
+            full = len(self._pending) >= self._batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-recorder", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                self._write_rows(rows)
+            except Exception:
+                with self._lock:
+                    self.dropped += len(rows)
+                return 0
+            with self._lock:
+                self.written += len(rows)
+                self.flushes += 1
+            return len(rows)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "written": self.written,
+                "dropped": self.dropped,
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+            }